@@ -1,5 +1,6 @@
 from typing import Dict, List, Optional
 import os
+import tempfile
 from multiprocessing import Pool
 from tqdm import tqdm
 
@@ -10,6 +11,11 @@ from allensdk.brain_observatory.behavior.data_objects.stimuli.util import \
     convert_filepath_caseinsensitive
 from allensdk.brain_observatory.stimulus_info import BrainObservatoryMonitor
 
+# Number of movie frames warped together by each worker. Each frame's
+# warped and unwarped (float) arrays are held by the worker until the chunk
+# is returned, so chunks are kept small.
+MOVIE_WARP_CHUNK_SIZE = 4
+
 
 class StimulusImage:
     """Container class for image stimuli"""
@@ -47,6 +53,21 @@ class StimulusImageFactory:
         image = StimulusImage(name=name, warped=warped, unwarped=unwarped)
         return image
 
+    def from_unprocessed_stack(self, input_arrays: List[np.ndarray],
+                               names: List[str]) -> List[StimulusImage]:
+        """Creates StimulusImages from a list of unprocessed inputs. The
+        images are warped together, which is much faster than warping them
+        one at a time"""
+        if len(input_arrays) == 0:
+            return []
+        resized, unwarped = zip(*[self._get_unwarped(arr=input_array)
+                                  for input_array in input_arrays])
+        warped = self._monitor.warp_images(imgs=np.array(resized))
+        return [StimulusImage(name=name, warped=warped_image,
+                              unwarped=unwarped_image)
+                for name, warped_image, unwarped_image
+                in zip(names, warped, unwarped)]
+
     @staticmethod
     def from_processed(warped: np.ndarray, unwarped: np.ndarray,
                        name: str) -> StimulusImage:
@@ -271,12 +292,10 @@ class StimulusTemplateFactory:
         StimulusTemplate
             A StimulusTemplate object
         """
-        stimulus_images = []
-        for i, image in enumerate(images):
-            name = image_attributes[i]['image_name']
-            stimulus_image = StimulusImageFactory().from_unprocessed(
-                name=name, input_array=image)
-            stimulus_images.append(stimulus_image)
+        names = [image_attributes[i]['image_name']
+                 for i in range(len(images))]
+        stimulus_images = StimulusImageFactory().from_unprocessed_stack(
+            input_arrays=images, names=names)
         return StimulusTemplate(image_set_name=image_set_name,
                                 images=stimulus_images)
 
@@ -364,24 +383,44 @@ class StimulusMovieTemplateFactory(StimulusTemplateFactory):
         if n_workers is None:
             n_workers = os.cpu_count()
 
-        with Pool(n_workers) as worker_pool:
-            stimulus_images = list(tqdm(
-                worker_pool.imap(
-                    _movie_warper_helper,
-                    [(idx, frame) for idx, frame in enumerate(movie_frames)]
-                ),
-                total=len(movie_frames),
-                desc="Warping natural movie frames"
-            ))
+        chunks = [(start, movie_frames[start:start + MOVIE_WARP_CHUNK_SIZE])
+                  for start in range(0, len(movie_frames),
+                                     MOVIE_WARP_CHUNK_SIZE)]
+
+        # The warp operator is large, so it is built once, here, and saved
+        # for the workers to memory-map. The factory's monitor lives as
+        # long as the process, so the operator is not kept in memory.
+        geometry = StimulusMovieFrameFactory._monitor.experiment_geometry
+        with tempfile.TemporaryDirectory() as cache_dir:
+            geometry.get_warp_operator(cache_dir=cache_dir)
+            geometry.clear_warp_operator()
+
+            with Pool(n_workers, initializer=_init_movie_warper,
+                      initargs=(cache_dir,)) as worker_pool:
+                stimulus_images = []
+                with tqdm(total=len(movie_frames),
+                          desc="Warping natural movie frames") as progress:
+                    for chunk_images in worker_pool.imap(
+                            _movie_warper_helper, chunks):
+                        stimulus_images.extend(chunk_images)
+                        progress.update(len(chunk_images))
 
         return StimulusTemplate(image_set_name=movie_name,
                                 images=stimulus_images)
 
 
+def _init_movie_warper(cache_dir: str):
+    """Memory-map the warp operator saved in cache_dir"""
+    StimulusMovieFrameFactory._monitor.experiment_geometry.get_warp_operator(
+        cache_dir=cache_dir, mmap_mode="r")
+
+
 def _movie_warper_helper(*args):
     """
-    Simple helper wrapping the stimulus movie frame factory.
+    Simple helper wrapping the stimulus movie frame factory. Warps a chunk
+    of consecutive frames, named by their index in the movie.
     """
-    name, frame = args[0]
-    return StimulusMovieFrameFactory().from_unprocessed(
-        name=name, input_array=frame)
+    start, frames = args[0]
+    return StimulusMovieFrameFactory().from_unprocessed_stack(
+        input_arrays=frames,
+        names=list(range(start, start + len(frames))))
@@ -1,9 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
 import numpy as np
-from scipy import stats
+from scipy import signal, sparse, stats
+
+
+def _time_chunks(n_frames: int, chunk_size: int):
+    """Yield (start, stop) frame bounds of consecutive time chunks"""
+    for start in range(0, n_frames, chunk_size):
+        yield start, min(start + chunk_size, n_frames)
+
+
+def _map_chunks(func, chunks, num_workers: int):
+    """Apply func to each chunk, on a thread pool if num_workers > 1"""
+    if num_workers > 1:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            return list(executor.map(func, chunks))
+    return [func(chunk) for chunk in chunks]
 
 
 def filter_events_array(arr: np.ndarray, scale: float = 2,
-                        n_time_steps: int = 20) -> np.ndarray:
+                        n_time_steps: int = 20,
+                        chunk_size: int = 10000,
+                        num_workers: int = 1,
+                        out: Optional[np.ndarray] = None) -> np.ndarray:
     """
     Convolve the trace array with a 1d causal half-gaussian filter
     to smooth it for visualization
@@ -12,6 +32,11 @@ def filter_events_array(arr: np.ndarray, scale: float = 2,
 
     Modified from initial implementation by Nick Ponvert
 
+    All traces are filtered together, one chunk of time at a time. Each
+    chunk is read with the n_time_steps - 1 preceding frames it depends
+    on, so `arr` may be a memory-mapped or HDF5-backed array that is never
+    loaded in full.
+
     Parameters
     ----------
     arr: np.ndarray
@@ -20,6 +45,13 @@ def filter_events_array(arr: np.ndarray, scale: float = 2,
         std deviation of halfnorm distribution in units of timesteps
     n_time_steps: int
         number of time steps to use for the convolution operation
+    chunk_size: int
+        number of frames filtered at once
+    num_workers: int
+        number of threads filtering chunks in parallel
+    out: np.ndarray
+        Optional (possibly memory-mapped) n traces x n frames array in which
+        to store the output
 
     Returns
     ----------
@@ -33,9 +65,73 @@ def filter_events_array(arr: np.ndarray, scale: float = 2,
         raise ValueError(f'n_time_steps must be a minimum of 1 but received '
                          f'{n_time_steps}')
 
+    if chunk_size < 1:
+        raise ValueError(f'chunk_size must be a minimum of 1 but received '
+                         f'{chunk_size}')
+
     filt = stats.halfnorm(loc=0, scale=scale).pdf(np.arange(n_time_steps))
     filt = filt / np.sum(filt)  # normalize filter
-    filtered_arr = np.zeros(arr.shape)
-    for i, trace in enumerate(arr):
-        filtered_arr[i] = np.convolve(arr[i], filt)[:len(arr[i])]
-    return filtered_arr
+
+    if out is None:
+        out = np.zeros(arr.shape)
+    elif out.shape != arr.shape:
+        raise ValueError(f'out has shape {out.shape} but arr has shape '
+                         f'{arr.shape}')
+
+    overlap = n_time_steps - 1
+
+    def filter_chunk(bounds):
+        start, stop = bounds
+        padded_start = max(start - overlap, 0)
+        chunk = np.asarray(arr[:, padded_start:stop], dtype=float)
+        filtered = signal.lfilter(filt, 1, chunk, axis=1)
+        out[:, start:stop] = filtered[:, start - padded_start:]
+
+    _map_chunks(filter_chunk, _time_chunks(arr.shape[1], chunk_size),
+                num_workers)
+    return out
+
+
+def sparse_events_array(arr: np.ndarray,
+                        chunk_size: int = 10000,
+                        num_workers: int = 1) -> sparse.csr_matrix:
+    """
+    Compress an events array, which is zero except at detected events,
+    into a sparse matrix holding only the event frames and magnitudes
+
+    Parameters
+    ----------
+    arr: np.ndarray
+        Event matrix of dimension n traces x n frames. May be a
+        memory-mapped or HDF5-backed array; it is read one chunk of time
+        at a time
+    chunk_size: int
+        number of frames read at once
+    num_workers: int
+        number of threads reading chunks in parallel
+
+    Returns
+    ----------
+    sparse.csr_matrix:
+        n traces x n frames matrix of event magnitudes
+    """
+    if len(arr.shape) == 1:
+        raise ValueError('Expected a 2d array but received a 1d array')
+
+    if chunk_size < 1:
+        raise ValueError(f'chunk_size must be a minimum of 1 but received '
+                         f'{chunk_size}')
+
+    def compress_chunk(bounds):
+        start, stop = bounds
+        chunk = np.asarray(arr[:, start:stop])
+        traces, frames = np.nonzero(chunk)
+        return traces, frames + start, chunk[traces, frames]
+
+    chunks = _map_chunks(compress_chunk,
+                         _time_chunks(arr.shape[1], chunk_size), num_workers)
+    if len(chunks) == 0:
+        return sparse.csr_matrix(arr.shape, dtype=arr.dtype)
+
+    traces, frames, magnitudes = (np.concatenate(x) for x in zip(*chunks))
+    return sparse.csr_matrix((magnitudes, (traces, frames)), shape=arr.shape)
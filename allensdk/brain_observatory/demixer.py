@@ -33,12 +33,15 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
-from typing import Tuple, Optional
+from typing import Tuple, Optional, List
 import os
+import itertools
 import logging
+import multiprocessing as mp
 
 import numpy as np
 import scipy.sparse as sparse
+import scipy.sparse.csgraph as csgraph
 import scipy.linalg as linalg
 import matplotlib.pyplot as plt
 import matplotlib.colors as colors
@@ -101,6 +104,11 @@ def _demix_point(source_frame: np.ndarray, mask_traces: np.ndarray,
     weighted_masks = norm_mat.dot(source_mask_projection)
     # cast to dense numpy array for linear solver because solution is dense
     overlap = flat_masks.dot(weighted_masks.T).toarray()
+    return _solve_overlap(overlap, mask_weighted_trace)
+
+
+def _solve_overlap(overlap: np.ndarray,
+                   mask_weighted_trace: np.ndarray) -> np.ndarray:
     try:
         demix_traces = linalg.solve(overlap, mask_weighted_trace)
     except linalg.LinAlgError:
@@ -110,9 +118,136 @@ def _demix_point(source_frame: np.ndarray, mask_traces: np.ndarray,
     return demix_traces
 
 
+class _OverlapComponent:
+    """A connected set of overlapping masks, which are demixed jointly.
+
+    Attributes
+    ==========
+    mask_indices: indices of the component's masks
+    pixel_indices: indices (into the pixels covered by any mask) of the
+        pixels covered by the component's masks
+    masks: dense masks of shape (k, p) over those pixels
+    pair_products: sparse (k * k, p) products of pairs of masks, where row
+        i * k + j is mask_i * mask_j
+    """
+    def __init__(self, mask_indices: np.ndarray, pixel_indices: np.ndarray,
+                 masks: np.ndarray):
+        self.mask_indices = mask_indices
+        self.pixel_indices = pixel_indices
+        self.masks = masks
+        sparse_masks = sparse.csr_matrix(masks)
+        self.pair_products = sparse.vstack(
+            [sparse_masks.multiply(mask) for mask in masks], format="csr")
+
+
+def _overlap_components(flat_masks: sparse.csr_matrix,
+                        mask_pixels: np.ndarray) -> List[_OverlapComponent]:
+    """
+    Partition masks into connected components of the mask overlap graph
+    (two masks are connected if they share a pixel).
+
+    Parameters
+    ==========
+    flat_masks: sparse (n, HxW) masks
+    mask_pixels: flat indices of the pixels covered by any mask
+
+    Returns
+    =======
+    The overlap components, in order of their first mask
+    """
+    support = (flat_masks != 0).astype(np.int64)
+    num_components, labels = csgraph.connected_components(
+        support.dot(support.T), directed=False)
+
+    covered_masks = flat_masks[:, mask_pixels]
+    components = []
+    for label in range(num_components):
+        mask_indices = np.flatnonzero(labels == label)
+        component_masks = covered_masks[mask_indices]
+        pixel_indices = np.flatnonzero(component_masks.getnnz(axis=0))
+        components.append(_OverlapComponent(
+            mask_indices, pixel_indices,
+            component_masks[:, pixel_indices].toarray().astype(float)))
+    return components
+
+
+def _demix_block(source_block: np.ndarray, trace_block: np.ndarray,
+                 components: List[_OverlapComponent],
+                 pixels_per_mask: np.ndarray
+                 ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Demix a block of frames, solving the overlap systems of all frames of
+    a component at once.
+
+    Parameters
+    ==========
+    source_block: movie values of the pixels covered by any mask, of
+        shape (t, p)
+    trace_block: mask traces, of shape (n, t)
+    components: overlap components of the masks
+    pixels_per_mask: Number of pixels for each mask (1d-array of length `n`)
+
+    Returns
+    =======
+    Demixed traces of shape (n, t) (zero for dropped frames) and whether
+    each frame was dropped because some mask trace is zero.
+    """
+    mask_weighted_traces = trace_block * pixels_per_mask[:, np.newaxis]
+    drop_frames = (mask_weighted_traces == 0).any(axis=0)
+    keep_frames = np.flatnonzero(~drop_frames)
+
+    demix_traces = np.zeros(trace_block.shape)
+    if keep_frames.size == 0:
+        return demix_traces, drop_frames
+
+    source_block = source_block[keep_frames]
+    for component in components:
+        source = source_block[:, component.pixel_indices]
+        # (t, k) weighted traces; the right hand side of each frame's system
+        weighted = \
+            mask_weighted_traces[component.mask_indices][:, keep_frames].T
+        norm = pixels_per_mask[component.mask_indices] / weighted
+
+        if len(component.mask_indices) == 1:
+            # a mask without overlaps: the system is a scalar
+            overlap = source.dot(component.masks[0] ** 2) * norm[:, 0]
+            demixed = weighted / overlap[:, np.newaxis]
+        else:
+            # overlap[t, i, j] = sum(mask_i * mask_j * source_t) * norm_tj,
+            # without a (t, k, p) temporary
+            k = len(component.mask_indices)
+            overlap = component.pair_products.dot(source.T).T.reshape(
+                -1, k, k) * norm[:, np.newaxis, :]
+            try:
+                demixed = np.linalg.solve(
+                    overlap, weighted[:, :, np.newaxis])[:, :, 0]
+            except np.linalg.LinAlgError:
+                demixed = np.array([
+                    _solve_overlap(frame_overlap, frame_weighted)
+                    for frame_overlap, frame_weighted in zip(overlap, weighted)
+                ])
+        demix_traces[np.ix_(component.mask_indices, keep_frames)] = demixed.T
+
+    return demix_traces, drop_frames
+
+
+_worker_components = None
+
+
+def _init_demix_worker(components, pixels_per_mask):
+    global _worker_components
+    _worker_components = (components, pixels_per_mask)
+
+
+def _demix_worker_block(args):
+    source_block, trace_block = args
+    return _demix_block(source_block, trace_block, *_worker_components)
+
+
 def demix_time_dep_masks(raw_traces: np.ndarray, stack: np.ndarray,
                          masks: np.ndarray,
-                         max_block_size: int = 1000) -> Tuple[np.ndarray, list]:
+                         max_block_size: int = 1000,
+                         num_workers: int = 1) -> Tuple[np.ndarray, list]:
     """
     Demix traces of potentially overlapping masks extraced from a single
     2p recording.
@@ -127,6 +262,8 @@ def demix_time_dep_masks(raw_traces: np.ndarray, stack: np.ndarray,
         an individual frame in the movie `stack`.
     :max_block_size: int representing maximum number of movie frames to read
         at a time (-1 for full length `t` of `stack`) (the default is 1000)
+    :param num_workers: number of processes demixing blocks of frames
+        (the default is 1, demixing in this process)
     :return: Tuple of demixed traces and whether each frame was skipped
         in the demixing calculation.
     """
@@ -146,24 +283,42 @@ def demix_time_dep_masks(raw_traces: np.ndarray, stack: np.ndarray,
     flat_masks = masks.reshape(N, P)
     flat_masks = sparse.csr_matrix(flat_masks)
 
-    drop_frames = []
-    demix_traces = np.zeros((N, T))
-
-    for t in range(T):
+    # only pixels inside some mask contribute to the overlap systems
+    mask_pixels = np.flatnonzero(flat_masks.getnnz(axis=0))
+    components = _overlap_components(flat_masks, mask_pixels)
+
+    def blocks():
+        for t in range(0, T, max_block_size):
+            block_T = min(T - t, max_block_size)
+            stack_block = stack[t: t+block_T].reshape(block_T, P)
+            yield stack_block[:, mask_pixels], raw_traces[:, t: t+block_T]
+
+    if num_workers > 1 and T > max_block_size:
+        results = []
+        with mp.Pool(num_workers, initializer=_init_demix_worker,
+                     initargs=(components, num_pixels_in_mask)) as pool:
+            # read only as many blocks as there are workers at a time
+            block_iter = blocks()
+            while True:
+                worker_blocks = list(itertools.islice(block_iter, num_workers))
+                if not worker_blocks:
+                    break
+                results.extend(pool.map(_demix_worker_block, worker_blocks))
+    else:
+        results = [
+            _demix_block(source_block, trace_block, components,
+                         num_pixels_in_mask)
+            for source_block, trace_block in blocks()
+        ]
 
-        block_t = t % max_block_size
-        if block_t == 0:  # load next block into memory and reshape
-            block_T = np.min([(T - t), max_block_size])
-            stack_block = stack[t : t+block_T].reshape(block_T, P)
+    demix_traces = np.zeros((N, T))
+    drop_frames = []
+    t = 0
+    for block_traces, block_drop_frames in results:
+        demix_traces[:, t: t+block_traces.shape[1]] = block_traces
+        drop_frames.extend(block_drop_frames.tolist())
+        t += block_traces.shape[1]
 
-        demixed_point = _demix_point(
-            stack_block[block_t], raw_traces[:, t], flat_masks,
-            num_pixels_in_mask)
-        if demixed_point is not None:
-            demix_traces[:, t] = demixed_point
-            drop_frames.append(False)
-        else:
-            drop_frames.append(True)
     return demix_traces, drop_frames
 
 
@@ -33,12 +33,11 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
-from .stimulus_analysis import StimulusAnalysis
+from .stimulus_analysis import StimulusAnalysis, level_index
 import scipy.stats as st
 import pandas as pd
 import numpy as np
 import h5py
-from math import sqrt
 import logging
 from . import observatory_plots as oplots
 from . import circle_plots as cplots
@@ -122,30 +121,19 @@ class DriftingGratings(StimulusAnalysis):
         '''
         DriftingGratings._log.info("Calculating mean responses")
 
-        response = np.empty(
-            (self.number_ori, self.number_tf, self.numbercells + 1, 3))
+        ori_index = level_index(self.stim_table.orientation.values,
+                                self.orivals)
+        tf_index = level_index(self.stim_table.temporal_frequency.values,
+                               self.tfvals)
+        condition_index = np.where((ori_index >= 0) & (tf_index >= 0),
+                                   ori_index * self.number_tf + tf_index, -1)
+
+        response = self.get_condition_response(
+            condition_index, self.number_ori * self.number_tf,
+            p_threshold=0.05 / (8 * 5))
 
-        def ptest(x):
-            if x.empty:
-                return np.nan
-            return len(np.where(x < (0.05 / (8 * 5)))[0])
-
-        for ori in self.orivals:
-            ori_pt = np.where(self.orivals == ori)[0][0]
-            for tf in self.tfvals:
-                tf_pt = np.where(self.tfvals == tf)[0][0]
-                subset_response = self.mean_sweep_response[
-                    (self.stim_table.temporal_frequency == tf) & (
-                                self.stim_table.orientation == ori)]
-                subset_pval = self.pval[
-                    (self.stim_table.temporal_frequency == tf) & (
-                            self.stim_table.orientation == ori)]
-                response[ori_pt, tf_pt, :, 0] = subset_response.mean(axis=0)
-                response[ori_pt, tf_pt, :, 1] = subset_response.std(
-                    axis=0) / sqrt(len(subset_response))
-                response[ori_pt, tf_pt, :, 2] = subset_pval.apply(
-                    ptest, axis=0)
-        return response
+        return response.reshape(
+            (self.number_ori, self.number_tf, self.numbercells + 1, 3))
 
     def get_peak(self):
         ''' Computes metrics related to each cell's peak response condition.
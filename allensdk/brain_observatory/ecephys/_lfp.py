@@ -1,4 +1,9 @@
+import dataclasses
+from typing import Optional, Tuple
+
 import numpy as np
+from hdmf.backends.hdf5 import H5DataIO
+from hdmf.data_utils import GenericDataChunkIterator
 from xarray import DataArray
 
 from allensdk.brain_observatory.ecephys.file_io.continuous_file import \
@@ -6,6 +11,162 @@ from allensdk.brain_observatory.ecephys.file_io.continuous_file import \
 from allensdk.core import DataObject, JsonReadableInterface
 
 
+# Target size of a single HDF5 chunk of LFP data. HDF5 recommends chunks
+# no larger than 1 MB for good chunk cache behavior
+DEFAULT_LFP_CHUNK_BYTES = 2 ** 20
+
+# gzip level used unless LFPWriteOptions.compression_opts is given
+DEFAULT_LFP_GZIP_LEVEL = 4
+
+
+@dataclasses.dataclass
+class LFPWriteOptions:
+    """
+    Options controlling how LFP (and CSD) data are laid out on disk when
+    written to NWB
+
+    Attributes:
+
+    - chunk_shape --> (time samples, channels) shape of each HDF5 chunk. If
+    None, chunks span all channels and as many time samples as fit in
+    `DEFAULT_LFP_CHUNK_BYTES`, which suits reads of time windows across the
+    whole probe.
+    - compression --> HDF5 compression filter. One of "gzip", "lzf" or None
+    (no compression)
+    - compression_opts --> Options for the compression filter (the gzip
+    level). If None, gzip uses `DEFAULT_LFP_GZIP_LEVEL`. Must be None for
+    other filters
+    - buffer_gb --> Maximum amount of LFP data (in GB) read from the raw
+    file and held in memory at once while writing
+    """
+    chunk_shape: Optional[Tuple[int, int]] = None
+    compression: Optional[str] = 'gzip'
+    compression_opts: Optional[int] = None
+    buffer_gb: float = 1.0
+
+    def __post_init__(self):
+        if self.compression != 'gzip' and self.compression_opts is not None:
+            raise ValueError(
+                f"compression_opts must be None for compression "
+                f"{self.compression!r}, got {self.compression_opts!r}")
+
+    def wrap_data(self, data) -> H5DataIO:
+        """Wraps `data` in an `H5DataIO` using these compression options"""
+        if self.compression is None:
+            return H5DataIO(data=data)
+        compression_opts = self.compression_opts
+        if self.compression == 'gzip' and compression_opts is None:
+            compression_opts = DEFAULT_LFP_GZIP_LEVEL
+        return H5DataIO(
+            data=data,
+            compression=self.compression,
+            compression_opts=compression_opts
+        )
+
+
+def scale_lfp_data(
+        data: np.ndarray,
+        amplitude_scale_factor: Optional[float] = None
+) -> np.ndarray:
+    """Converts raw LFP samples to Volts
+
+    Parameters
+    ----------
+    data:
+        raw LFP samples (time samples X channels)
+    amplitude_scale_factor:
+        amplitude scale factor converting raw amplitudes to Volts. If None,
+        `data` is assumed to already be scaled and is returned as is
+
+    Returns
+    -------
+    float32 LFP data in Volts
+    """
+    if amplitude_scale_factor is None:
+        return data
+    data = data.astype(np.float32)
+    return data * amplitude_scale_factor
+
+
+class LFPDataChunkIterator(GenericDataChunkIterator):
+    """Streams LFP data from a (typically memory-mapped) raw array into an
+    NWB file buffer by buffer, scaling each buffer to Volts as it is read,
+    so that the full float32 LFP array never needs to be held in memory"""
+    def __init__(
+            self,
+            data: np.ndarray,
+            amplitude_scale_factor: Optional[float] = None,
+            chunk_shape: Optional[Tuple[int, int]] = None,
+            buffer_gb: float = 1.0
+    ):
+        """
+
+        Parameters
+        ----------
+        data:
+            raw LFP samples (time samples X channels)
+        amplitude_scale_factor:
+            amplitude scale factor converting raw amplitudes to Volts. If
+            None, `data` is written unscaled
+        chunk_shape:
+            (time samples, channels) shape of each HDF5 chunk. See
+            `LFPWriteOptions`
+        buffer_gb:
+            maximum size (in GB) of each buffer read from `data`
+        """
+        self._lfp_data = data
+        self._amplitude_scale_factor = amplitude_scale_factor
+
+        chunk_shape = self._get_lfp_chunk_shape(chunk_shape=chunk_shape)
+        super().__init__(
+            chunk_shape=chunk_shape,
+            buffer_shape=self._get_lfp_buffer_shape(
+                chunk_shape=chunk_shape, buffer_gb=buffer_gb)
+        )
+
+    def _get_lfp_chunk_shape(
+            self,
+            chunk_shape: Optional[Tuple[int, int]] = None
+    ) -> Tuple[int, int]:
+        n_samples, n_channels = self._lfp_data.shape
+        if chunk_shape is None:
+            row_bytes = max(1, n_channels * self._get_dtype().itemsize)
+            chunk_shape = (DEFAULT_LFP_CHUNK_BYTES // row_bytes, n_channels)
+        return (
+            int(max(1, min(chunk_shape[0], n_samples))),
+            int(max(1, min(chunk_shape[1], n_channels)))
+        )
+
+    def _get_lfp_buffer_shape(
+            self,
+            chunk_shape: Tuple[int, int],
+            buffer_gb: float
+    ) -> Tuple[int, int]:
+        # Buffers span all channels and a whole number of chunks in time, so
+        # that every chunk is written exactly once
+        n_samples, n_channels = self._lfp_data.shape
+        row_bytes = max(1, n_channels * self._get_dtype().itemsize)
+        chunks_per_buffer = max(
+            1, int(buffer_gb * 1e9) // (row_bytes * chunk_shape[0]))
+        return (
+            int(max(1, min(chunks_per_buffer * chunk_shape[0], n_samples))),
+            int(max(1, n_channels))
+        )
+
+    def _get_data(self, selection: Tuple[slice]) -> np.ndarray:
+        return scale_lfp_data(
+            data=np.asarray(self._lfp_data[selection]),
+            amplitude_scale_factor=self._amplitude_scale_factor)
+
+    def _get_maxshape(self) -> Tuple[int, int]:
+        return self._lfp_data.shape
+
+    def _get_dtype(self) -> np.dtype:
+        if self._amplitude_scale_factor is None:
+            return np.dtype(self._lfp_data.dtype)
+        return np.dtype(np.float32)
+
+
 class LFP(DataObject, JsonReadableInterface):
     """
     Probe LFP
@@ -15,7 +176,8 @@ class LFP(DataObject, JsonReadableInterface):
             data: np.ndarray,
             timestamps: np.ndarray,
             channels: np.ndarray,
-            sampling_rate: float
+            sampling_rate: float,
+            amplitude_scale_factor: Optional[float] = None
     ):
         """
 
@@ -29,16 +191,25 @@ class LFP(DataObject, JsonReadableInterface):
             LFP channels
         sampling_rate
             LFP sampling rate
+        amplitude_scale_factor
+            If not None, `data` holds raw (unscaled) samples, which are
+            converted to Volts using this factor only when needed
         """
         super().__init__(name='lfp', value=None, is_value_self=True)
         self._data = data
         self._timestamps = timestamps
         self._channels = channels
         self._sampling_rate = sampling_rate
+        self._amplitude_scale_factor = amplitude_scale_factor
+        self._scaled_data = None
 
     @property
     def data(self) -> np.ndarray:
-        return self._data
+        if self._scaled_data is None:
+            self._scaled_data = scale_lfp_data(
+                data=self._data,
+                amplitude_scale_factor=self._amplitude_scale_factor)
+        return self._scaled_data
 
     @property
     def timestamps(self) -> np.ndarray:
@@ -70,7 +241,8 @@ class LFP(DataObject, JsonReadableInterface):
 
         Returns
         -------
-        `LFP` instance
+        `LFP` instance. The raw data file is memory-mapped and only scaled
+        to Volts when `data` is accessed or as it is written to NWB
         """
         lfp_meta = probe_meta['lfp']
         lfp_channels = np.load(lfp_meta['input_channels_path'],
@@ -80,11 +252,7 @@ class LFP(DataObject, JsonReadableInterface):
             data_path=lfp_meta['input_data_path'],
             timestamps_path=lfp_meta['input_timestamps_path'],
             total_num_channels=len(lfp_channels)
-        ).load(memmap=False)
-
-        lfp_data = lfp_data.astype(np.float32)
-        lfp_data = lfp_data * probe_meta.get("amplitude_scale_factor",
-                                             amplitude_scale_factor)
+        ).load(memmap=True)
 
         sampling_rate = (
                 probe_meta['lfp_sampling_rate'] /
@@ -94,13 +262,48 @@ class LFP(DataObject, JsonReadableInterface):
             data=lfp_data,
             timestamps=lfp_timestamps,
             channels=lfp_channels,
-            sampling_rate=sampling_rate
+            sampling_rate=sampling_rate,
+            amplitude_scale_factor=probe_meta.get("amplitude_scale_factor",
+                                                  amplitude_scale_factor)
+        )
+
+    def to_nwb_data(
+            self,
+            write_options: Optional[LFPWriteOptions] = None
+    ) -> H5DataIO:
+        """Returns the LFP data wrapped for chunked, compressed, iterative
+        writing to NWB
+
+        Parameters
+        ----------
+        write_options:
+            Chunking/compression options. Defaults to `LFPWriteOptions()`
+
+        Returns
+        -------
+        `H5DataIO` wrapping an `LFPDataChunkIterator`
+        """
+        if write_options is None:
+            write_options = LFPWriteOptions()
+
+        if self._scaled_data is not None:
+            data, amplitude_scale_factor = self._scaled_data, None
+        else:
+            data, amplitude_scale_factor = \
+                self._data, self._amplitude_scale_factor
+
+        iterator = LFPDataChunkIterator(
+            data=data,
+            amplitude_scale_factor=amplitude_scale_factor,
+            chunk_shape=write_options.chunk_shape,
+            buffer_gb=write_options.buffer_gb
         )
+        return write_options.wrap_data(data=iterator)
 
     def to_dataarray(self) -> DataArray:
         return DataArray(
             name="LFP",
-            data=self._data,
+            data=self.data,
             dims=['time', 'channel'],
             coords=[self._timestamps, self._channels]
         )
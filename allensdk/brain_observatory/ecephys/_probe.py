@@ -16,7 +16,7 @@ from allensdk.brain_observatory.ecephys._channels import Channels
 from allensdk.brain_observatory.ecephys._current_source_density import \
     CurrentSourceDensity
 from allensdk.brain_observatory.ecephys._units import Units
-from allensdk.brain_observatory.ecephys._lfp import LFP
+from allensdk.brain_observatory.ecephys._lfp import LFP, LFPWriteOptions
 from allensdk.brain_observatory.ecephys.nwb import EcephysCSD
 from allensdk.brain_observatory.ecephys.nwb_util import add_probe_to_nwbfile, \
     add_ecephys_electrodes
@@ -282,10 +282,33 @@ class Probe(DataObject, JsonReadableInterface, NwbWritableInterface,
             self,
             session_id: str,
             session_start_time: datetime,
-            session_metadata: BehaviorEcephysMetadata
+            session_metadata: BehaviorEcephysMetadata,
+            write_options: Optional[LFPWriteOptions] = None
     ):
+        """
+
+        Parameters
+        ----------
+        session_id:
+            Session id
+        session_start_time:
+            Session start time
+        session_metadata:
+            Session metadata
+        write_options:
+            Chunking/compression options used for the LFP and CSD data.
+            Defaults to `LFPWriteOptions()`. LFP data are streamed into the
+            file buffer by buffer rather than loaded into memory at once
+
+        Returns
+        -------
+        `NWBFile` containing LFP (and CSD if present) for this probe
+        """
         logging.info(f'writing lfp file for probe {self._id}')
 
+        if write_options is None:
+            write_options = LFPWriteOptions()
+
         nwbfile = pynwb.NWBFile(
             session_description='LFP data and associated info for one probe',
             identifier=f"{self._id}",
@@ -309,14 +332,15 @@ class Probe(DataObject, JsonReadableInterface, NwbWritableInterface,
 
         nwbfile.add_acquisition(lfp_nwb.create_electrical_series(
             name=f"probe_{self._id}_lfp_data",
-            data=self._lfp.data,
+            data=self._lfp.to_nwb_data(write_options=write_options),
             timestamps=self._lfp.timestamps,
             electrodes=electrode_table_region
         ))
         nwbfile.add_acquisition(lfp_nwb)
 
         if self._current_source_density is not None:
-            nwbfile = self._add_csd_to_nwb(nwbfile=nwbfile)
+            nwbfile = self._add_csd_to_nwb(nwbfile=nwbfile,
+                                           write_options=write_options)
 
         return nwbfile
 
@@ -324,7 +348,8 @@ class Probe(DataObject, JsonReadableInterface, NwbWritableInterface,
             self,
             nwbfile: NWBFile,
             csd_unit: str = 'V/cm^2',
-            position_unit: str = "um"
+            position_unit: str = "um",
+            write_options: Optional[LFPWriteOptions] = None
     ):
         """
 
@@ -336,12 +361,17 @@ class Probe(DataObject, JsonReadableInterface, NwbWritableInterface,
             Units of CSD data, by default "V/cm^2"
         position_unit:
             Units of virtual channel locations, by default "um" (micrometer)
+        write_options:
+            Compression options for the CSD data. Defaults to
+            `LFPWriteOptions()`
 
         Returns
         -------
         `NWBFile` with csd added
         """
         csd = self._current_source_density
+        if write_options is None:
+            write_options = LFPWriteOptions()
 
         csd_mod = pynwb.ProcessingModule("current_source_density",
                                          "Precalculated current source "
@@ -350,7 +380,7 @@ class Probe(DataObject, JsonReadableInterface, NwbWritableInterface,
 
         csd_ts = pynwb.base.TimeSeries(
             name="current_source_density",
-            data=csd.data.T,
+            data=write_options.wrap_data(data=csd.data.T),
             # TimeSeries should have data in (time x channels) format
             timestamps=csd.timestamps.T,
             unit=csd_unit
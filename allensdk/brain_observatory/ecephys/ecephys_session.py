@@ -9,6 +9,7 @@ import scipy.stats
 import xarray as xr
 
 from allensdk.core.utilities import literal_col_eval, df_list_to_tuple
+from allensdk.brain_observatory.interval_set import IntervalSet
 from allensdk.brain_observatory.ecephys.ecephys_session_api import (
     EcephysNwb1Api,
     EcephysNwbSessionApi,
@@ -395,7 +396,7 @@ class EcephysSession(LazyPropertyMixin):
             probe_name = self.probes.loc[probe_id]["description"]
             fail_tags = ["all_probes", probe_name]
             invalid_time_intervals = \
-                self._filter_invalid_times_by_tags(fail_tags)
+                self._get_invalid_interval_set(fail_tags)
             lfp = self.api.get_lfp(probe_id)
             time_points = lfp.time
             valid_time_points = \
@@ -406,25 +407,30 @@ class EcephysSession(LazyPropertyMixin):
             return self.api.get_lfp(probe_id)
 
     def _get_valid_time_points(self, time_points, invalid_time_intevals):
+        """
+        Parameters
+        ----------
+        time_points: array-like
+            times to check
+        invalid_time_intevals: IntervalSet or pd.DataFrame
+            invalid intervals
+
+        Returns
+        -------
+        xr.DataArray of booleans, True where the time point does not
+        fall within an invalid interval
+        """
+        if not isinstance(invalid_time_intevals, IntervalSet):
+            invalid_time_intevals = \
+                IntervalSet.from_dataframe(invalid_time_intevals)
 
-        all_time_points = xr.DataArray(
+        return xr.DataArray(
             name="time_points",
-            data=[True] * len(time_points),
+            data=~invalid_time_intevals.contains(np.asarray(time_points)),
             dims=['time'],
             coords=[time_points]
         )
 
-        valid_time_points = all_time_points
-        for ix, invalid_time_interval in invalid_time_intevals.iterrows():
-            invalid_time_points = \
-                ((time_points >= invalid_time_interval['start_time'])
-                 & (time_points <= invalid_time_interval['stop_time']))
-            valid_time_points = \
-                np.logical_and(valid_time_points,
-                               np.logical_not(invalid_time_points))
-
-        return valid_time_points
-
     def _filter_invalid_times_by_tags(self, tags):
         """
         Parameters
@@ -440,12 +446,92 @@ class EcephysSession(LazyPropertyMixin):
         """
         invalid_times = self.invalid_times.copy()
         if not invalid_times.empty:
-            mask = invalid_times['tags'].apply(lambda x:
-                                               any([t in x for t in tags]))
-            invalid_times = invalid_times[mask]
+            # one row per (interval, tag), labelled by interval position
+            interval_tags = \
+                invalid_times['tags'].reset_index(drop=True).explode()
+            mask = interval_tags.isin(tags).groupby(level=0).any()
+            mask = mask.reindex(np.arange(len(invalid_times)),
+                                fill_value=False)
+            invalid_times = invalid_times[mask.values]
 
         return invalid_times
 
+    def _get_invalid_interval_set(self, tags):
+        """
+        Parameters
+        ----------
+        tags: list
+            of tags
+
+        Returns
+        -------
+        IntervalSet of the invalid times having any of these tags
+        """
+        return IntervalSet.from_dataframe(
+            self._filter_invalid_times_by_tags(tags))
+
+    def get_running_speed(self, mask_invalid_intervals=True):
+        ''' Running speed of the experimental subject
+
+        Parameters
+        ----------
+        mask_invalid_intervals : bool
+            if True (default) velocity samples whose [start_time, end_time]
+            overlaps an invalid stimulus interval (during which frame times,
+            and so running speed, are unreliable) are masked with np.nan.
+            Samples without an end_time (as read from NWB 1 files) are
+            masked if their start_time falls within an invalid interval.
+
+        Returns
+        -------
+        pd.DataFrame :
+            columns are 'start_time', 'end_time' (if available) and
+            'velocity' (cm/s)
+        '''
+        running_speed = self.running_speed
+        if not mask_invalid_intervals:
+            return running_speed
+
+        invalid_time_intervals = self._get_invalid_interval_set(["stimulus"])
+        if 'end_time' in running_speed.columns:
+            end_times = running_speed['end_time'].values
+        else:
+            end_times = None
+        invalid = invalid_time_intervals.intersect(
+            running_speed['start_time'].values, end_times)
+
+        running_speed = running_speed.copy()
+        running_speed.loc[invalid, 'velocity'] = np.nan
+        return running_speed
+
+    def _get_valid_spike_times(self, unit_ids):
+        """
+        Parameters
+        ----------
+        unit_ids: array-like
+            units whose spike times are wanted
+
+        Returns
+        -------
+        dict mapping unit id to the spike times of that unit which do not
+        fall within an invalid interval of its probe
+        """
+        units = self._filter_owned_df('units', ids=unit_ids)
+
+        interval_sets = {}
+        spike_times = {}
+        for unit_id, probe_description in zip(
+                units.index.values, units['probe_description'].values):
+            if probe_description not in interval_sets:
+                interval_sets[probe_description] = \
+                    self._get_invalid_interval_set(
+                        [probe_description, "all_probes"])
+            data = np.asarray(self.spike_times[unit_id])
+            spike_times[unit_id] = \
+                data[~interval_sets[probe_description].contains(data)]
+
+        return spike_times
+
     def get_inter_presentation_intervals_for_stimulus(self, stimulus_names):
         ''' Get a subset of this session's inter-presentation intervals,
         filtered by stimulus name.
@@ -662,21 +748,23 @@ class EcephysSession(LazyPropertyMixin):
         """
 
         fail_tags = ["stimulus"]
-        invalid_times = self._filter_invalid_times_by_tags(fail_tags)
-
-        for ix_sp, sp in stimulus_presentations.iterrows():
-            stim_epoch = sp['start_time'], sp['stop_time']
-
-            for ix_it, it in invalid_times.iterrows():
-                invalid_interval = it['start_time'], it['stop_time']
-                if _overlap(stim_epoch, invalid_interval):
-                    stimulus_presentations.iloc[ix_sp, :] = np.nan
-                    stimulus_presentations.at[ix_sp, "stimulus_name"] = \
-                        "invalid_presentation"
-                    stimulus_presentations.at[ix_sp, "start_time"] = \
-                        stim_epoch[0]
-                    stimulus_presentations.at[ix_sp, "stop_time"] = \
-                        stim_epoch[1]
+        invalid_times = self._get_invalid_interval_set(fail_tags)
+
+        start_times = stimulus_presentations['start_time'].values.copy()
+        stop_times = stimulus_presentations['stop_time'].values.copy()
+        invalid = np.flatnonzero(
+            invalid_times.intersect(start_times, stop_times))
+
+        if invalid.size > 0:
+            columns = stimulus_presentations.columns
+            stimulus_presentations.iloc[invalid, :] = np.nan
+            stimulus_presentations.iloc[
+                invalid, columns.get_loc("stimulus_name")] = \
+                "invalid_presentation"
+            stimulus_presentations.iloc[
+                invalid, columns.get_loc("start_time")] = start_times[invalid]
+            stimulus_presentations.iloc[
+                invalid, columns.get_loc("stop_time")] = stop_times[invalid]
 
         return stimulus_presentations
 
@@ -688,7 +776,8 @@ class EcephysSession(LazyPropertyMixin):
         binarize=False,
         dtype=None,
         large_bin_size_threshold=0.001,
-        time_domain_callback=None
+        time_domain_callback=None,
+        mask_invalid_intervals=False
     ):
         ''' Build an array of spike counts surrounding stimulus onset per
         unit and stimulus frame.
@@ -713,6 +802,9 @@ class EcephysSession(LazyPropertyMixin):
             The time domain is a numpy array whose values are trial-aligned bin
             edges (each row is aligned to a different trial). This optional
             function will be applied to the time domain before counting spikes.
+        mask_invalid_intervals : bool, optional
+            If True, spikes within invalid time intervals of each unit's probe
+            are not counted. Default False.
 
         Returns
         -------
@@ -766,9 +858,14 @@ class EcephysSession(LazyPropertyMixin):
                           "with a maximum overlap of"
                           f" {np.abs(np.min(time_diffs))} seconds.")
 
+        if mask_invalid_intervals:
+            spike_times = self._get_valid_spike_times(units.index.values)
+        else:
+            spike_times = self.spike_times
+
         tiled_data = build_spike_histogram(
             domain,
-            self.spike_times,
+            spike_times,
             units.index.values,
             dtype=dtype,
             binarize=binarize
@@ -795,7 +892,8 @@ class EcephysSession(LazyPropertyMixin):
     def presentationwise_spike_times(
             self,
             stimulus_presentation_ids=None,
-            unit_ids=None):
+            unit_ids=None,
+            mask_invalid_intervals=False):
         ''' Produce a table associating spike times with units and
         stimulus presentations
 
@@ -805,6 +903,9 @@ class EcephysSession(LazyPropertyMixin):
             Filter to these stimulus presentations
         unit_ids : array-like
             Filter to these units
+        mask_invalid_intervals : bool, optional
+            If True, spikes within invalid time intervals of each unit's probe
+            are excluded. Default False.
 
         Returns
         -------
@@ -831,12 +932,17 @@ class EcephysSession(LazyPropertyMixin):
             np.array(stimulus_presentations['stop_time'])
         all_presentation_ids = np.array(stimulus_presentations.index.values)
 
+        if mask_invalid_intervals:
+            all_spike_times = self._get_valid_spike_times(units.index.values)
+        else:
+            all_spike_times = self.spike_times
+
         presentation_ids = []
         unit_ids = []
         spike_times = []
 
         for ii, unit_id in enumerate(units.index.values):
-            data = self.spike_times[unit_id]
+            data = all_spike_times[unit_id]
             indices = np.searchsorted(presentation_times, data) - 1
 
             index_valid = indices % 2 == 0
@@ -1510,18 +1616,3 @@ def _extract_summary_rate_statistics(index, group):
         "spike_sem": scipy.stats.sem(group["spike_rate"].values)
     }
 
-
-def _overlap(a, b):
-    """Check if the two intervals overlap
-
-    Parameters
-    ----------
-    a : tuple
-        start, stop times
-    b : tuple
-        start, stop times
-    Returns
-    -------
-    bool : True if overlap, otherwise False
-    """
-    return max(a[0], b[0]) <= min(a[1], b[1])
@@ -1,6 +1,8 @@
 """Module for writing NWB files for the VCN project"""
 import logging
+import os
 import sys
+import time
 from typing import Any, Dict, List, Tuple
 from pathlib import Path, PurePath
 import multiprocessing as mp
@@ -16,6 +18,7 @@ from allensdk.brain_observatory.behavior.data_objects.stimuli.presentations \
     Presentations
 from allensdk.brain_observatory.ecephys._behavior_ecephys_metadata import \
     BehaviorEcephysMetadata
+from allensdk.brain_observatory.ecephys._lfp import LFPWriteOptions
 from allensdk.brain_observatory.ecephys._probe import Probe
 from allensdk.brain_observatory.ecephys.optotagging import OptotaggingTable
 from allensdk.brain_observatory.ecephys.probes import Probes
@@ -45,6 +48,10 @@ import allensdk.brain_observatory.sync_utilities as su
 
 STIM_TABLE_RENAMES_MAP = {"Start": "start_time", "End": "stop_time"}
 
+# Fraction of the node's available memory that concurrent probewise LFP
+# writers are allowed to use
+LFP_WRITE_MEMORY_FRACTION = 0.8
+
 
 def get_inputs_from_lims(host,
                          ecephys_session_id,
@@ -248,42 +255,196 @@ def add_raw_running_data_to_nwbfile(nwbfile, raw_running_data, units=None):
 
 
 def write_probe_lfp_file(session_id, session_metadata, session_start_time,
-                         log_level, probe_meta):
+                         log_level, probe_meta, write_options=None):
     """ Writes LFP data (and associated channel information) for one
-    probe to a standalone nwb file
+    probe to a standalone nwb file. LFP data are streamed from the
+    memory-mapped raw file into chunked, compressed datasets as configured by
+    `write_options` (an `LFPWriteOptions`)
+
+    Returns
+    -------
+    dict :
+        probe id, path to the written nwb file, the time (s) taken to write
+        it and its size in bytes
     """
     logging.getLogger('').setLevel(log_level)
     logging.info(f"writing lfp file for probe {probe_meta['id']}")
+    start = time.perf_counter()
 
     probe = Probe.from_json(probe=probe_meta)
     nwbfile = probe.add_lfp_to_nwb(
         session_id=session_id,
         session_start_time=session_start_time,
         session_metadata=BehaviorEcephysMetadata.from_json(
-            dict_repr=session_metadata)
+            dict_repr=session_metadata),
+        write_options=write_options
     )
-    with pynwb.NWBHDF5IO(probe_meta['lfp']['output_path'], 'w') as lfp_writer:
-        logging.info(f"writing lfp file to {probe_meta['lfp']['output_path']}")
+    output_path = probe_meta['lfp']['output_path']
+    with pynwb.NWBHDF5IO(output_path, 'w') as lfp_writer:
+        logging.info(f"writing lfp file to {output_path}")
         lfp_writer.write(nwbfile, cache_spec=True)
+
     return {
         "id": probe_meta["id"],
-        "nwb_path": probe_meta["lfp"]["output_path"]}
+        "nwb_path": output_path,
+        "write_time_seconds": time.perf_counter() - start,
+        "bytes_written": Path(output_path).stat().st_size}
+
+
+def get_available_memory():
+    """ Returns the amount of memory (bytes) available to new processes on
+    this node, or None if it can't be determined
+    """
+    try:
+        with open("/proc/meminfo", "r") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def estimate_probe_lfp_write_memory(probe_meta, write_options=None):
+    """ Estimates the peak memory (bytes) needed to write one probe's LFP
+    file. Raw LFP data are memory-mapped and streamed, so this is bounded by
+    the write buffer (raw int16 + scaled float32 copies) plus the fully
+    loaded timestamps and CSD.
+    """
+    if write_options is None:
+        write_options = LFPWriteOptions()
+
+    def file_size(path):
+        try:
+            return Path(path).stat().st_size
+        except (OSError, TypeError):
+            return 0
+
+    lfp_meta = probe_meta["lfp"]
+    # int16 raw samples are scaled to float32 (2x) one buffer at a time
+    scaled_bytes = 2 * file_size(lfp_meta["input_data_path"])
+    buffer_bytes = min(scaled_bytes, int(write_options.buffer_gb * 1e9))
+
+    return (
+        buffer_bytes * 3 // 2
+        + file_size(lfp_meta["input_timestamps_path"])
+        + file_size(probe_meta.get("csd_path"))
+    )
+
+
+def get_lfp_pool_size(probes, max_pool_size=3, write_options=None,
+                      available_memory=None,
+                      memory_fraction=LFP_WRITE_MEMORY_FRACTION):
+    """ Determine how many probewise LFP files can be written concurrently
+
+    Parameters
+    ----------
+    probes : List[dict]
+        probes (with lfp data) to be written
+    max_pool_size : int
+        upper bound on the number of worker processes
+    write_options : LFPWriteOptions, optional
+        chunking/buffering options used while writing
+    available_memory : int, optional
+        bytes of memory available. Determined from the node if None
+    memory_fraction : float
+        fraction of available memory that LFP writers may use
+
+    Returns
+    -------
+    int :
+        number of worker processes (at least 1)
+    """
+    pool_size = max(1, min(max_pool_size, len(probes)))
+
+    if available_memory is None:
+        available_memory = get_available_memory()
+    if available_memory is None or len(probes) == 0:
+        return pool_size
+
+    per_probe = max(
+        estimate_probe_lfp_write_memory(p, write_options) for p in probes)
+    if per_probe == 0:
+        return pool_size
+
+    memory_limited = int(available_memory * memory_fraction // per_probe)
+    return max(1, min(pool_size, memory_limited))
+
+
+def _try_write_probe_lfp_file(write, probe_meta):
+    """ Calls `write` for a probe, returning any error rather than raising it
+    so that failed probes can be retried by the caller
+    """
+    try:
+        return probe_meta, write(probe_meta), None
+    except Exception as err:
+        logging.exception(
+            f"failed to write lfp file for probe {probe_meta['id']}")
+        return probe_meta, None, repr(err)
 
 
 def write_probewise_lfp_files(probes, session_id, session_metadata,
-                              session_start_time, pool_size=3):
+                              session_start_time, pool_size=3,
+                              write_options=None, max_retries=1):
+    """ Writes a standalone LFP nwb file for each probe, in parallel.
+
+    The number of worker processes is at most `pool_size` and is further
+    limited by the memory available on this node and the estimated memory
+    needed to write each probe. Each worker reads its probe's LFP directly
+    from the memory-mapped raw file, so no LFP arrays are passed between
+    processes, and workers are replaced after each probe so that memory is
+    returned between probes. Probes that fail are retried up to
+    `max_retries` times.
 
+    Returns
+    -------
+    List[dict] :
+        output of `write_probe_lfp_file` for each probe
+    """
     output_paths = []
+    if len(probes) == 0:
+        return output_paths
+
+    n_workers = get_lfp_pool_size(probes, max_pool_size=pool_size,
+                                  write_options=write_options)
+    logging.info(f"writing lfp files for {len(probes)} probes "
+                 f"using {n_workers} processes")
 
-    pool = mp.Pool(processes=pool_size)
     write = partial(write_probe_lfp_file,
                     session_id,
                     session_metadata,
                     session_start_time,
-                    logging.getLogger("").getEffectiveLevel())
-
-    for pout in pool.imap_unordered(write, probes):
-        output_paths.append(pout)
+                    logging.getLogger("").getEffectiveLevel(),
+                    write_options=write_options)
+    try_write = partial(_try_write_probe_lfp_file, write)
+
+    pending = list(probes)
+    attempt = 0
+    with mp.Pool(processes=n_workers, maxtasksperchild=1) as pool:
+        while pending:
+            failed = []
+            for probe_meta, pout, error in pool.imap_unordered(
+                    try_write, pending):
+                if error is not None:
+                    failed.append((probe_meta, error))
+                    continue
+                output_paths.append(pout)
+                logging.info(
+                    f"wrote lfp file for probe {pout['id']} "
+                    f"({len(output_paths)}/{len(probes)}) in "
+                    f"{pout['write_time_seconds']:.1f}s, "
+                    f"{pout['bytes_written']} bytes")
+
+            if failed and attempt >= max_retries:
+                errors = {p["id"]: error for p, error in failed}
+                raise RuntimeError(
+                    f"failed to write lfp files for probes: {errors}")
+            pending = [p for p, _ in failed]
+            attempt += 1
 
     return output_paths
 
@@ -408,6 +569,11 @@ def write_ecephys_nwb(
     eye_dlc_ellipses_path=None,
     eye_gaze_mapping_path=None,
     session_metadata=None,
+    lfp_compression="gzip",
+    lfp_compression_opts=None,
+    lfp_chunk_shape=None,
+    lfp_buffer_gb=1.0,
+    lfp_write_retries=1,
     **kwargs
 ):
 
@@ -485,10 +651,19 @@ def write_ecephys_nwb(
     probes_with_lfp = [p for p in probes if p["lfp"] is not None]
     probes_without_lfp = [p for p in probes if p["lfp"] is None]
 
+    lfp_write_options = LFPWriteOptions(
+        chunk_shape=(tuple(lfp_chunk_shape) if lfp_chunk_shape is not None
+                     else None),
+        compression=lfp_compression,
+        compression_opts=lfp_compression_opts,
+        buffer_gb=lfp_buffer_gb
+    )
     probe_outputs = write_probewise_lfp_files(probes_with_lfp, session_id,
                                               session_metadata,
                                               session_start_time,
-                                              pool_size=pool_size)
+                                              pool_size=pool_size,
+                                              write_options=lfp_write_options,
+                                              max_retries=lfp_write_retries)
 
     probe_outputs += \
         [{'id': p["id"], "nwb_path": ""} for p in probes_without_lfp]
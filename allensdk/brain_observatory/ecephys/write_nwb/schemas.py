@@ -300,7 +300,40 @@ class VCNInputSchema(BaseNeuropixelsSchema):
     )
     pool_size = Int(
         default=3,
-        help="number of child processes used to write probewise lfp files",
+        help="""maximum number of child processes used to write probewise
+                lfp files. Fewer are used if available memory is
+                insufficient""",
+    )
+    lfp_write_retries = Int(
+        default=1,
+        help="number of times writing a failed probewise lfp file is retried",
+    )
+    lfp_compression = String(
+        default="gzip",
+        allow_none=True,
+        validate=mm.validate.OneOf(["gzip", "lzf"]),
+        help="""HDF5 compression filter applied to probewise LFP and CSD
+                data. Null disables compression""",
+    )
+    lfp_compression_opts = Int(
+        default=None,
+        allow_none=True,
+        help="""options for the LFP compression filter (gzip level,
+                4 if null). Must be null for lzf""",
+    )
+    lfp_chunk_shape = List(
+        Int,
+        required=False,
+        allow_none=True,
+        cli_as_single_argument=True,
+        help="""(time samples, channels) shape of the HDF5 chunks used to
+                store LFP data. Defaults to ~1MB chunks spanning all
+                channels""",
+    )
+    lfp_buffer_gb = Float(
+        default=1.0,
+        help="""maximum amount of LFP data (GB) held in memory at once
+                per probe while writing""",
     )
     eye_dlc_ellipses_path = String(
         required=False,
@@ -327,10 +360,27 @@ class VCNInputSchema(BaseNeuropixelsSchema):
                 subject""",
     )
 
+    @mm.validates_schema
+    def validate_lfp_compression(self, data, **kwargs):
+        compression = data.get("lfp_compression", "gzip")
+        if compression != "gzip" \
+                and data.get("lfp_compression_opts") is not None:
+            raise mm.ValidationError(
+                "lfp_compression_opts must be null for lfp_compression "
+                f"{compression!r}",
+                "lfp_compression_opts"
+            )
+
 
 class ProbeOutputs(RaisingSchema):
     nwb_path = String(required=True)
     id = Int(required=True)
+    write_time_seconds = Float(
+        required=False, help="time taken to write the probewise lfp file"
+    )
+    bytes_written = Int(
+        required=False, help="size of the probewise lfp file in bytes"
+    )
 
 
 class OutputSchema(RaisingSchema):
@@ -0,0 +1,134 @@
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+class IntervalSet:
+    """A set of closed time intervals [start, stop], stored as sorted,
+    merged (non-overlapping) start and stop times so that membership and
+    overlap queries are binary searches rather than a scan over every
+    interval.
+    """
+
+    def __init__(self, start_times: Iterable[float],
+                 stop_times: Iterable[float]):
+        """
+
+        Parameters
+        ----------
+        start_times:
+            start time of each interval
+        stop_times:
+            stop time of each interval. Intervals need not be sorted and may
+            overlap; overlapping intervals are merged.
+        """
+        start_times = np.asarray(start_times, dtype=float).ravel()
+        stop_times = np.asarray(stop_times, dtype=float).ravel()
+        if start_times.shape != stop_times.shape:
+            raise ValueError(
+                f"got {start_times.size} start times but "
+                f"{stop_times.size} stop times")
+
+        self._start_times, self._stop_times = \
+            self._merge(start_times, stop_times)
+
+    @staticmethod
+    def _merge(start_times: np.ndarray, stop_times: np.ndarray):
+        if start_times.size == 0:
+            return start_times, stop_times
+
+        order = np.argsort(start_times, kind="stable")
+        start_times = start_times[order]
+        stop_times = stop_times[order]
+
+        # an interval begins a new merged interval if it starts after every
+        # preceding interval has stopped
+        running_stop = np.maximum.accumulate(stop_times)
+        is_new = np.ones(start_times.size, dtype=bool)
+        is_new[1:] = start_times[1:] > running_stop[:-1]
+
+        group_starts = np.flatnonzero(is_new)
+        group_stops = np.append(group_starts[1:], start_times.size) - 1
+        return start_times[group_starts], running_stop[group_stops]
+
+    @classmethod
+    def from_dataframe(cls, intervals: pd.DataFrame,
+                       start_column: str = "start_time",
+                       stop_column: str = "stop_time") -> "IntervalSet":
+        """Build an IntervalSet from a table of intervals, such as a
+        session's invalid times"""
+        if intervals.empty:
+            return cls([], [])
+        return cls(intervals[start_column].values,
+                   intervals[stop_column].values)
+
+    @property
+    def start_times(self) -> np.ndarray:
+        return self._start_times
+
+    @property
+    def stop_times(self) -> np.ndarray:
+        return self._stop_times
+
+    def __len__(self) -> int:
+        return self._start_times.size
+
+    def _last_interval_starting_before(self, times: np.ndarray) -> np.ndarray:
+        return np.searchsorted(self._start_times, times, side="right") - 1
+
+    def contains(self, times) -> np.ndarray:
+        """Determine which times fall within any interval of this set
+
+        Parameters
+        ----------
+        times:
+            array-like of times
+
+        Returns
+        -------
+        np.ndarray :
+            boolean array (same shape as times), True where the time falls
+            within an interval (inclusive of its endpoints)
+        """
+        times = np.asarray(times, dtype=float)
+        if len(self) == 0:
+            return np.zeros(times.shape, dtype=bool)
+
+        index = self._last_interval_starting_before(times)
+        return (index >= 0) & (times <= self._stop_times[np.maximum(index, 0)])
+
+    def intersect(self, window_start_times,
+                  window_stop_times: Optional[Iterable[float]] = None
+                  ) -> np.ndarray:
+        """Determine which windows overlap any interval of this set
+
+        Parameters
+        ----------
+        window_start_times:
+            array-like of window start times
+        window_stop_times:
+            array-like of window stop times. If None, windows are points
+            (equivalent to `contains`)
+
+        Returns
+        -------
+        np.ndarray :
+            boolean array, True where the closed window [start, stop] shares
+            at least one point with an interval of this set
+        """
+        window_start_times = np.asarray(window_start_times, dtype=float)
+        if window_stop_times is None:
+            return self.contains(window_start_times)
+        window_stop_times = np.asarray(window_stop_times, dtype=float)
+
+        if len(self) == 0:
+            return np.zeros(window_start_times.shape, dtype=bool)
+
+        # merged intervals are disjoint, so the last interval starting
+        # before a window's end also has the latest stop of any such interval
+        index = self._last_interval_starting_before(window_stop_times)
+        return (
+            (index >= 0)
+            & (window_start_times <= self._stop_times[np.maximum(index, 0)])
+        )
@@ -40,7 +40,7 @@ import numpy as np
 import pandas as pd
 import scipy.ndimage
 from .receptive_field_analysis.receptive_field import \
-    compute_receptive_field_with_postprocessing
+    compute_receptive_fields_with_postprocessing
 from .receptive_field_analysis.visualization import plot_receptive_field_data
 
 from . import circle_plots as cplots
@@ -287,18 +287,18 @@ class LocallySparseNoise(StimulusAnalysis):
 
         return receptive_field
 
-    def get_receptive_field_analysis_data(self):
-        ''' Calculates receptive fields for each cell
+    def get_receptive_field_analysis_data(self, num_workers=1):
+        ''' Calculates receptive fields for each cell, using num_workers
+        processes
         '''
 
-        csid_rf = {}
-        for cell_index in range(self.data_set.number_of_cells):
-            csid_rf[str(cell_index)] = \
-                compute_receptive_field_with_postprocessing(
-                    self.data_set, cell_index, self.stimulus, alpha=.05,
-                    number_of_shuffles=10000)
+        cell_indices = list(range(self.data_set.number_of_cells))
+        rfs = compute_receptive_fields_with_postprocessing(
+            self.data_set, cell_indices, self.stimulus,
+            num_workers=num_workers, alpha=.05, number_of_shuffles=10000)
 
-        return csid_rf
+        return dict((str(cell_index), rf)
+                    for cell_index, rf in zip(cell_indices, rfs))
 
     def plot_receptive_field_analysis_data(self, cell_index, **kwargs):
         rf = self._cell_index_receptive_field_analysis_data[str(cell_index)]
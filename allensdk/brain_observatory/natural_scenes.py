@@ -33,10 +33,12 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
+import warnings
 import scipy.stats as st
 import numpy as np
 import pandas as pd
-from .stimulus_analysis import StimulusAnalysis
+from .stimulus_analysis import StimulusAnalysis, level_index, \
+    sweep_traces, trial_reliability
 import logging
 import h5py
 from . import observatory_plots as oplots
@@ -115,21 +117,14 @@ class NaturalScenes(StimulusAnalysis):
         '''
         NaturalScenes._log.info("Calculating mean responses")
 
-        response = np.empty((self.number_scenes, self.numbercells + 1, 3))
+        # scene ns is frame ns - 1, so that the blank sweeps (frame -1) are
+        # scene 0
+        condition_index = level_index(self.stim_table.frame.values,
+                                      np.arange(self.number_scenes) - 1)
 
-        def ptest(x):
-            return len(np.where(x < (0.05 / (self.number_scenes - 1)))[0])
-
-        for ns in range(self.number_scenes):
-            subset_response = self.mean_sweep_response[
-                self.stim_table.frame == (ns - 1)]
-            subset_pval = self.pval[self.stim_table.frame == (ns - 1)]
-            response[ns, :, 0] = subset_response.mean(axis=0)
-            response[ns, :, 1] = subset_response.std(
-                axis=0) / np.sqrt(len(subset_response))
-            response[ns, :, 2] = subset_pval.apply(ptest, axis=0)
-
-        return response
+        return self.get_condition_response(
+            condition_index, self.number_scenes,
+            p_threshold=0.05 / (self.number_scenes - 1), empty_ptest=0)
 
     def get_peak(self):
         ''' Computes metrics about peak response condition for each cell.
@@ -154,97 +149,80 @@ class NaturalScenes(StimulusAnalysis):
             'cell_specimen_id', 'image_selectivity_ns'))
         cids = self.data_set.get_cell_specimen_ids()
 
-        for nc in range(self.numbercells):
-            nsp = np.argmax(self.response[1:, nc, 0])
-            peak.cell_specimen_id.iloc[nc] = cids[nc]
-            peak.scene_ns[nc] = nsp
-            #            peak.response_reliability_ns[nc] = self.response[
-            #                nsp + 1, nc, 2] / 0.50  # assume 50 trials
-            peak.peak_dff_ns[nc] = self.response[nsp + 1, nc, 0]
-            #            subset = self.mean_sweep_response[
-            #            self.stim_table.frame == nsp]
-            #            subset_stat = subset[subset.dx < 2]
-            #            subset_run = subset[subset.dx >= 2]
-            #            if (len(subset_run) > 5) & (len(subset_stat) > 5):
-            #                (_, peak.p_run_ns[nc]) = st.ks_2samp(
-            #                    subset_run[str(nc)], subset_stat[str(nc)])
-            #                peak.run_modulation_ns[nc] = subset_run[
-            #                    str(nc)].mean() / subset_stat[str(nc)].mean()
-            #            else:
-            #                peak.p_run_ns[nc] = np.NaN
-            #                peak.run_modulation_ns[nc] = np.NaN
-            groups = []
-            for im in range(self.number_scenes):
-                subset = self.mean_sweep_response[
-                    self.stim_table.frame == (im - 1)]
-                groups.append(subset[str(nc)].values)
-            (_, peak.ptest_ns[nc]) = st.f_oneway(*groups)
-            test = self.sweep_response[
-                self.stim_table.frame == nsp][str(nc)].mean()
-            peak.time_to_peak_ns[nc] = \
-                (np.argmax(test) - self.interlength) / self.acquisition_rate
-
-            # running modulation
-            subset = self.mean_sweep_response[self.stim_table.frame == nsp]
-            subset_run = subset[subset.dx >= 1]
-            subset_stat = subset[subset.dx < 1]
-            if (len(subset_run) > 4) & (len(subset_stat) > 4):
-                (_, peak.p_run_ns.iloc[nc]) = st.ttest_ind(subset_run[str(nc)],
-                                                           subset_stat[
-                                                               str(nc)],
-                                                           equal_var=False)
-
-                if subset_run[str(nc)].mean() > subset_stat[str(nc)].mean():
-                    peak.run_modulation_ns.iloc[nc] = (subset_run[
-                                                           str(nc)].mean() -
-                                                       subset_stat[
-                                                           str(nc)].mean()) \
-                                                      / np.abs(
-                        subset_run[str(nc)].mean())
-                elif subset_run[str(nc)].mean() < subset_stat[str(nc)].mean():
-                    peak.run_modulation_ns.iloc[nc] = \
-                        (-1 * ((subset_stat[str(nc)].mean() -
-                                subset_run[str(nc)].mean()) /
-                               np.abs(subset_stat[str(nc)].mean())))
-            else:
-                peak.p_run_ns.iloc[nc] = np.NaN
-                peak.run_modulation_ns.iloc[nc] = np.NaN
-
-                # reliability
-            subset = self.sweep_response[self.stim_table.frame == nsp]
-            corr_matrix = np.empty((len(subset), len(subset)))
-            for i in range(len(subset)):
-                for j in range(len(subset)):
-                    r, p = st.pearsonr(subset[str(nc)].iloc[i][28:42],
-                                       subset[str(nc)].iloc[j][28:42])
-                    corr_matrix[i, j] = r
-            mask = np.ones((len(subset), len(subset)))
-            for i in range(len(subset)):
-                for j in range(len(subset)):
-                    if i >= j:
-                        mask[i, j] = np.NaN
-            corr_matrix *= mask
-            peak.reliability_ns.iloc[nc] = np.nanmean(corr_matrix)
-
-            # image selectivity
-            fmin = self.response[1:, nc, 0].min()
-            fmax = self.response[1:, nc, 0].max()
-            rtj = np.empty((1000, 1))
-            for j in range(1000):
-                thresh = fmin + j * ((fmax - fmin) / 1000.)
-                theta = np.empty((118, 1))
-                for im in range(118):
-                    # im+1 to only look at
-                    if self.response[im + 1, nc, 0] > thresh:
-                        # images, not blanksweep
-                        theta[im] = 1
-                    else:
-                        theta[im] = 0
-                rtj[j] = theta.mean()
-
-            biga = rtj.mean()
-            bigs = 1 - (2 * biga)
-            peak.image_selectivity_ns.iloc[nc] = bigs
+        if self.numbercells == 0:
+            return peak
+
+        cells = np.arange(self.numbercells)
+        columns = [str(nc) for nc in cells]
+
+        # scene_ns is the peak image (frame); rows of response and scene
+        # indices count the blank sweep (frame -1) as scene 0
+        images = self.response[1:, :self.numbercells, 0]
+        nsp = np.argmax(images, axis=0)
+        frames = self.stim_table.frame.values
+        scene = level_index(frames, np.arange(self.number_scenes) - 1)
+
+        responses = self.mean_sweep_response[columns].values.astype(float)
+        (_, ptest) = st.f_oneway(
+            *[responses[scene == im] for im in range(self.number_scenes)],
+            axis=0)
+
+        # running modulation, from the mean and variance of the running and
+        # stationary trials of each scene. NaN responses make the t-test NaN,
+        # but are skipped in the means compared for the modulation
+        dx = self.mean_sweep_response['dx'].values.astype(float)
+        run = (dx >= 1) & (scene >= 0)
+        stat = (dx < 1) & (scene >= 0)
+        (run_count, run_mean, run_std, run_nanmean) = \
+            _peak_scene_statistics(responses[run], scene[run],
+                                   self.number_scenes, nsp + 1)
+        (stat_count, stat_mean, stat_std, stat_nanmean) = \
+            _peak_scene_statistics(responses[stat], scene[stat],
+                                   self.number_scenes, nsp + 1)
+
+        has_trials = (run_count > 4) & (stat_count > 4)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            (_, p_run) = st.ttest_ind_from_stats(
+                run_mean, run_std, run_count, stat_mean, stat_std, stat_count,
+                equal_var=False)
+            run_modulation = np.full(self.numbercells, np.nan)
+            faster = run_nanmean > stat_nanmean
+            slower = run_nanmean < stat_nanmean
+            run_modulation[faster] = ((run_nanmean - stat_nanmean) /
+                                      np.abs(run_nanmean))[faster]
+            run_modulation[slower] = (-1 * ((stat_nanmean - run_nanmean) /
+                                            np.abs(stat_nanmean)))[slower]
+        p_run[~has_trials] = np.nan
+        run_modulation[~has_trials] = np.nan
+
+        # time to peak and reliability, from the traces of the peak scene's
+        # trials, for the cells sharing each peak scene at once
+        time_to_peak = np.full(self.numbercells, np.nan)
+        reliability = np.full(self.numbercells, np.nan)
+        for nsp_value in np.unique(nsp):
+            trials = np.flatnonzero(frames == nsp_value)
+            peak_cells = np.flatnonzero(nsp == nsp_value)
+            if len(trials) == 0:
+                continue
+
+            traces = sweep_traces(self.sweep_response.iloc[trials],
+                                  [columns[nc] for nc in peak_cells])
+            test = np.mean(traces, axis=0)
+            time_to_peak[peak_cells] = \
+                (np.argmax(test, axis=-1) - self.interlength) / \
+                self.acquisition_rate
+            reliability[peak_cells] = trial_reliability(traces[:, :, 28:42])
+
+        peak['cell_specimen_id'] = cids
+        peak['scene_ns'] = nsp
+        peak['reliability_ns'] = reliability
+        peak['peak_dff_ns'] = images[nsp, cells]
+        peak['ptest_ns'] = ptest
+        peak['p_run_ns'] = p_run
+        peak['run_modulation_ns'] = run_modulation
+        peak['time_to_peak_ns'] = time_to_peak
+        peak['image_selectivity_ns'] = image_selectivity(images)
 
         return peak
 
@@ -468,3 +446,86 @@ class NaturalScenes(StimulusAnalysis):
             raise MissingStimulusException(e.args)
 
         return ns
+
+
+def _peak_scene_statistics(responses, scene, number_scenes, peak_scene):
+    """ Number of trials, and mean and standard deviation (ddof=1) of the
+    responses, of each cell's peak scene. Sums are grouped by scene, for all
+    cells at once. The mean and standard deviation are NaN if any of the
+    responses are; the nanmean (as from pandas) skips NaN responses.
+
+    Parameters
+    ----------
+    responses: np.ndarray
+        (# trials, # cells) mean response of each trial
+
+    scene: np.ndarray
+        scene of each trial
+
+    number_scenes: int
+
+    peak_scene: np.ndarray
+        (# cells,) peak scene of each cell
+
+    Returns
+    -------
+    4-tuple of (# cells,) np.ndarrays: count, mean, std, nanmean
+    """
+    cells = np.arange(responses.shape[1])
+    count = np.bincount(scene, minlength=number_scenes)
+    sums = np.zeros((number_scenes, responses.shape[1]))
+    np.add.at(sums, scene, responses)
+
+    valid = ~np.isnan(responses)
+    valid_count = np.zeros_like(sums)
+    np.add.at(valid_count, scene, valid)
+    valid_sums = np.zeros_like(sums)
+    np.add.at(valid_sums, scene, np.where(valid, responses, 0))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = sums / count[:, np.newaxis]
+        nanmean = valid_sums / valid_count
+        squares = np.zeros_like(sums)
+        np.add.at(squares, scene, (responses - mean[scene]) ** 2)
+        std = np.sqrt(squares / (count[:, np.newaxis] - 1))
+
+    return (count[peak_scene], mean[peak_scene, cells],
+            std[peak_scene, cells], nanmean[peak_scene, cells])
+
+
+def image_selectivity(responses, number_of_thresholds=1000):
+    """ Image selectivity of each cell: 1 - 2 * the mean, over thresholds
+    evenly spaced from the minimum to the maximum of the cell's responses,
+    of the fraction of images whose response exceeds the threshold.
+
+    Rather than comparing every response to every threshold, counts the
+    thresholds below each response in closed form.
+
+    Parameters
+    ----------
+    responses: np.ndarray
+        (# images, # cells) mean responses to each image
+
+    number_of_thresholds: int
+
+    Returns
+    -------
+    (# cells,) np.ndarray of image selectivities
+    """
+    responses = np.asarray(responses, dtype=float)
+    fmin = responses.min(axis=0)
+    step = (responses.max(axis=0) - fmin) / float(number_of_thresholds)
+
+    # threshold j is fmin + j * step; count the j in
+    # [0, number_of_thresholds) with threshold < response
+    with np.errstate(divide='ignore', invalid='ignore'):
+        below = np.ceil((responses - fmin) / step)
+    below = np.clip(np.nan_to_num(below, nan=0, posinf=0, neginf=0),
+                    0, number_of_thresholds).astype(int)
+
+    # correct for rounding in the division
+    below -= (below > 0) & (fmin + (below - 1) * step >= responses)
+    below += (below < number_of_thresholds) & (fmin + below * step < responses)
+
+    biga = below.sum(axis=0) / float(number_of_thresholds * len(responses))
+    return 1 - (2 * biga)
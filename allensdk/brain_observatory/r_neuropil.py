@@ -33,10 +33,12 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
+import logging
+import multiprocessing as mp
+
 import numpy as np
 import scipy.sparse as sparse
 from scipy.linalg import solve_banded
-import logging
 
 
 def get_diagonals_from_sparse(mat):
@@ -123,6 +125,52 @@ def ab_from_T(T, lam, dt):
     return ab
 
 
+def fold_error_terms(F_M, F_N, ab, folds):
+    ''' Precompute the terms of the cross-validation error of each fold as a
+    function of r.
+
+    Since the smoothed trace F_C(r) = solve(F_M) - r * solve(F_N) is linear in
+    r, the residual of each fold is a - r * b, with a = solve(F_M) - F_M and
+    b = solve(F_N) - F_N, and its sum of squares is a quadratic in r.  All
+    traces are solved at once as multiple right-hand sides.
+
+    Parameters
+    ----------
+    F_M: float[number traces][T]
+        ROI traces
+
+    F_N: float[number traces][T]
+        Neuropil traces
+
+    ab: banded smoothing matrix of one fold (see ab_from_T)
+
+    folds: number of folds
+
+    Returns
+    -------
+    tuple: (sum(a*a), sum(a*b), sum(b*b), mean(F_M)), each
+    float[number traces][folds]
+    '''
+    F_M = np.atleast_2d(np.asarray(F_M, dtype=float))
+    F_N = np.atleast_2d(np.asarray(F_N, dtype=float))
+    T_f = ab.shape[1]
+
+    terms = np.zeros((4, F_M.shape[0], folds))
+    for fi in range(folds):
+        F_M_f = F_M[:, fi * T_f:(fi + 1) * T_f]
+        F_N_f = F_N[:, fi * T_f:(fi + 1) * T_f]
+
+        a = solve_banded((1, 1), ab, F_M_f.T).T - F_M_f
+        b = solve_banded((1, 1), ab, F_N_f.T).T - F_N_f
+
+        terms[0, :, fi] = np.einsum('ij,ij->i', a, a)
+        terms[1, :, fi] = np.einsum('ij,ij->i', a, b)
+        terms[2, :, fi] = np.einsum('ij,ij->i', b, b)
+        terms[3, :, fi] = F_M_f.mean(axis=1)
+
+    return tuple(terms)
+
+
 def normalize_F(F_M, F_N):
     F_N_min, F_N_max = float(np.amin(F_N)), float(np.amax(F_N))
 
@@ -191,6 +239,7 @@ class NeuropilSubtract(object):
 
         self.F_M = None
         self.F_N = None
+        self.error_terms = None
 
         self.r_vals = None
         self.error_vals = None
@@ -224,6 +273,17 @@ class NeuropilSubtract(object):
             self.F_M.append(F_M[fi * self.T_f:(fi + 1) * self.T_f])
             self.F_N.append(F_N[fi * self.T_f:(fi + 1) * self.T_f])
 
+        self.set_error_terms(*(
+            term[0] for term in fold_error_terms(F_M, F_N, self.ab, self.folds)))
+
+    def set_error_terms(self, aa, ab, bb, mean_F_M):
+        """ Set the per-fold error terms (see fold_error_terms) that
+        estimate_error evaluates, e.g. when they were computed for many
+        traces at once.
+        """
+        self.error_terms = (np.asarray(aa), np.asarray(ab),
+                            np.asarray(bb), np.asarray(mean_F_M))
+
     def fit_block_coordinate_desc(self, r_init=5.0, min_delta_r=0.00000001):
         F_M = np.concatenate(self.F_M)
         F_N = np.concatenate(self.F_N)
@@ -271,18 +331,14 @@ class NeuropilSubtract(object):
 
         it_dr = dr
         while it < iterations:
-            it_errors = []
-
             # build a set of r values evenly distributed in a current range
             rs = np.arange(it_range[0], it_range[1], it_dr)
 
             # estimate error for each r
-            for r in rs:
-                error = self.estimate_error(r)
-                it_errors.append(error)
+            it_errors = self.estimate_error(rs)
 
-                r_vals.append(r)
-                error_vals.append(error)
+            r_vals.extend(rs)
+            error_vals.extend(it_errors)
 
             # find the minimum in this range and update the global minimum
             min_i = np.argmin(it_errors)
@@ -314,16 +370,17 @@ class NeuropilSubtract(object):
         self.error = global_min_error
 
     def estimate_error(self, r):
-        """ Estimate error values for a given r for each fold and return the mean. """
+        """ Estimate error values for a given r (or array of r values) for
+        each fold and return the mean.  The error is evaluated in closed form
+        from the precomputed fold error terms, without solving for F_C.
+        """
+        aa, ab, bb, mean_F_M = self.error_terms
+        r = np.asarray(r, dtype=float)[..., np.newaxis]
 
-        errors = np.zeros(self.folds)
-        for fi in range(self.folds):
-            F_M = self.F_M[fi]
-            F_N = self.F_N[fi]
-            F_C = solve_banded((1, 1), self.ab, F_M - r * F_N)
-            errors[fi] = abs(error_calc(F_M, F_N, F_C, r))
+        sum_squares = np.maximum(aa - 2.0 * r * ab + r * r * bb, 0.0)
+        errors = np.abs(np.sqrt(sum_squares / self.T_f) / mean_F_M)
 
-        return np.mean(errors)
+        return errors.mean(axis=-1)
 
 
 def estimate_contamination_ratios(F_M, F_N,
@@ -360,6 +417,10 @@ def estimate_contamination_ratios(F_M, F_N,
         logging.warning("r is negative (%f). return 0.0.", ns.r)
         ns.r = 0
 
+    return _fit_results(ns)
+
+
+def _fit_results(ns):
     return {
         "r": ns.r,
         "r_vals": ns.r_vals,
@@ -368,3 +429,74 @@ def estimate_contamination_ratios(F_M, F_N,
         "min_error": ns.error,
         "it": len(ns.r_vals)
     }
+
+
+def _estimate_contamination_ratios_block(args):
+    F_M, F_N, lam, folds, fit_args = args
+
+    ns = NeuropilSubtract(lam=lam, folds=folds)
+    ns.T = F_M.shape[1]
+    ns.T_f = int(ns.T / folds)
+    ns.ab = ab_from_T(ns.T_f, lam, ns.dt)
+
+    error_terms = fold_error_terms(F_M, F_N, ns.ab, folds)
+
+    results = []
+    for i in range(F_M.shape[0]):
+        ns.set_error_terms(*(term[i] for term in error_terms))
+        ns.fit(**fit_args)
+
+        if ns.r < 0:
+            logging.warning("r is negative (%f). return 0.0.", ns.r)
+            ns.r = 0
+
+        results.append(_fit_results(ns))
+
+    return results
+
+
+def estimate_all_contamination_ratios(F_M, F_N,
+                                      lam=0.05, folds=4, iterations=3,
+                                      r_range=[0.0, 2.0], dr=0.1,
+                                      dr_factor=0.1, num_workers=1,
+                                      block_size=100):
+    ''' Calculates neuropil contamination of all ROIs of an experiment.
+    Equivalent to calling estimate_contamination_ratios on each pair of
+    traces, but the smoothing of all traces in a block is done with one
+    banded solve per fold.
+
+    Parameters
+    ----------
+       F_M: ROI traces (number traces x T). Must be finite.
+       F_N: Neuropil traces (number traces x T). Must be finite.
+       num_workers: number of processes fitting blocks of traces
+       block_size: number of traces solved together
+
+    Returns
+    -------
+    list: one dictionary per trace, as returned by
+    estimate_contamination_ratios
+    '''
+    F_M = np.atleast_2d(np.asarray(F_M, dtype=float))
+    F_N = np.atleast_2d(np.asarray(F_N, dtype=float))
+
+    if F_M.shape != F_N.shape:
+        raise Exception(
+            "F_M and F_N must have the same shape (%s vs %s)" %
+            (F_M.shape, F_N.shape))
+
+    fit_args = dict(r_range=r_range, iterations=iterations,
+                    dr=dr, dr_factor=dr_factor)
+    blocks = [(F_M[i:i + block_size], F_N[i:i + block_size],
+               lam, folds, fit_args)
+              for i in range(0, F_M.shape[0], block_size)]
+
+    if num_workers > 1 and len(blocks) > 1:
+        with mp.Pool(num_workers) as pool:
+            block_results = pool.map(_estimate_contamination_ratios_block,
+                                     blocks)
+    else:
+        block_results = [_estimate_contamination_ratios_block(block)
+                         for block in blocks]
+
+    return [result for results in block_results for result in results]
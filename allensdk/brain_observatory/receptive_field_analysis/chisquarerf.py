@@ -42,7 +42,7 @@ ON_LUMINANCE = 255
 OFF_LUMINANCE = 0
 
 
-def chi_square_binary(events, LSN_template):
+def chi_square_binary(events, LSN_template, cell_chunk_size=64):
     # note: can only be applied to binary events for trial responses
     #
     # *****INPUT*****
@@ -50,6 +50,9 @@ def chi_square_binary(events, LSN_template):
     #   or absence of response on a given trial
     # LSN_template: 3D numpy int8 with shape (num_trials,num_y_pixels,
     #   num_x_pixels) for luminance at each pixel location
+    # cell_chunk_size: number of cells whose statistics are computed at once.
+    #   Memory use grows as cell_chunk_size * num_y_pixels * num_x_pixels
+    #   times the number of pixels in a mask
     #
     # *****OUTPUT*****
     # chi_square_grid_NLL: 3D numpy float with shape (num_cells,num_y_pixels,
@@ -81,25 +84,101 @@ def chi_square_binary(events, LSN_template):
     events_per_pixel = get_events_per_pixel(events, trial_matrix)
 
     # smooth stimulus-triggered average spatially with a gaussian
-    for n in range(num_cells):
-        for on_off in range(2):
-            events_per_pixel[n, :, :, on_off] = smooth_STA(
-                events_per_pixel[n, :, :, on_off]
-            )
+    events_per_pixel = np.moveaxis(
+        smooth_STAs(np.moveaxis(events_per_pixel, 3, 1)), 1, 3
+    )
 
-    # calculate the p_value for each exclusion region
-    chi_square_grid = np.zeros((num_cells, num_y, num_x))
-    for y in range(num_y):
-        for x in range(num_x):
-            exclusion_mask = np.ones((num_y, num_x, 2)) * disc_masks[
-                y, x, :, :
-            ].reshape(num_y, num_x, 1)
-            p_vals, __ = chi_square_within_mask(
-                exclusion_mask, events_per_pixel, trials_per_pixel
+    # calculate the p_value for the exclusion region centered on each pixel
+    #   exclusion_masks has shape (num_y*num_x,num_y*num_x*2)
+    exclusion_masks = np.repeat(
+        disc_masks.reshape(num_y * num_x, num_y * num_x), 2, axis=1
+    )
+    chi_square_grid, __ = chi_square_within_masks(
+        exclusion_masks,
+        events_per_pixel.reshape(num_cells, num_y * num_x * 2),
+        trials_per_pixel.reshape(num_y * num_x * 2),
+        cell_chunk_size=cell_chunk_size,
+    )
+
+    return chi_square_grid.reshape(num_cells, num_y, num_x)
+
+
+def chi_square_within_masks(exclusion_masks, events_per_pixel,
+                            trials_per_pixel, cell_chunk_size=None):
+    """Apply chi_square_within_mask for many exclusion masks and cells at
+    once.
+
+    Parameters
+    ----------
+    exclusion_masks : np.ndarray
+        Dimensions are (nMasks, nPixels). Integer indicator for INCLUSION (!)
+        of a pixel within each testing region.
+    events_per_pixel : np.ndarray
+        Dimensions are (nCells, nPixels). Response counts by cell to each
+        pixel.
+    trials_per_pixel : np.ndarray
+        Dimensions are (nPixels,). Counts of trials where a pixel is active.
+    cell_chunk_size : int, optional
+        Number of cells whose statistics are computed at once, to bound
+        memory use. Default is all cells.
+
+    Returns
+    -------
+    p_vals : np.ndarray
+        Dimensions are (nCells, nMasks). Float values are p-values for the
+        hypothesis that a given cell has a receptive field within each mask.
+    chi_sum : np.ndarray
+        Dimensions are (nCells, nMasks). The chi-square test statistics.
+    """
+
+    # d.f. is number of pixels in mask minus one
+    degrees_of_freedom = np.sum(exclusion_masks, axis=1).astype(int) - 1
+
+    # pixels outside a mask do not contribute to its statistic, so only the
+    #   pixels within each mask are gathered, padded to the largest mask.
+    #   mask_pixels and mask_weights have shape (num_masks,max_pixels_per_mask)
+    pixels_per_mask = np.count_nonzero(exclusion_masks, axis=1)
+    max_pixels = max(int(pixels_per_mask.max(initial=0)), 1)
+    in_mask = np.arange(max_pixels) < pixels_per_mask[:, np.newaxis]
+    mask_pixels = np.zeros(in_mask.shape, dtype=int)
+    mask_pixels[in_mask] = np.nonzero(exclusion_masks)[1]
+    mask_weights = np.where(
+        in_mask, np.take_along_axis(exclusion_masks, mask_pixels, axis=1), 0
+    )
+
+    masked_trials = mask_weights * trials_per_pixel[mask_pixels]
+    total_trials = np.sum(masked_trials, axis=1).astype(float)
+
+    num_cells = events_per_pixel.shape[0]
+    if cell_chunk_size is None:
+        cell_chunk_size = max(num_cells, 1)
+
+    chi_sum = np.zeros((num_cells, exclusion_masks.shape[0]))
+    for start in range(0, num_cells, cell_chunk_size):
+        chunk = slice(start, start + cell_chunk_size)
+
+        # shape is (num_chunk_cells,num_masks,max_pixels_per_mask)
+        observed_by_pixel = (
+            events_per_pixel[chunk][:, mask_pixels] * mask_weights
+        ).astype(float)
+
+        total_events = np.sum(observed_by_pixel, axis=2)
+        expected_by_pixel = masked_trials * (total_events / total_trials)[
+            :, :, np.newaxis
+        ]
+
+        # calculate test statistic given observed and expected
+        with np.errstate(divide="ignore", invalid="ignore"):
+            chi = (
+                (observed_by_pixel - expected_by_pixel) ** 2
+                / expected_by_pixel
             )
-            chi_square_grid[:, y, x] = p_vals
+        chi_sum[chunk] = np.nansum(chi, axis=2)
+
+    # get p-value given test statistic and degrees of freedom
+    p_vals = 1.0 - stats.chi2.cdf(chi_sum, degrees_of_freedom)
 
-    return chi_square_grid
+    return p_vals, chi_sum
 
 
 def get_peak_significance(chi_square_grid_NLL, LSN_template, alpha=0.05):
@@ -224,20 +303,14 @@ def get_events_per_pixel(responses_np, trial_matrix):
 
     """
 
-    num_cells = np.shape(responses_np)[1]
-    num_y = np.shape(trial_matrix)[0]
-    num_x = np.shape(trial_matrix)[1]
+    num_y, num_x, _, num_trials = np.shape(trial_matrix)
 
-    events_per_pixel = np.zeros((num_cells, num_y, num_x, 2))
-    for y in range(num_y):
-        for x in range(num_x):
-            for on_off in range(2):
-                frames = np.argwhere(trial_matrix[y, x, on_off, :])[:, 0]
-                events_per_pixel[:, y, x, on_off] = np.sum(
-                    responses_np[frames, :], axis=0
-                )
+    trial_matrix = np.reshape(trial_matrix, (num_y * num_x * 2, num_trials))
+    events_per_pixel = np.dot(
+        trial_matrix.astype(float), np.asarray(responses_np, dtype=float)
+    )
 
-    return events_per_pixel
+    return events_per_pixel.T.reshape(-1, num_y, num_x, 2)
 
 
 def smooth_STA(STA, gauss_std=0.75, total_degrees=64):
@@ -260,16 +333,65 @@ def smooth_STA(STA, gauss_std=0.75, total_degrees=64):
         Smoothed image
     """
 
-    deg_per_pnt = total_degrees // STA.shape[0]
-    STA_interpolated = interpolate_RF(STA, deg_per_pnt)
-    STA_interpolated_smoothed = filt.gaussian_filter(
-        STA_interpolated, gauss_std
+    return smooth_STAs(STA, gauss_std=gauss_std, total_degrees=total_degrees)
+
+
+def smooth_STAs(STAs, gauss_std=0.75, total_degrees=64):
+    """Smooth a stack of images, as smooth_STA does for each image
+
+    Parameters
+    ----------
+    STAs : np.ndarray
+        Input images, with dimensions (nImages, nYPixels, nXPixels)
+    gauss_std : numeric, optional
+        See smooth_STA
+    total_degrees : int, optional
+        See smooth_STA
+
+    Returns
+    -------
+    STAs_smoothed : np.ndarray
+        Smoothed images
+    """
+
+    num_y, num_x = STAs.shape[-2:]
+    deg_per_pnt = total_degrees // num_y
+
+    # the upsampling is bilinear, so it is a matrix product along each axis
+    interpolation_y = _interpolation_matrix(num_y, deg_per_pnt)
+    interpolation_x = _interpolation_matrix(num_x, deg_per_pnt)
+    STAs_interpolated = np.matmul(
+        np.matmul(interpolation_y, STAs), interpolation_x.T
+    )
+
+    STAs_interpolated_smoothed = filt.gaussian_filter(
+        STAs_interpolated, (0,) * (STAs.ndim - 2) + (gauss_std, gauss_std)
+    )
+
+    return STAs_interpolated_smoothed[
+        ..., ::deg_per_pnt, :][..., ::deg_per_pnt]
+
+
+def _interpolation_matrix(pnts, deg_per_pnt):
+    """Linear interpolation weights from pnts sample points (spaced
+    deg_per_pnt apart) to the points of interpolate_RF (spaced 1 apart)
+    """
+
+    coor = np.arange(
+        -(pnts - 1) * deg_per_pnt / 2,
+        (pnts + 1) * deg_per_pnt / 2,
+        deg_per_pnt,
     )
-    STA_smoothed = deinterpolate_RF(
-        STA_interpolated_smoothed, STA.shape[1], STA.shape[0], deg_per_pnt
+    interpolated = np.arange(
+        -(pnts - 1) * deg_per_pnt / 2,
+        deg_per_pnt / 2 + (pnts / 2 - 1) * deg_per_pnt + 1,
+        1,
     )
 
-    return STA_smoothed
+    return np.stack(
+        [np.interp(interpolated, coor, column) for column in np.eye(pnts)],
+        axis=1,
+    )
 
 
 def interpolate_RF(rf_map, deg_per_pnt):
@@ -483,18 +605,13 @@ def build_trial_matrix(
         indicate that a pixel was on/off on a particular trial.
     """
 
-    _, num_y, num_x = np.shape(LSN_template)
-    trial_mat = np.zeros((num_y, num_x, 2, num_trials), dtype=bool)
-
-    for y in range(num_y):
-        for x in range(num_x):
-            for oo, on_off in enumerate(on_off_luminance):
-                frame = np.argwhere(LSN_template[:num_trials, y, x] == on_off)[
-                    :, 0
-                ]
-                trial_mat[y, x, oo, frame] = True
+    trial_mat = np.stack(
+        [LSN_template[:num_trials] == on_off for on_off in on_off_luminance],
+        axis=-1,
+    )
 
-    return trial_mat
+    # shape is (num_y,num_x,2,num_trials)
+    return np.moveaxis(trial_mat, 0, -1)
 
 
 def get_disc_masks(
@@ -540,13 +657,16 @@ def get_disc_masks(
     # get number of trials each pixel is not gray
     on_trials = LSN_binary.sum(axis=0).astype(float)  # shape is (num_y,num_x)
 
+    # number of trials on which each pair of pixels is not gray
+    LSN_binary = LSN_binary.reshape(-1, num_y * num_x)
+    coactive_trials = np.dot(LSN_binary.T, LSN_binary).reshape(
+        num_y, num_x, num_y, num_x
+    )
+
     masks = np.zeros((num_y, num_x, num_y, num_x))
     for y in range(num_y):
         for x in range(num_x):
-            trials_not_gray = np.argwhere(LSN_binary[:, y, x] > 0)[:, 0]
-            raw_mask = np.divide(
-                LSN_binary[trials_not_gray, :, :].sum(axis=0), on_trials
-            )
+            raw_mask = np.divide(coactive_trials[y, x], on_trials)
 
             center_y, center_x = np.unravel_index(
                 raw_mask.argmax(), (num_y, num_x)
@@ -33,6 +33,8 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
+import multiprocessing as mp
+
 from .eventdetection import detect_events
 from statsmodels.sandbox.stats.multicomp import multipletests
 import numpy as np
@@ -46,36 +48,33 @@ def events_to_pvalues_no_fdr_correction(data, event_vector, A,
                                         number_of_shuffles=5000,
                                         response_detection_error_std_dev=.1,
                                         seed=1):
-    number_of_pixels = A.shape[0] // 2
-
     # Initializations:
     number_of_events = event_vector.sum()
-    np.random.seed(seed)
+    rng = np.random.RandomState(seed)
 
     shuffle_data = get_shuffle_matrix(
         data, event_vector, A,
         number_of_shuffles=number_of_shuffles,
-        response_detection_error_std_dev=response_detection_error_std_dev)
+        response_detection_error_std_dev=response_detection_error_std_dev,
+        rng=rng)
 
     # Build list of p-values:
     response_triggered_stimulus_vector = A.dot(event_vector) / number_of_events
-    p_value_list = []
-    for pi in range(2 * number_of_pixels):
-        curr_p_value = \
-            1 - (shuffle_data[pi, :] <
-                 response_triggered_stimulus_vector[pi]).sum() * \
-            1. / number_of_shuffles
-        p_value_list.append(curr_p_value)
+    return 1 - (shuffle_data <
+                response_triggered_stimulus_vector[:, np.newaxis]).sum(
+        axis=1) * 1. / number_of_shuffles
 
-    return np.array(p_value_list)
 
-
-def compute_receptive_field(data, cell_index, stimulus, **kwargs):
+def compute_receptive_field(data, cell_index, stimulus, A=None, A_blur=None,
+                            **kwargs):
     alpha = kwargs.pop('alpha')
 
     event_vector = detect_events(data, cell_index, stimulus)
 
-    A_blur = get_A_blur(data, stimulus)
+    if A is None:
+        A = get_A(data, stimulus)
+    if A_blur is None:
+        A_blur = get_A_blur(data, stimulus)
     number_of_pixels = A_blur.shape[0] // 2
 
     pvalues = events_to_pvalues_no_fdr_correction(data, event_vector, A_blur,
@@ -103,9 +102,6 @@ def compute_receptive_field(data, cell_index, stimulus, **kwargs):
     _fdr_mask_off[fdr_corrected_pvalues_off < alpha] = True
     components_off, number_of_components_off = get_components(_fdr_mask_off)
 
-    A = get_A(data, stimulus)
-    A_blur = get_A_blur(data, stimulus)
-
     response_triggered_stimulus_field = A.dot(event_vector)
     response_triggered_stimulus_field_on = response_triggered_stimulus_field[
                                            :number_of_pixels].reshape(s1, s2)
@@ -173,6 +169,40 @@ def compute_receptive_field_with_postprocessing(data, cell_index, stimulus,
     return rf
 
 
+def _init_receptive_field_worker(data, stimulus, kwargs):
+    global _worker_args
+    _worker_args = (data, stimulus, kwargs)
+
+
+def _compute_receptive_field_worker(cell_index):
+    data, stimulus, kwargs = _worker_args
+    return compute_receptive_field_with_postprocessing(
+        data, cell_index, stimulus, **kwargs)
+
+
+def compute_receptive_fields_with_postprocessing(data, cell_indices, stimulus,
+                                                 num_workers=1, **kwargs):
+    """ Compute the receptive fields of many cells, optionally in parallel.
+    Shuffles are seeded per cell (see events_to_pvalues_no_fdr_correction), so
+    results do not depend on num_workers.
+
+    Returns
+    -------
+    list of receptive field dictionaries, in the order of cell_indices
+    """
+    # compute the stimulus design matrices once and hand them to every cell
+    kwargs = dict(kwargs, A=get_A(data, stimulus),
+                  A_blur=get_A_blur(data, stimulus))
+
+    if num_workers > 1 and len(cell_indices) > 1:
+        with mp.Pool(num_workers, initializer=_init_receptive_field_worker,
+                     initargs=(data, stimulus, kwargs)) as pool:
+            return pool.map(_compute_receptive_field_worker, cell_indices)
+
+    return [compute_receptive_field_with_postprocessing(
+        data, cell_index, stimulus, **kwargs) for cell_index in cell_indices]
+
+
 def get_attribute_dict(rf):
     attribute_dict = {}
     for x in dict_generator(rf):
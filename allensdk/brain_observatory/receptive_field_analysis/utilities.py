@@ -37,6 +37,7 @@ import warnings
 
 import numpy as np
 import scipy.interpolate as spinterp
+import scipy.sparse as sparse
 from allensdk.api.warehouse_cache.cache import memoize
 from scipy.ndimage.filters import gaussian_filter
 from skimage.measure import block_reduce
@@ -150,24 +151,55 @@ def get_shuffle_matrix(
     A,
     number_of_shuffles=5000,
     response_detection_error_std_dev=0.1,
+    batch_size=500,
+    rng=None,
 ):
+    """Response-triggered averages of A for random sets of trials.
+
+    Each shuffle draws (without replacement) about as many trials as
+    event_vector has events, with a normally distributed error of
+    response_detection_error_std_dev in the number of events.  Shuffles are
+    generated in batches of batch_size as a sparse selection matrix, which
+    is multiplied against A at once.  rng is a np.random.RandomState (default
+    the global numpy random state).
+    """
+    if rng is None:
+        rng = np.random
+
     number_of_events = event_vector.sum()
-    number_of_pixels = A.shape[0] // 2
-    shuffle_data = np.zeros((2 * number_of_pixels, number_of_shuffles))
-    evr = range(len(event_vector))
-    for ii in range(number_of_shuffles):
-        size = number_of_events + int(
-            np.round(
-                response_detection_error_std_dev
-                * number_of_events
-                * np.random.randn()
-            )
+    number_of_trials = len(event_vector)
+    A_T = np.ascontiguousarray(A.T)
+    shuffle_data = np.zeros((A.shape[0], number_of_shuffles))
+    for start in range(0, number_of_shuffles, batch_size):
+        batch = min(batch_size, number_of_shuffles - start)
+
+        sizes = number_of_events + np.round(
+            response_detection_error_std_dev
+            * number_of_events
+            * rng.randn(batch)
+        ).astype(int)
+        sizes = np.clip(sizes, 0, number_of_trials)
+        max_size = max(sizes.max(), 1)
+
+        # each shuffle takes the trials with the sizes[ii] smallest of a set
+        # of uniform random keys, which is a uniform random selection
+        keys = rng.random_sample((batch, number_of_trials))
+        smallest = np.argpartition(keys, max_size - 1, axis=1)[:, :max_size]
+        smallest = np.take_along_axis(
+            smallest,
+            np.argsort(np.take_along_axis(keys, smallest, axis=1), axis=1),
+            axis=1,
         )
-        shuffled_event_inds = np.random.choice(evr, size=size, replace=False)
+        selected = np.arange(max_size) < sizes[:, np.newaxis]
+        with np.errstate(divide="ignore"):
+            weights = np.repeat(1.0 / sizes, sizes)
 
-        b_tmp = np.zeros(len(event_vector), dtype=bool)
-        b_tmp[shuffled_event_inds] = True
-        shuffle_data[:, ii] = A[:, b_tmp].sum(axis=1) / float(size)
+        selection = sparse.csr_matrix(
+            (weights, smallest[selected], np.append(0, np.cumsum(sizes))),
+            shape=(batch, number_of_trials),
+        )
+        shuffle_data[:, start:start + batch] = selection.dot(A_T).T
+        shuffle_data[:, start + np.flatnonzero(sizes == 0)] = np.nan
 
     return shuffle_data
 
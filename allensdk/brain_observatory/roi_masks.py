@@ -36,8 +36,10 @@
 import numpy as np
 import math
 import scipy.ndimage.morphology as morphology
+import scipy.sparse as sparse
 import logging
 import h5py
+from concurrent.futures import ThreadPoolExecutor
 
 # constants used for accessing border array
 RIGHT_SHIFT = 0
@@ -448,25 +450,88 @@ def calculate_traces(stack, mask_list, block_size=1000):
             mask.mask = np.array(mask.mask)
         mask_areas[i] = mask.mask.sum()
 
-    # calculate traces
-    for frame_num in range(0, num_frames, block_size):
-        if frame_num % block_size == 0:
-            logging.debug("frame " + str(frame_num) + " of " + str(num_frames))
-        frames = stack[frame_num:frame_num+block_size]
+    if not valid_masks.any():
+        return traces, exclusions
 
-        for i in range(len(mask_list)):
-            if not valid_masks[i]:
-                continue
+    # sum every mask over each frame block with one sparse product,
+    # restricted to the pixels covered by some mask
+    mask_pixels = create_mask_pixel_matrix(mask_list, stack.shape[1:],
+                                           valid_masks)
+    covered_pixels = np.flatnonzero(mask_pixels.getnnz(axis=0))
+    mask_pixels = mask_pixels[valid_masks][:, covered_pixels]
 
-            mask = mask_list[i]
-            subframe = frames[:,mask.y:mask.y + mask.height, 
-                                mask.x:mask.x + mask.width]
+    # calculate traces
+    for frame_num, frames in _read_blocks(stack, block_size):
+        logging.debug("frame " + str(frame_num) + " of " + str(num_frames))
+        frames = frames.reshape(frames.shape[0], -1).take(covered_pixels, axis=1)
 
-            total = subframe[:, mask.mask].sum(axis=1)
-            traces[i, frame_num:frame_num+block_size] = total / mask_areas[i]
+        total = mask_pixels.dot(frames.T)
+        traces[valid_masks, frame_num:frame_num+block_size] = \
+            total / mask_areas[valid_masks, np.newaxis]
 
     return traces, exclusions
 
+
+def create_mask_pixel_matrix(mask_list, image_shape, valid_masks=None):
+    '''
+    Pack masks into a single sparse matrix
+
+    Parameters
+    ----------
+    mask_list: list<Mask>
+        List of masks
+
+    image_shape: tuple
+        (image height, image width) of the frames the masks are applied to
+
+    valid_masks: bool[number masks]
+        Masks to include. Rows of other masks are empty. Default all masks.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix [number masks][image height * image width]
+        Each row is 1 at the (flattened) pixels of its mask
+    '''
+    if valid_masks is None:
+        valid_masks = np.ones(len(mask_list), dtype=bool)
+
+    rows = []
+    pixels = []
+    for i, mask in enumerate(mask_list):
+        if not valid_masks[i]:
+            continue
+        mask_y, mask_x = np.nonzero(np.asarray(mask.mask))
+        rows.append(np.full(mask_y.size, i))
+        pixels.append(np.ravel_multi_index(
+            (mask_y + mask.y, mask_x + mask.x), image_shape))
+
+    rows = np.concatenate(rows) if rows else np.array([], dtype=int)
+    pixels = np.concatenate(pixels) if pixels else np.array([], dtype=int)
+
+    return sparse.csr_matrix(
+        (np.ones(rows.size), (rows, pixels)),
+        shape=(len(mask_list), int(np.prod(image_shape))))
+
+
+def _read_blocks(stack, block_size):
+    ''' Yield (first frame number, frames) blocks of a stack, reading the
+    next block on a background thread while the current one is used '''
+    num_frames = stack.shape[0]
+    if num_frames == 0:
+        return
+
+    def read(frame_num):
+        return np.asarray(stack[frame_num:frame_num+block_size])
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_block = executor.submit(read, 0)
+        for frame_num in range(0, num_frames, block_size):
+            frames = next_block.result()
+            if frame_num + block_size < num_frames:
+                next_block = executor.submit(read, frame_num + block_size)
+            yield frame_num, frames
+
+
 def calculate_roi_and_neuropil_traces(movie_h5, roi_mask_list, motion_border):
     """ get roi and neuropil masks """
 
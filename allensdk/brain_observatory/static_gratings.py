@@ -36,9 +36,8 @@
 import scipy.stats as st
 import numpy as np
 import pandas as pd
-from math import sqrt
 import logging
-from .stimulus_analysis import StimulusAnalysis
+from .stimulus_analysis import StimulusAnalysis, level_index
 from .brain_observatory_exceptions import BrainObservatoryAnalysisException, \
     MissingStimulusException
 from . import observatory_plots as oplots
@@ -164,40 +163,31 @@ class StaticGratings(StimulusAnalysis):
         '''
         StaticGratings._log.info("Calculating mean responses")
 
-        response = np.empty((self.number_ori, self.number_sf,
-                             self.number_phase, self.numbercells + 1, 3))
-
-        def ptest(x):
-            if x.empty:
-                return np.nan
-            return len(np.where(
-                x < (0.05 / (self.number_ori * (self.number_sf - 1))))[0])
-
-        for ori in self.orivals:
-            ori_pt = np.where(self.orivals == ori)[0][0]
-
-            for sf in self.sfvals:
-                sf_pt = np.where(self.sfvals == sf)[0][0]
-
-                for phase in self.phasevals:
-                    phase_pt = np.where(self.phasevals == phase)[0][0]
-                    subset_response = self.mean_sweep_response[
-                        (self.stim_table.spatial_frequency == sf) & (
-                                self.stim_table.orientation == ori) & (
-                                    self.stim_table.phase == phase)]
-                    subset_pval = self.pval[
-                        (self.stim_table.spatial_frequency == sf) & (
-                                self.stim_table.orientation == ori) & (
-                                    self.stim_table.phase == phase)]
-                    response[ori_pt, sf_pt, phase_pt, :, 0] = \
-                        subset_response.mean(axis=0)
-                    response[ori_pt, sf_pt, phase_pt, :, 1] = \
-                        subset_response.std(
-                        axis=0) / sqrt(len(subset_response))
-                    response[ori_pt, sf_pt, phase_pt, :, 2] = \
-                        subset_pval.apply(ptest, axis=0)
-
-        return response
+        ori_index = level_index(self.stim_table.orientation.values,
+                                self.orivals)
+        sf_index = level_index(self.stim_table.spatial_frequency.values,
+                               self.sfvals)
+        phase_index = level_index(self.stim_table.phase.values,
+                                  self.phasevals)
+        condition_index = np.where(
+            (ori_index >= 0) & (sf_index >= 0) & (phase_index >= 0),
+            np.ravel_multi_index(
+                (np.maximum(ori_index, 0), np.maximum(sf_index, 0),
+                 np.maximum(phase_index, 0)),
+                (self.number_ori, self.number_sf, self.number_phase)),
+            -1)
+
+        shape = (self.number_ori, self.number_sf, self.number_phase,
+                 self.numbercells + 1, 3)
+        if condition_index.size == 0:
+            return np.empty(shape)
+
+        response = self.get_condition_response(
+            condition_index,
+            self.number_ori * self.number_sf * self.number_phase,
+            p_threshold=0.05 / (self.number_ori * (self.number_sf - 1)))
+
+        return response.reshape(shape)
 
     def get_peak(self):
         """ Computes metrics related to each cell's peak response condition.
@@ -566,42 +566,179 @@ class StimulusAnalysis(object):
         3-tuple: sweep_response, mean_sweep_response, pval
         """
 
-        def do_mean(x):
-            # +1])
-            return np.mean(
-                x[self.interlength:
-                  self.interlength + self.sweeplength + self.extralength])
-
-        def do_p_value(x):
-            (_, p) = \
-                st.f_oneway(
-                    x[:self.interlength],
-                    x[self.interlength:
-                      self.interlength + self.sweeplength + self.extralength])
-            return p
-
         StimulusAnalysis._log.info('Calculating responses for each sweep')
-        sweep_response = pd.DataFrame(index=self.stim_table.index.values,
-                                      columns=list(map(str, range(
-                                          self.numbercells + 1))))
+        sweep_responses, mean_sweep_response, pval, irregular_sweeps = \
+            self._compute_sweep_responses()
+
+        index = self.stim_table.index.values
+        columns = list(map(str, range(self.numbercells))) + ['dx']
+
+        # a view of the response tensor, one trace per (sweep, cell)
+        sweep_response = pd.DataFrame(
+            dict((column, list(sweep_responses[:, ci, :]))
+                 for ci, column in enumerate(columns)),
+            index=index, columns=columns)
+        for si, traces in irregular_sweeps.items():
+            for ci, column in enumerate(columns):
+                sweep_response[column].values[si] = traces[ci]
 
-        sweep_response.rename(
-            columns={str(self.numbercells): 'dx'}, inplace=True)
+        mean_sweep_response = pd.DataFrame(mean_sweep_response,
+                                           index=index, columns=columns)
+        pval = pd.DataFrame(pval, index=index, columns=columns)
 
-        for index, row in self.stim_table.iterrows():
-            start = int(row['start'] - self.interlength)
-            end = int(row['start'] + self.sweeplength + self.interlength)
+        return sweep_response, mean_sweep_response, pval
+
+    def get_sweep_response_arrays(self):
+        """ Array form of get_sweep_response, without building DataFrames.
+        The return is a 3-tuple of:
 
+            * sweep_response: (# sweeps, # cells + 1, # time points)
+            np.ndarray of response dF/F traces. The last cell is the running
+            speed. Traces of sweeps whose window extends past the end of the
+            recording are truncated and padded with NaN.
+
+            * mean_sweep_response: (# sweeps, # cells + 1) np.ndarray of
+            mean values of the traces returned in sweep_response
+
+            * pval: (# sweeps, # cells + 1) np.ndarray of p values from 1-way
+            ANOVA comparing response during sweep to response prior to sweep
+
+        Returns
+        -------
+        3-tuple: sweep_response, mean_sweep_response, pval
+        """
+        return self._compute_sweep_responses()[:3]
+
+    def _compute_sweep_responses(self):
+        response_start = self.interlength
+        response_end = self.interlength + self.sweeplength + self.extralength
+        window = self.sweeplength + 2 * self.interlength
+
+        starts = self.stim_table['start'].values.astype(int) - self.interlength
+        num_sweeps = len(starts)
+        num_samples = min(np.shape(self.celltraces)[1], len(self.dxcm))
+
+        sweep_response = np.full(
+            (num_sweeps, self.numbercells + 1, window), np.nan)
+        mean_sweep_response = np.full((num_sweeps, self.numbercells + 1),
+                                      np.nan)
+        pval = np.full((num_sweeps, self.numbercells + 1), np.nan)
+
+        # gather the windows of all sweeps within the recording with one
+        # fancy index, as a (sweep, cell, time) tensor
+        regular = (starts >= 0) & (starts + window <= num_samples)
+        time_index = starts[regular, np.newaxis] + np.arange(window)
+
+        # (contiguous copies of the reduced windows keep the summation
+        # order, and so the results, identical to reducing each trace)
+        traces = np.moveaxis(
+            np.asarray(self.celltraces)[:, time_index], 0, 1)
+        baseline = np.ascontiguousarray(traces[..., :self.interlength])
+        sweep_response[regular, :self.numbercells] = 100 * (
+            (traces / np.mean(baseline, axis=-1, keepdims=True)) - 1)
+        sweep_response[regular, self.numbercells] = \
+            np.asarray(self.dxcm)[time_index]
+
+        responses = sweep_response[regular]
+        before = np.ascontiguousarray(responses[..., :self.interlength])
+        during = np.ascontiguousarray(
+            responses[..., response_start:response_end])
+        mean_sweep_response[regular] = np.mean(during, axis=-1)
+        if responses.size > 0:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                pval[regular] = st.f_oneway(before, during, axis=-1).pvalue
+
+        # sweeps that run off the recording keep their truncated windows
+        irregular_sweeps = {}
+        for si in np.flatnonzero(~regular):
+            start = starts[si]
+            end = start + window
+
+            sweep_traces = []
             for nc in range(self.numbercells):
                 temp = self.celltraces[int(nc), start:end]
-                sweep_response[str(nc)][index] = \
-                    100 * ((temp / np.mean(temp[:self.interlength])) - 1)
-            sweep_response['dx'][index] = self.dxcm[start:end]
+                sweep_traces.append(
+                    100 * ((temp / np.mean(temp[:self.interlength])) - 1))
+            sweep_traces.append(self.dxcm[start:end])
+            irregular_sweeps[si] = sweep_traces
+
+            for ci, x in enumerate(sweep_traces):
+                sweep_response[si, ci, :len(x)] = x
+                mean_sweep_response[si, ci] = np.mean(
+                    x[response_start:response_end])
+                (_, pval[si, ci]) = st.f_oneway(
+                    x[:self.interlength], x[response_start:response_end])
+
+        return sweep_response, mean_sweep_response, pval, irregular_sweeps
+
+    def get_condition_response(self, condition_index, number_of_conditions,
+                               p_threshold, empty_ptest=np.nan):
+        """ Computes the mean response for each cell to each stimulus
+        condition from mean_sweep_response and pval, grouping sweeps by
+        condition index rather than filtering the tables per condition.
+
+        Parameters
+        ----------
+        condition_index: np.ndarray
+            Condition of each sweep of the stimulus table, in
+            [0, number_of_conditions). Sweeps with a negative index are
+            excluded.
+
+        number_of_conditions: int
+
+        p_threshold: float
+            Sweeps with a p value below this threshold are significant
+
+        empty_ptest: float
+            Number of significant sweeps reported for conditions without any
+            sweeps
 
-        mean_sweep_response = sweep_response.applymap(do_mean)
+        Returns
+        -------
+        (# conditions, # cells + 1, 3) np.ndarray of the mean response to
+        each condition (index 0), standard error of the mean of the response
+        (index 1), and the number of sweeps with a significant response
+        (index 2).
+        """
+        condition_index = np.asarray(condition_index)
+        included = condition_index >= 0
+        conditions = condition_index[included]
+
+        number_of_columns = self.numbercells + 1
+        values = np.asarray(self.mean_sweep_response, dtype=float).reshape(
+            -1, number_of_columns)[included]
+        significant = np.asarray(self.pval, dtype=float).reshape(
+            -1, number_of_columns)[included] < p_threshold
+
+        finite = ~np.isnan(values)
+        values = np.where(finite, values, 0)
+
+        def condition_sum(x):
+            sums = np.zeros((number_of_conditions,) + x.shape[1:])
+            np.add.at(sums, conditions, x)
+            return sums
+
+        number_of_sweeps = np.bincount(conditions,
+                                       minlength=number_of_conditions)
+        number_finite = condition_sum(finite)
+
+        response = np.empty((number_of_conditions, number_of_columns, 3))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = condition_sum(values) / number_finite
+            deviations = np.where(finite, values - mean[conditions], 0)
+            std = np.sqrt(condition_sum(deviations ** 2) /
+                          (number_finite - 1))
+            std[number_finite < 2] = np.nan
+
+            response[:, :, 0] = mean
+            response[:, :, 1] = \
+                std / np.sqrt(number_of_sweeps)[:, np.newaxis]
+        response[:, :, 2] = condition_sum(significant)
+        response[number_of_sweeps == 0, :, 2] = empty_ptest
+
+        return response
 
-        pval = sweep_response.applymap(do_p_value)
-        return sweep_response, mean_sweep_response, pval
 
     def plot_representational_similarity(self, repsim, stimulus=False):
         if stimulus:
@@ -649,6 +786,69 @@ class StimulusAnalysis(object):
                             % (str(csid), str(idx)))
 
 
+def level_index(values, levels):
+    """ Index of each value in a sorted array of unique levels, or -1 for
+    values that equal none of the levels.
+    """
+    values = np.asarray(values)
+    levels = np.asarray(levels)
+
+    if len(levels) == 0:
+        return np.full(values.shape, -1, dtype=int)
+
+    index = np.clip(np.searchsorted(levels, values), 0, len(levels) - 1)
+    index[levels[index] != values] = -1
+    return index
+
+
+def sweep_traces(sweep_response, columns):
+    """ Stack the traces of a sweep_response table (one trace per sweep and
+    column) into a (# sweeps, # columns, # time points) np.ndarray. Traces
+    shorter than the longest (of sweeps truncated at the end of the
+    recording) are padded with NaN.
+    """
+    traces = sweep_response[columns].values.ravel()
+    lengths = np.fromiter(map(len, traces), dtype=int, count=len(traces))
+    window = lengths.max() if len(lengths) > 0 else 0
+
+    stacked = np.full((len(traces), window), np.nan)
+    if len(traces) > 0:
+        stacked[np.arange(window) < lengths[:, np.newaxis]] = \
+            np.concatenate(traces)
+
+    return stacked.reshape(len(sweep_response), len(columns), window)
+
+
+def trial_reliability(traces):
+    """ Mean Pearson correlation between the traces of all pairs of trials,
+    for many cells at once. Equivalent to averaging scipy.stats.pearsonr
+    over the pairs, with NaN (e.g. constant trace) correlations ignored.
+
+    Parameters
+    ----------
+    traces: np.ndarray
+        (# trials, # cells, # time points) array of trial traces
+
+    Returns
+    -------
+    (# cells,) np.ndarray of reliabilities
+    """
+    traces = np.moveaxis(np.asarray(traces, dtype=float), 0, 1)
+
+    # correlations are dot products of the centered, normalized traces
+    centered = traces - np.mean(traces, axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = centered / np.linalg.norm(centered, axis=-1, keepdims=True)
+    z[np.all(traces == traces[..., :1], axis=-1)] = np.nan
+
+    corr = np.clip(np.matmul(z, np.swapaxes(z, 1, 2)), -1.0, 1.0)
+    upper = np.triu_indices(traces.shape[1], k=1)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(corr[:, upper[0], upper[1]], axis=-1)
+
+
 def nonraising_ks_2samp(data1, data2, **kwargs):
     """ scipy.stats.ks_2samp now raises a ValueError if one of the input arrays
     is of length 0. Previously it signaled this case by returning nans. This
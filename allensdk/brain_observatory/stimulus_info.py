@@ -33,12 +33,16 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
+import functools
+import hashlib
 import itertools
+import os
+import shutil
 
 import numpy as np
 import scipy.ndimage.interpolation as spndi
+import scipy.sparse as sparse
 import six
-from allensdk.api.warehouse_cache.cache import memoize
 from PIL import Image
 
 # some handles for stimulus types
@@ -155,6 +159,9 @@ NATURAL_MOVIE_DIMENSIONS = (304, 608)
 MONITOR_DIMENSIONS = (1200, 1920)
 MONITOR_DISTANCE = 15
 
+# bound (in bytes) on the buffers of BrainObservatoryMonitor.warp_images
+WARP_BUFFER_BYTES = 2 ** 26
+
 STIMULUS_GRAY = 127
 STIMULUS_BITDEPTH = 8
 
@@ -276,38 +283,146 @@ class BinaryIntervalSearchTree(object):
         return return_val
 
 
+class SortedIntervalIndex(object):
+    @staticmethod
+    def from_df(input_df):
+        starts = input_df["start"].values.astype(float)
+        ends = input_df["end"].values.astype(float)
+        # -.01 prevents endpoint-overlapping intervals; assigns ties to
+        # intervals that start at requested index
+        ends = np.where(starts == ends, ends, ends - 0.01)
+        return SortedIntervalIndex(starts, ends)
+
+    def __init__(self, starts, ends):
+        """Index a set of intervals as sorted arrays, to look up the
+        intervals containing many points at once with binary searches.
+        Assumes that the intervals are non-overlapping.  If two intervals
+        share an endpoint, the left-side wins the tie.
+
+        :param starts: interval starts
+        :param ends: interval ends (inclusive)
+
+        Example:
+        index = SortedIntervalIndex([0, 1], [.5, 2])
+        print(index.search([1.5, 0.7]))
+        """
+        starts = np.asarray(starts, dtype=float)
+        ends = np.asarray(ends, dtype=float)
+
+        self.order = np.argsort(starts, kind="stable")
+        self.starts = starts[self.order]
+        self.ends = ends[self.order]
+
+        # Check that the intervals are non-overlapping (except potentially at
+        # the end point)
+        if np.any(self.ends[:-1] > self.starts[1:]):
+            raise ValueError("intervals must not overlap")
+
+    def __len__(self):
+        return len(self.starts)
+
+    def search(self, values):
+        """Find the interval containing each value.
+
+        :param values: array of points
+        :return: array of the positions (in the order the intervals were
+        given) of the intervals containing each point, or -1 for points
+        outside of every interval
+        """
+        values = np.asarray(values, dtype=float)
+        if len(self) == 0:
+            return np.full(values.shape, -1, dtype=int)
+
+        # ends are sorted, so the first interval ending at or after a value
+        # is the leftmost that can contain it
+        index = np.searchsorted(self.ends, values, side="left")
+        clipped = np.minimum(index, len(self) - 1)
+        found = (index < len(self)) & (self.starts[clipped] <= values)
+
+        return np.where(found, self.order[clipped], -1)
+
+    def integer_ranges(self):
+        """First and last integer covered by each (sorted) interval"""
+        return np.ceil(self.starts), np.floor(self.ends)
+
+
 class StimulusSearch(object):
     def __init__(self, nwb_dataset):
         self.nwb_data = nwb_dataset
         self.epoch_df = nwb_dataset.get_stimulus_epoch_table()
         self.master_df = nwb_dataset.get_stimulus_table("master")
-        self.epoch_bst = BinaryIntervalSearchTree.from_df(self.epoch_df)
-        self.master_bst = BinaryIntervalSearchTree.from_df(self.master_df)
+        self.epoch_index = SortedIntervalIndex.from_df(self.epoch_df)
+        self.master_index = SortedIntervalIndex.from_df(self.master_df)
+
+        # (start, end, row) of each master table row, as returned by search
+        self.master_intervals = [
+            (
+                x["start"],
+                x["end"] if x["start"] == x["end"] else x["end"] - 0.01,
+                x,
+            )
+            for x in self.master_df.to_dict("records")
+        ]
+
+        # master intervals covering at least one frame
+        first_frames, last_frames = self.master_index.integer_ranges()
+        covers_frames = first_frames <= last_frames
+        self._master_first_frames = first_frames[covers_frames]
+        self._master_last_frames = last_frames[covers_frames]
+
+        # first frame of the contiguous run of epochs containing each epoch
+        first_frames, last_frames = self.epoch_index.integer_ranges()
+        new_run = np.ones(len(first_frames), dtype=bool)
+        new_run[1:] = first_frames[1:] > \
+            np.maximum.accumulate(last_frames)[:-1] + 1
+        self._epoch_first_frames = first_frames
+        self._epoch_run_starts = first_frames[new_run][
+            np.cumsum(new_run) - 1]
+
+    def search_frames(self, frames):
+        """Find the master stimulus table row of each of an array of
+        (integer) frame indices.
+
+        A frame inside a stimulus epoch but outside of every interval of
+        the master table is assigned the most recent interval registered
+        within the epoch.
+
+        Returns
+        -------
+        np.ndarray
+            positions (iloc) of the master stimulus table rows of each frame,
+            or -1 for frames not registered to a stimulus
+        """
+        frames = np.asarray(frames)
+        rows = self.master_index.search(frames)
+
+        unregistered = (rows < 0) & (self.epoch_index.search(frames) >= 0)
+        if not np.any(unregistered) or len(self._master_first_frames) == 0:
+            return rows
+        frames = frames[unregistered]
+
+        # the last frame before each frame that lies in a master interval
+        index = np.searchsorted(self._master_first_frames, frames - 1,
+                                side="right") - 1
+        previous = np.minimum(
+            self._master_last_frames[np.maximum(index, 0)], frames - 1)
+
+        # every frame after that one must lie in an epoch
+        epoch = np.searchsorted(self._epoch_first_frames, frames,
+                                side="right") - 1
+        first_frame = np.maximum(self._epoch_run_starts[epoch],
+                                 self.epoch_df.iloc[0]["start"])
+        found = (index >= 0) & (previous + 1 >= first_frame)
+
+        rows[unregistered] = np.where(
+            found, self.master_index.search(previous), -1)
+        return rows
 
-    @memoize
     def search(self, fi):
-        try:
-            # Look in fine-grain tree:
-            search_result = self.master_bst.search(fi)
-            return search_result
-        except KeyError:
-            # Current frame not found in a fine-grain interval;
-            #   see if it is unregistered to a coarse-grain epoch:
-            try:
-                # THis will thow KeyError if not in coarse-grain epoch
-                self.epoch_bst.search(fi)
-
-                # Frame is in a coarse-grain  epoch, but not a fine grain
-                #   interval; look backwards to find most recent find nearest
-                #   matching interval
-                if fi < self.epoch_df.iloc[0]["start"]:
-                    return None
-                else:
-                    return self.search(fi - 1)
-
-            except KeyError:
-                # Frame is unregistered at the coarse level; return None
-                return None
+        row = self.search_frames([fi])[0]
+        if row < 0:
+            return None
+        return self.master_intervals[row]
 
 
 def rotate(X, Y, theta):
@@ -865,6 +980,7 @@ class ExperimentGeometry(object):
         self.eyepoint = eyepoint
 
         self._warp_coordinates = None
+        self._warp_operator = None
 
     @property
     def warp_coordinates(self):
@@ -873,6 +989,67 @@ class ExperimentGeometry(object):
 
         return self._warp_coordinates
 
+    @property
+    def warp_operator(self):
+        return self.get_warp_operator()
+
+    @property
+    def warp_operator_key(self):
+        """Identifies the geometry that a warp operator was built for"""
+        geometry = (
+            float(self.distance),
+            float(self.mon_height_cm),
+            float(self.mon_width_cm),
+            tuple(int(r) for r in self.mon_res),
+            tuple(float(e) for e in self.eyepoint),
+        )
+        return hashlib.sha1(repr(geometry).encode("utf-8")).hexdigest()
+
+    def get_warp_operator(self, cache_dir=None, mmap_mode=None):
+        """Sparse (display pixels x display pixels) operator that warps the
+        cubic spline coefficients of a display image, as
+        spline_interpolation_matrix.
+
+        Parameters
+        ----------
+        cache_dir: str
+            If provided, the operator is loaded from this directory if it
+            was previously built for the same geometry, and saved there if
+            it was not (even if the operator is already in memory).
+        mmap_mode: str
+            If provided (e.g. "r"), an operator loaded from cache_dir is
+            memory-mapped (see numpy.load) rather than read into memory, so
+            that processes warping images in parallel share one copy.
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+        """
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = os.path.join(
+                cache_dir, "warp_operator_%s" % self.warp_operator_key
+            )
+        is_cached = cache_path is not None and os.path.exists(cache_path)
+
+        if self._warp_operator is None:
+            if is_cached:
+                self._warp_operator = load_csr_matrix(cache_path, mmap_mode)
+            else:
+                self._warp_operator = spline_interpolation_matrix(
+                    self.warp_coordinates.T, self.mon_res[::-1]
+                )
+
+        if cache_path is not None and not is_cached:
+            save_csr_matrix(cache_path, self._warp_operator)
+
+        return self._warp_operator
+
+    def clear_warp_operator(self):
+        """Release the warp operator held in memory. It is rebuilt, or
+        loaded from a cache_dir, when next needed."""
+        self._warp_operator = None
+
     def generate_warp_coordinates(self):
         display_shape = self.mon_res
         x = np.array(range(display_shape[0])) - display_shape[0] / 2
@@ -948,6 +1125,69 @@ class BrainObservatoryMonitor(Monitor):
             img, self.experiment_geometry.warp_coordinates.T
         ).reshape((self.n_pixels_r, self.n_pixels_c))
 
+    def warp_images(
+        self, imgs, chunk_size=None, cache_dir=None,
+        max_buffer_bytes=WARP_BUFFER_BYTES
+    ):
+        """Warp a stack of display images at once. Matches warp_image applied
+        to each image, but interpolates with a sparse operator built once
+        per experiment geometry (see ExperimentGeometry.get_warp_operator).
+
+        Parameters
+        ----------
+        imgs: np.ndarray
+            (images x rows x columns) stack of display images
+        chunk_size: int
+            number of images warped at once. Defaults to as many as fit in
+            max_buffer_bytes of (float64) spline coefficient and
+            interpolated value buffers.
+        cache_dir: str
+            directory in which to cache the warp operator
+        max_buffer_bytes: int
+            bound on the size of the working buffers, used if chunk_size is
+            not provided
+
+        Returns
+        -------
+        np.ndarray
+            warped images, with the dtype of imgs
+        """
+        imgs = np.asarray(imgs)
+        assert imgs.shape[1:] == (self.n_pixels_r, self.n_pixels_c)
+        assert self.spatial_unit == "cm"
+
+        operator = self.experiment_geometry.get_warp_operator(cache_dir)
+
+        if chunk_size is None:
+            # coefficients and interpolated values of each image
+            image_bytes = 2 * np.dtype(np.float64).itemsize * np.prod(
+                imgs.shape[1:], dtype=np.int64
+            )
+            chunk_size = max(1, int(max_buffer_bytes // image_bytes))
+
+        warped = np.empty(imgs.shape, dtype=imgs.dtype)
+        for start in range(0, len(imgs), chunk_size):
+            chunk = imgs[start:start + chunk_size]
+
+            # the spline coefficients of each image, as map_coordinates
+            # computes them
+            coefficients = np.empty(chunk.shape, dtype=np.float64)
+            spndi.spline_filter1d(
+                chunk, 3, axis=1, output=coefficients, mode="constant"
+            )
+            spndi.spline_filter1d(
+                coefficients, 3, axis=2, output=coefficients, mode="constant"
+            )
+
+            values = operator.dot(
+                coefficients.reshape(len(chunk), -1).T
+            ).T.reshape(chunk.shape)
+            warped[start:start + chunk_size] = cast_interpolated(
+                values, imgs.dtype
+            )
+
+        return warped
+
     def grating_to_screen(
         self, phase, spatial_frequency, orientation, **kwargs
     ):
@@ -1065,39 +1305,176 @@ def warp_stimulus_coords(
     return retCoords
 
 
-def make_display_mask(display_shape=(1920, 1200)):
-    """Build a display-shaped mask that indicates which pixels are on screen
-    after warping the stimulus.
+def cubic_spline_weights(t):
+    """Weights of the 4 cubic B-spline coefficients around each point, given
+    the distance t (in [0, 1)) of each point past the second coefficient"""
+    t2 = t * t
+    t3 = t2 * t
+    return np.array(
+        [
+            (1.0 - t) ** 3 / 6.0,
+            (4.0 - 6.0 * t2 + 3.0 * t3) / 6.0,
+            (1.0 + 3.0 * t + 3.0 * t2 - 3.0 * t3) / 6.0,
+            t3 / 6.0,
+        ]
+    )
+
+
+def _mirror_index(index, size):
+    if size == 1:
+        return np.zeros_like(index)
+    period = 2 * (size - 1)
+    index = np.abs(index) % period
+    return np.where(index >= size, period - index, index)
+
+
+def spline_interpolation_matrix(coordinates, input_shape, chunk_size=2**18):
+    """Build a sparse matrix that evaluates cubic splines at a set of
+    coordinates. Applied to the (flattened) spline coefficients of an image
+    (see scipy.ndimage.spline_filter), it gives the same values as
+    scipy.ndimage.map_coordinates(image, coordinates) with mode="constant":
+    points outside of the image are 0, and coefficients beyond the edge of
+    the image are mirrored.
+
+    Parameters
+    ----------
+    coordinates: np.ndarray
+        (2 x points) array of (row, column) coordinates
+    input_shape: tuple
+        (rows, columns) of the image
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        (points x pixels) interpolation matrix
     """
-    x = np.array(range(display_shape[0])) - display_shape[0] / 2
-    y = np.array(range(display_shape[1])) - display_shape[1] / 2
-    display_coords = np.array(list(itertools.product(x, y)))
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    n_rows, n_cols = int(input_shape[0]), int(input_shape[1])
+
+    inside = (
+        (coordinates[0] >= 0)
+        & (coordinates[0] <= n_rows - 1)
+        & (coordinates[1] >= 0)
+        & (coordinates[1] <= n_cols - 1)
+    )
+    points = np.flatnonzero(inside)
+    offsets = np.arange(-1, 3)
+
+    data = []
+    indices = []
+    for start in range(0, len(points), chunk_size):
+        chunk_points = points[start:start + chunk_size]
+        row, col = coordinates[:, chunk_points]
+
+        first_row = np.floor(row)
+        first_col = np.floor(col)
+        row_weights = cubic_spline_weights(row - first_row)
+        col_weights = cubic_spline_weights(col - first_col)
+        rows = _mirror_index(
+            first_row.astype(np.int64) + offsets[:, np.newaxis], n_rows
+        )
+        cols = _mirror_index(
+            first_col.astype(np.int64) + offsets[:, np.newaxis], n_cols
+        )
 
-    warped_coords = warp_stimulus_coords(display_coords).astype(int)
+        # (4 x 4 x points) -> (points x 16)
+        data.append(
+            (row_weights[:, np.newaxis] * col_weights[np.newaxis])
+            .reshape(16, -1)
+            .T.ravel()
+        )
+        indices.append(
+            (rows[:, np.newaxis] * n_cols + cols[np.newaxis])
+            .reshape(16, -1)
+            .T.ravel()
+            .astype(np.int32)
+        )
 
-    off_warped_coords = np.array(
-        [
-            warped_coords[:, 0] + display_shape[0] / 2,
-            warped_coords[:, 1] + display_shape[1] / 2,
-        ]
+    indptr = np.zeros(coordinates.shape[1] + 1, dtype=np.int64)
+    np.cumsum(np.where(inside, 16, 0), out=indptr[1:])
+
+    matrix = sparse.csr_matrix(
+        (
+            np.concatenate(data) if data else np.zeros(0),
+            np.concatenate(indices) if indices else np.zeros(0, np.int32),
+            indptr,
+        ),
+        shape=(coordinates.shape[1], n_rows * n_cols),
     )
+    # coefficients mirrored at the edges may appear twice in a row
+    matrix.sum_duplicates()
+
+    return matrix
 
-    used_coords = set()
-    for i in range(off_warped_coords.shape[1]):
-        used_coords.add((off_warped_coords[0, i], off_warped_coords[1, i]))
 
-    used_coords = (
-        np.array([x for (x, y) in used_coords]).astype(int),
-        np.array([y for (x, y) in used_coords]).astype(int),
+def save_csr_matrix(path, matrix):
+    """Save a sparse matrix as a directory of uncompressed arrays, which
+    load_csr_matrix can memory-map"""
+    matrix = sparse.csr_matrix(matrix)
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    os.makedirs(temp_path, exist_ok=True)
+    for name in ("data", "indices", "indptr"):
+        np.save(os.path.join(temp_path, name + ".npy"), getattr(matrix, name))
+    np.save(os.path.join(temp_path, "shape.npy"), np.array(matrix.shape))
+
+    try:
+        os.rename(temp_path, path)
+    except OSError:
+        # saved concurrently by another process
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+
+def load_csr_matrix(path, mmap_mode=None):
+    """Load a sparse matrix saved by save_csr_matrix. With a mmap_mode,
+    its arrays are memory-mapped rather than copied into memory."""
+    data, indices, indptr = [
+        np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+        for name in ("data", "indices", "indptr")
+    ]
+    shape = tuple(np.load(os.path.join(path, "shape.npy")))
+    return sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+
+def cast_interpolated(values, dtype):
+    """Cast interpolated values to dtype as scipy.ndimage does: integers are
+    rounded half away from zero and clipped to the range of dtype"""
+    dtype = np.dtype(dtype)
+    if not np.issubdtype(dtype, np.integer):
+        return values.astype(dtype)
+
+    info = np.iinfo(dtype)
+    rounded = np.trunc(np.where(values > 0, values + 0.5, values - 0.5))
+    return np.clip(rounded, info.min, info.max).astype(dtype)
+
+
+@functools.lru_cache(maxsize=4)
+def _display_mask(display_shape):
+    x = np.arange(display_shape[0]) - display_shape[0] / 2
+    y = np.arange(display_shape[1]) - display_shape[1] / 2
+    xx, yy = np.meshgrid(x, y, indexing="ij")
+    display_coords = np.column_stack((xx.ravel(), yy.ravel()))
+
+    warped_coords = warp_stimulus_coords(display_coords).astype(int)
+
+    off_warped_coords = (
+        (warped_coords[:, 0] + display_shape[0] / 2).astype(int),
+        (warped_coords[:, 1] + display_shape[1] / 2).astype(int),
     )
 
     mask = np.zeros(display_shape)
 
-    mask[used_coords] = 1
+    mask[off_warped_coords] = 1
 
     return mask
 
 
+def make_display_mask(display_shape=(1920, 1200)):
+    """Build a display-shaped mask that indicates which pixels are on screen
+    after warping the stimulus.
+    """
+    return _display_mask(tuple(display_shape)).copy()
+
+
 def mask_stimulus_template(
     template_display_coords, template_shape, display_mask=None, threshold=1.0
 ):
@@ -1128,17 +1505,34 @@ def mask_stimulus_template(
     if display_mask is None:
         display_mask = make_display_mask()
 
-    frac = np.zeros(template_shape)
-    mask = np.zeros(template_shape, dtype=bool)
-    for y in range(template_shape[1]):
-        for x in range(template_shape[0]):
-            tdcm = np.where(
-                (template_display_coords[0, :, :] == x)
-                & (template_display_coords[1, :, :] == y)
-            )
-            v = display_mask[tdcm]
-            f = np.sum(v) / len(v)
-            frac[x, y] = f
-            mask[x, y] = f >= threshold
+    template_display_coords = np.asarray(template_display_coords)
+    x = template_display_coords[0]
+    y = template_display_coords[1]
+
+    # display coordinates that map onto a template pixel
+    on_template = (
+        (x == np.floor(x))
+        & (y == np.floor(y))
+        & (x >= 0)
+        & (x < template_shape[0])
+        & (y >= 0)
+        & (y < template_shape[1])
+    )
+    template_index = np.ravel_multi_index(
+        (x[on_template].astype(int), y[on_template].astype(int)),
+        template_shape,
+    )
+
+    size = int(np.prod(template_shape))
+    counts = np.bincount(template_index, minlength=size)
+    on_screen = np.bincount(
+        template_index,
+        weights=np.asarray(display_mask)[on_template],
+        minlength=size,
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = (on_screen / counts).reshape(template_shape)
+    mask = frac >= threshold
 
     return mask, frac
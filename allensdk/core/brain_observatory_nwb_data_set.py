@@ -33,6 +33,7 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
+import contextlib
 import functools
 import dateutil
 import re
@@ -141,6 +142,10 @@ class BrainObservatoryNwbDataSet(object):
         self.nwb_file = nwb_file
         self.pipeline_version = None
 
+        self._h5 = None
+        self._read_cache_bytes = None
+        self._loaded = {}
+
         if os.path.exists(self.nwb_file):
             meta = self.get_metadata()
             if meta and 'pipeline_version' in meta:
@@ -153,6 +158,71 @@ class BrainObservatoryNwbDataSet(object):
 
         self._stimulus_search = None
 
+    def open(self, read_cache_bytes=None):
+        ''' Keep the NWB file open for reading until close() is called, so
+        that getters share one file handle instead of reopening the file,
+        and metadata (cell specimen ids, ROI ids, timestamps) is read only
+        once. Also available as a context manager:
+
+            with BrainObservatoryNwbDataSet(nwb_file) as data_set:
+                ...
+
+        Parameters
+        ----------
+        read_cache_bytes: int (optional)
+            Size of the HDF5 chunk cache of each dataset. Defaults to the
+            h5py default (1 MB).
+
+        Returns
+        -------
+        self
+        '''
+        if self._h5 is None:
+            kwargs = {}
+            if read_cache_bytes is not None:
+                kwargs['rdcc_nbytes'] = int(read_cache_bytes)
+            self._h5 = h5py.File(self.nwb_file, 'r', **kwargs)
+            self._read_cache_bytes = read_cache_bytes
+        return self
+
+    def close(self):
+        ''' Close the file opened by open() and drop cached metadata '''
+        if self._h5 is not None:
+            self._h5.close()
+            self._h5 = None
+        self._loaded.clear()
+
+    @property
+    def is_open(self):
+        return self._h5 is not None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+    @contextlib.contextmanager
+    def _h5_file(self):
+        ''' The open NWB file, or the file opened for the duration of the
+        block if open() has not been called '''
+        if self._h5 is not None:
+            yield self._h5
+        else:
+            with h5py.File(self.nwb_file, 'r') as f:
+                yield f
+
+    def _load(self, key, loader):
+        ''' Load an array with loader(h5_file), keeping it in memory while
+        the file is open '''
+        if self._h5 is None:
+            with self._h5_file() as f:
+                return loader(f)
+
+        if key not in self._loaded:
+            self._loaded[key] = loader(self._h5)
+        return self._loaded[key].copy()
+
     def get_stimulus_epoch_table(self):
         '''Returns a pandas dataframe that summarizes the stimulus epoch duration for each acquisition time index in
         the experiment
@@ -247,7 +317,7 @@ class BrainObservatoryNwbDataSet(object):
             Fluorescence traces for each cell
         '''
         timestamps = self.get_fluorescence_timestamps()
-        with h5py.File(self.nwb_file, 'r') as f:
+        with self._h5_file() as f:
             ds = f['processing'][self.PIPELINE_DATASET][
                 'Fluorescence']['imaging_plane_1']['data']
 
@@ -255,17 +325,16 @@ class BrainObservatoryNwbDataSet(object):
                 cell_traces = ds[()]
             else:
                 inds = self.get_cell_specimen_indices(cell_specimen_ids)
-                cell_traces = ds[inds, :]
+                cell_traces = _read_rows(ds, inds)
 
         return timestamps, cell_traces
 
     def get_fluorescence_timestamps(self):
         ''' Returns an array of timestamps in seconds for the fluorescence traces '''
 
-        with h5py.File(self.nwb_file, 'r') as f:
-            timestamps = f['processing'][self.PIPELINE_DATASET][
-                'Fluorescence']['imaging_plane_1']['timestamps'][()]
-        return timestamps
+        return self._load('fluorescence_timestamps', lambda f: f['processing'][
+            self.PIPELINE_DATASET]['Fluorescence']['imaging_plane_1'][
+            'timestamps'][()])
 
     def get_neuropil_traces(self, cell_specimen_ids=None):
         ''' Returns an array of neuropil fluorescence traces for all ROIs
@@ -288,7 +357,7 @@ class BrainObservatoryNwbDataSet(object):
 
         timestamps = self.get_fluorescence_timestamps()
 
-        with h5py.File(self.nwb_file, 'r') as f:
+        with self._h5_file() as f:
             if self.pipeline_version >= parse_version("2.0"):
                 ds = f['processing'][self.PIPELINE_DATASET][
                     'Fluorescence']['imaging_plane_1_neuropil_response']['data']
@@ -300,7 +369,7 @@ class BrainObservatoryNwbDataSet(object):
                 np_traces = ds[()]
             else:
                 inds = self.get_cell_specimen_indices(cell_specimen_ids)
-                np_traces = ds[inds, :]
+                np_traces = _read_rows(ds, inds)
 
         return timestamps, np_traces
 
@@ -320,7 +389,7 @@ class BrainObservatoryNwbDataSet(object):
             Scalar for neuropil subtraction for each cell
         '''
 
-        with h5py.File(self.nwb_file, 'r') as f:
+        with self._h5_file() as f:
             if self.pipeline_version >= parse_version("2.0"):
                 r_ds = f['processing'][self.PIPELINE_DATASET][
                     'Fluorescence']['imaging_plane_1_neuropil_response']['r']
@@ -332,7 +401,7 @@ class BrainObservatoryNwbDataSet(object):
                 r = r_ds[()]
             else:
                 inds = self.get_cell_specimen_indices(cell_specimen_ids)
-                r = r_ds[inds]
+                r = _read_rows(r_ds, inds)
 
         return r
 
@@ -357,14 +426,14 @@ class BrainObservatoryNwbDataSet(object):
 
         timestamps = self.get_fluorescence_timestamps()
 
-        with h5py.File(self.nwb_file, 'r') as f:
+        with self._h5_file() as f:
             ds = f['processing'][self.PIPELINE_DATASET][
                 'Fluorescence']['imaging_plane_1_demixed_signal']['data']
             if cell_specimen_ids is None:
                 traces = ds[()]
             else:
                 inds = self.get_cell_specimen_indices(cell_specimen_ids)
-                traces = ds[inds, :]
+                traces = _read_rows(ds, inds)
 
         return timestamps, traces
 
@@ -410,13 +479,19 @@ class BrainObservatoryNwbDataSet(object):
 
         '''
 
-        all_cell_specimen_ids = list(self.get_cell_specimen_ids())
-        
-        try:
-            inds = [list(all_cell_specimen_ids).index(i)
-                    for i in cell_specimen_ids]
-        except ValueError as e:
-            raise ValueError("Cell specimen not found (%s)" % str(e))
+        # the first index of each id, as list.index
+        all_cell_specimen_ids = self.get_cell_specimen_ids().tolist()
+        index_of = {}
+        for i, cell_specimen_id in enumerate(all_cell_specimen_ids):
+            index_of.setdefault(cell_specimen_id, i)
+
+        inds = []
+        for cell_specimen_id in cell_specimen_ids:
+            try:
+                inds.append(index_of[cell_specimen_id])
+            except (KeyError, TypeError):
+                raise ValueError("Cell specimen not found (%s is not in list)"
+                                 % str(cell_specimen_id))
 
         return inds
 
@@ -438,7 +513,7 @@ class BrainObservatoryNwbDataSet(object):
         dF/F: 2D numpy array
             dF/F values for each cell
         '''
-        with h5py.File(self.nwb_file, 'r') as f:
+        with self._h5_file() as f:
             dff_ds = f['processing'][self.PIPELINE_DATASET][
                 'DfOverF']['imaging_plane_1']
 
@@ -448,7 +523,7 @@ class BrainObservatoryNwbDataSet(object):
                 cell_traces = dff_ds['data'][()]
             else:
                 inds = self.get_cell_specimen_indices(cell_specimen_ids)
-                cell_traces = dff_ds['data'][inds, :]
+                cell_traces = _read_rows(dff_ds['data'], inds)
 
         return timestamps, cell_traces
 
@@ -459,10 +534,8 @@ class BrainObservatoryNwbDataSet(object):
         -------
         ROI IDs: list
         '''
-        with h5py.File(self.nwb_file, 'r') as f:
-            roi_id = f['processing'][self.PIPELINE_DATASET][
-                'ImageSegmentation']['roi_ids'][()]
-        return roi_id
+        return self._load('roi_ids', lambda f: f['processing'][
+            self.PIPELINE_DATASET]['ImageSegmentation']['roi_ids'][()])
 
     def get_cell_specimen_ids(self):
         ''' Returns an array of cell IDs for all cells in the file
@@ -471,10 +544,9 @@ class BrainObservatoryNwbDataSet(object):
         -------
         cell specimen IDs: list
         '''
-        with h5py.File(self.nwb_file, 'r') as f:
-            cell_id = f['processing'][self.PIPELINE_DATASET][
-                'ImageSegmentation']['cell_specimen_ids'][()]
-        return cell_id
+        return self._load('cell_specimen_ids', lambda f: f['processing'][
+            self.PIPELINE_DATASET]['ImageSegmentation'][
+            'cell_specimen_ids'][()])
 
     def get_session_type(self):
         ''' Returns the type of experimental session, presently one of the
@@ -484,7 +556,7 @@ class BrainObservatoryNwbDataSet(object):
         -------
         session type: string
         '''
-        with h5py.File(self.nwb_file, 'r') as f:
+        with self._h5_file() as f:
             session_type = f['general/session_type'][()]
         return session_type.decode('utf-8')
 
@@ -496,7 +568,7 @@ class BrainObservatoryNwbDataSet(object):
         max projection: np.ndarray
         '''
 
-        with h5py.File(self.nwb_file, 'r') as f:
+        with self._h5_file() as f:
             max_projection = f['processing'][self.PIPELINE_DATASET]['ImageSegmentation'][
                 'imaging_plane_1']['reference_images']['maximum_intensity_projection_image']['data'][()]
         return max_projection
@@ -509,7 +581,7 @@ class BrainObservatoryNwbDataSet(object):
         stimuli: list of strings
         '''
 
-        with h5py.File(self.nwb_file, 'r') as f:
+        with self._h5_file() as f:
             keys = list(f["stimulus/presentation/"].keys())
         return [ k.replace('_stimulus', '') for k in keys ]
 
@@ -556,7 +628,7 @@ class BrainObservatoryNwbDataSet(object):
         if stimulus_name == 'master':
             return self._get_master_stimulus_table()
 
-        with h5py.File(self.nwb_file, 'r') as nwb_file:
+        with self._h5_file() as nwb_file:
 
             stimulus_group = _find_stimulus_presentation_group(nwb_file, stimulus_name)
 
@@ -595,7 +667,7 @@ class BrainObservatoryNwbDataSet(object):
         stimulus table: pd.DataFrame
         '''
         stim_name = stimulus_name + "_image_stack"
-        with h5py.File(self.nwb_file, 'r') as f:
+        with self._h5_file() as f:
             image_stack = f['stimulus']['templates'][stim_name]['data'][()]
         return image_stack
 
@@ -694,7 +766,7 @@ class BrainObservatoryNwbDataSet(object):
             List of ROI_Mask objects
         '''
 
-        with h5py.File(self.nwb_file, 'r') as f:
+        with self._h5_file() as f:
             mask_loc = f['processing'][self.PIPELINE_DATASET][
                 'ImageSegmentation']['imaging_plane_1']
             roi_list = f['processing'][self.PIPELINE_DATASET][
@@ -736,7 +808,7 @@ class BrainObservatoryNwbDataSet(object):
 
         meta = {}
 
-        with h5py.File(self.nwb_file, 'r') as f:
+        with self._h5_file() as f:
             for memory_key, disk_key in BrainObservatoryNwbDataSet.FILE_METADATA_MAPPING.items():
                 try:
                     v = f[disk_key][()]
@@ -803,7 +875,7 @@ class BrainObservatoryNwbDataSet(object):
     def get_running_speed(self):
         ''' Returns the mouse running speed in cm/s
         '''
-        with h5py.File(self.nwb_file, 'r') as f:
+        with self._h5_file() as f:
             dx_ds = f['processing'][self.PIPELINE_DATASET][
                 'BehavioralTimeSeries']['running_speed']
             dxcm = dx_ds['data'][()]
@@ -841,7 +913,7 @@ class BrainObservatoryNwbDataSet(object):
         else:
             location_key = "pupil_location"
         try:
-            with h5py.File(self.nwb_file, 'r') as f:
+            with self._h5_file() as f:
                 eye_tracking = f['processing'][self.PIPELINE_DATASET][
                     'EyeTracking'][location_key]
                 pupil_location = eye_tracking['data'][()]
@@ -861,7 +933,7 @@ class BrainObservatoryNwbDataSet(object):
             Areas is an (Nx1) array of pupil areas in pixels.
         '''
         try:
-            with h5py.File(self.nwb_file, 'r') as f:
+            with self._h5_file() as f:
                 pupil_tracking = f['processing'][self.PIPELINE_DATASET][
                     'PupilTracking']['pupil_size']
                 pupil_size = pupil_tracking['data'][()]
@@ -876,7 +948,7 @@ class BrainObservatoryNwbDataSet(object):
         '''
 
         motion_correction = None
-        with h5py.File(self.nwb_file, 'r') as f:
+        with self._h5_file() as f:
             pipeline_ds = f['processing'][self.PIPELINE_DATASET]
 
             # pipeline 0.9 stores this in xy_translations
@@ -909,18 +981,31 @@ class BrainObservatoryNwbDataSet(object):
 
         return motion_correction
 
+    @contextlib.contextmanager
+    def _closed_for_writing(self):
+        ''' Close the file opened by open(), if any, while writing to it '''
+        was_open = self.is_open
+        self.close()
+        try:
+            yield
+        finally:
+            if was_open:
+                self.open(self._read_cache_bytes)
+
     def save_analysis_dataframes(self, *tables):
-        store = pd.HDFStore(self.nwb_file, mode='a')
-        for k, v in tables:
-            store.put('analysis/%s' % (k), v)
-        store.close()
+        with self._closed_for_writing():
+            store = pd.HDFStore(self.nwb_file, mode='a')
+            for k, v in tables:
+                store.put('analysis/%s' % (k), v)
+            store.close()
 
     def save_analysis_arrays(self, *datasets):
-        with h5py.File(self.nwb_file, 'a') as f:
-            for k, v in datasets:
-                if k in f['analysis']:
-                    del f['analysis'][k]
-                f.create_dataset('analysis/%s' % k, data=v)
+        with self._closed_for_writing():
+            with h5py.File(self.nwb_file, 'a') as f:
+                for k, v in datasets:
+                    if k in f['analysis']:
+                        del f['analysis'][k]
+                    f.create_dataset('analysis/%s' % k, data=v)
 
     @property
     def stimulus_search(self):
@@ -930,20 +1015,85 @@ class BrainObservatoryNwbDataSet(object):
         return self._stimulus_search
 
     def get_stimulus(self, frame_ind):
+        ''' Find the stimulus shown at one or more imaging frames.
+
+        Parameters
+        ----------
+        frame_ind: int or array-like of int
+            Imaging frame index, or an array of them.  All frames of an array
+            are looked up together with StimulusSearch.search_frames.
+
+        Returns
+        -------
+        tuple :
+            (start, end, master stimulus table row) of the frame's stimulus
+            interval and the template image shown (or None), or (None, None)
+            if the frame is not registered to a stimulus or falls within
+            spontaneous activity.  A list of these tuples if frame_ind is an
+            array.
+        '''
+
+        search = self.stimulus_search
+        # each stimulus's template is loaded at most once per call
+        templates = {}
+        if np.ndim(frame_ind) == 0:
+            row = search.search_frames([frame_ind])[0]
+            return self._stimulus_for_master_row(row, templates)
 
-        search_result = self.stimulus_search.search(frame_ind)
+        return [self._stimulus_for_master_row(row, templates)
+                for row in search.search_frames(np.asarray(frame_ind))]
 
-        if search_result is None or search_result[2]['stimulus'] == si.SPONTANEOUS_ACTIVITY:
+    def _stimulus_for_master_row(self, row, templates):
+
+        if row < 0:
             return None, None
 
-        else:
+        search_result = self.stimulus_search.master_intervals[row]
+        curr_stimulus = search_result[2]['stimulus']
+        if curr_stimulus == si.SPONTANEOUS_ACTIVITY:
+            return None, None
+
+        elif curr_stimulus in si.LOCALLY_SPARSE_NOISE_STIMULUS_TYPES + \
+                si.NATURAL_MOVIE_STIMULUS_TYPES + [si.NATURAL_SCENES]:
+            curr_frame = search_result[2]['frame']
+            if curr_stimulus not in templates:
+                templates[curr_stimulus] = \
+                    self.get_stimulus_template(curr_stimulus)
+            template = templates[curr_stimulus]
+            return search_result, template[int(curr_frame), :, :]
+
+        elif curr_stimulus == si.STATIC_GRATINGS or \
+                curr_stimulus == si.DRIFTING_GRATINGS:
+            return search_result, None
+
+
+def _read_rows(ds, inds):
+    ''' Read rows of a dataset in any order, with repeats. h5py requires
+    increasing, unique indices, so each requested row is read once, in
+    sorted order, and the rows are then arranged in the requested order.
+
+    Parameters
+    ----------
+    ds : h5py.Dataset
+        Dataset to read
+    inds : list of int
+        Indices (along the first axis) of the rows to read
+
+    Returns
+    -------
+    np.ndarray :
+        The requested rows
+    '''
+    inds = np.asarray(inds, dtype=int)
+    if inds.size == 0:
+        return np.empty((0,) + ds.shape[1:], dtype=ds.dtype)
+
+    unique_inds, order = np.unique(inds, return_inverse=True)
+    rows = ds[unique_inds.tolist(), ...]
 
-            curr_stimulus = search_result[2]['stimulus']
-            if curr_stimulus in si.LOCALLY_SPARSE_NOISE_STIMULUS_TYPES + si.NATURAL_MOVIE_STIMULUS_TYPES + [si.NATURAL_SCENES]:
-                curr_frame = search_result[2]['frame']
-                return search_result, self.get_stimulus_template(curr_stimulus)[int(curr_frame), :, :]
-            elif curr_stimulus == si.STATIC_GRATINGS or curr_stimulus == si.DRIFTING_GRATINGS:
-                return search_result, None
+    if len(unique_inds) == len(inds) and np.all(order == np.arange(len(inds))):
+        return rows
+    return rows[order]
 
 
 def _find_stimulus_presentation_group(nwb_file,
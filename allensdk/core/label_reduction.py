@@ -0,0 +1,254 @@
+# Allen Institute Software License - This software license is the 2-clause BSD
+# license plus a third clause that prohibits redistribution for commercial
+# purposes without further permission.
+#
+# Copyright 2024. Allen Institute. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# 3. Redistributions for commercial purposes are not permitted without the
+# Allen Institute's written permission.
+# For purposes of this license, commercial purposes is the incorporation of the
+# Allen Institute's software into anything for which you will charge fees or
+# other compensation. Contact terms@alleninstitute.org for commercial licensing
+# opportunities.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import multiprocessing as mp
+import os
+import tempfile
+
+import nrrd
+import numpy as np
+
+
+def _statistic_reducer(statistic):
+    return lambda stats, voxel_volume: stats[statistic]
+
+
+def _mean_reducer(stats, voxel_volume):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return stats["sum"] / stats["count"]
+
+
+def _volume_reducer(stats, voxel_volume):
+    return stats["count_above"] * voxel_volume
+
+
+# Each reducer maps a dict of per-structure statistics ("count": number of
+# valid voxels, "sum": sum of values over valid voxels, "count_above": number
+# of valid voxels whose value exceeds the threshold) and the volume of one
+# voxel (mm^3) to an array of per-structure results.
+REDUCERS = {
+    "sum": _statistic_reducer("sum"),
+    "mean": _mean_reducer,
+    "voxel_count": _statistic_reducer("count_above"),
+    "volume": _volume_reducer,
+}
+
+STATISTICS = ("count", "sum", "count_above")
+
+# number of annotation voxels labeled at a time when building a LabelMap
+LABEL_CHUNK_VOXELS = 2 ** 22
+
+
+def _iter_fortran_chunks(volume, chunk_voxels=LABEL_CHUNK_VOXELS):
+    """ Yield consecutive pieces of np.ravel(volume, order="F") without
+    copying the whole volume, by slicing along its last axis.
+    """
+    if volume.ndim == 0:
+        yield np.ravel(volume)
+        return
+
+    slice_voxels = int(np.prod(volume.shape[:-1]))
+    step = max(1, chunk_voxels // max(1, slice_voxels))
+    for start in range(0, volume.shape[-1], step):
+        yield np.ravel(volume[..., start:start + step], order="F")
+
+
+class LabelMap(object):
+    """ Assigns each voxel of an annotation volume to a compact label index,
+    so that statistics of many volumes over every label can be computed with
+    one np.bincount per statistic.
+
+    Parameters
+    ----------
+    annotation : numpy ndarray
+        Volume of structure ids.
+
+    """
+
+    def __init__(self, annotation, chunk_voxels=LABEL_CHUNK_VOXELS):
+        self.shape = annotation.shape
+
+        labels = np.array([], dtype=annotation.dtype)
+        for chunk in _iter_fortran_chunks(annotation, chunk_voxels):
+            labels = np.union1d(labels, chunk)
+        self.labels = labels
+
+        self.label_index = np.empty(annotation.size, dtype=np.int32)
+        start = 0
+        for chunk in _iter_fortran_chunks(annotation, chunk_voxels):
+            self.label_index[start:start + chunk.size] = np.searchsorted(
+                self.labels, chunk)
+            start += chunk.size
+
+    @classmethod
+    def from_label_index(cls, labels, label_index, shape):
+        """ Build a LabelMap from precomputed labels and (possibly
+        memory-mapped) label indices.
+        """
+        label_map = cls.__new__(cls)
+        label_map.shape = tuple(shape)
+        label_map.labels = labels
+        label_map.label_index = label_index
+        return label_map
+
+    @property
+    def n_labels(self):
+        return len(self.labels)
+
+    def membership(self, structure_tree, structure_ids):
+        """ Build a matrix which aggregates per-label statistics to
+        per-structure statistics (including descendants).
+
+        Returns
+        -------
+        numpy ndarray :
+            structures X labels. 1 where the label is the structure or one of
+            its descendants, 0 otherwise.
+
+        """
+        membership = np.zeros((len(structure_ids), self.n_labels))
+        for ii, descendants in enumerate(
+                structure_tree.descendant_ids(structure_ids)):
+            membership[ii] = np.isin(self.labels, descendants)
+        return membership
+
+    def statistics(self, values, mask=None, threshold=0.0):
+        """ Compute per-label statistics of a volume
+
+        Parameters
+        ----------
+        values : numpy ndarray
+            Volume, shaped like the annotation.
+        mask : numpy ndarray, optional
+            If provided, only voxels where the mask is nonzero are counted.
+        threshold : float, optional
+            Voxels whose values exceed this are counted in "count_above".
+
+        Returns
+        -------
+        numpy ndarray :
+            (len(STATISTICS), n_labels)
+
+        """
+        if values.shape != self.shape:
+            raise ValueError(
+                "volume shape {} does not match annotation shape {}".format(
+                    values.shape, self.shape))
+
+        values = np.ravel(values, order="F").astype(np.float64)
+        if mask is None:
+            valid = None
+            count = np.bincount(self.label_index, minlength=self.n_labels)
+        else:
+            valid = np.ravel(mask, order="F") > 0
+            values = values * valid
+            count = np.bincount(self.label_index, weights=valid,
+                                minlength=self.n_labels)
+
+        above = values > threshold
+        if valid is not None:
+            above &= valid
+
+        return np.stack([
+            count,
+            np.bincount(self.label_index, weights=values,
+                        minlength=self.n_labels),
+            np.bincount(self.label_index, weights=above,
+                        minlength=self.n_labels),
+        ])
+
+
+def read_volume(path):
+    """ Read a volume from an nrrd file or a (memory-mapped) .npy file """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    return nrrd.read(path)[0]
+
+
+_worker_label_map = None
+
+
+def _init_worker(label_map):
+    global _worker_label_map
+    _worker_label_map = label_map
+
+
+def _init_shared_worker(labels, label_index_path, shape):
+    _init_worker(LabelMap.from_label_index(
+        labels, np.load(label_index_path, mmap_mode="r"), shape))
+
+
+def _volume_statistics(args):
+    key, volume_path, mask_path, threshold = args
+    mask = None if mask_path is None else read_volume(mask_path)
+    return key, _worker_label_map.statistics(
+        read_volume(volume_path), mask=mask, threshold=threshold)
+
+
+def iter_volume_statistics(label_map, tasks, num_workers=1):
+    """ Compute per-label statistics of many volumes, holding at most one
+    volume per worker in memory.
+
+    Parameters
+    ----------
+    label_map : LabelMap
+    tasks : list of tuple
+        (key, volume_path, mask_path or None, threshold)
+    num_workers : int
+        If greater than 1, volumes are read and reduced in a process pool.
+        The label index is then written to a temporary file, which the
+        workers memory-map rather than each receiving a copy.
+
+    Yields
+    ------
+    tuple :
+        key and statistics (see LabelMap.statistics), in the order of tasks.
+
+    """
+    if num_workers <= 1:
+        _init_worker(label_map)
+        for task in tasks:
+            yield _volume_statistics(task)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        label_index_path = os.path.join(tmp_dir, "label_index.npy")
+        np.save(label_index_path, label_map.label_index)
+
+        with mp.Pool(num_workers, initializer=_init_shared_worker,
+                     initargs=(label_map.labels, label_index_path,
+                               label_map.shape)) as pool:
+            for result in pool.imap(_volume_statistics, tasks):
+                yield result
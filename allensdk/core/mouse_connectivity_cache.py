@@ -48,7 +48,15 @@ from allensdk.api.warehouse_cache.cache import Cache, get_default_manifest_file
 from allensdk.config.manifest import Manifest
 from six.moves import reduce
 
+from .label_reduction import (
+    REDUCERS,
+    STATISTICS,
+    LabelMap,
+    iter_volume_statistics,
+)
 from .reference_space_cache import ReferenceSpaceCache
+from .structure_unionize_store import StructureUnionizeStore
+from .volume_cache import memmap_path
 
 
 class MouseConnectivityCache(ReferenceSpaceCache):
@@ -95,6 +103,17 @@ class MouseConnectivityCache(ReferenceSpaceCache):
         File name of the manifest to be read.  Default is
         "mouse_connectivity_manifest.json".
 
+    memory_map_volumes: boolean
+        If True, volumes (annotation, template, projection density, etc.)
+        are converted to uncompressed .npy files alongside the downloaded
+        nrrd files the first time they are read, and are returned as
+        read-only memory maps of those files. Recently opened volumes are
+        retained (see max_cached_volumes).  Default is False.
+
+    max_cached_volumes: int
+        Maximum number of memory-mapped volumes retained by this cache.
+        Default is 8.
+
     """
 
     PROJECTION_DENSITY_KEY = "PROJECTION_DENSITY"
@@ -102,6 +121,7 @@ class MouseConnectivityCache(ReferenceSpaceCache):
     INJECTION_FRACTION_KEY = "INJECTION_FRACTION"
     DATA_MASK_KEY = "DATA_MASK"
     STRUCTURE_UNIONIZES_KEY = "STRUCTURE_UNIONIZES"
+    STRUCTURE_UNIONIZES_STORE_KEY = "STRUCTURE_UNIONIZES_STORE"
     EXPERIMENTS_KEY = "EXPERIMENTS"
     DEFORMATION_FIELD_HEADER_KEY = "DEFORMATION_FIELD_HEADER"
     DEFORMATION_FIELD_VOXEL_KEY = "DEFORMATION_FIELD_VOXELS"
@@ -135,6 +155,8 @@ class MouseConnectivityCache(ReferenceSpaceCache):
         ccf_version=None,
         base_uri=None,
         version=None,
+        memory_map_volumes=False,
+        max_cached_volumes=8,
     ):
         if manifest_file is None:
             manifest_file = get_default_manifest_file("mouse_connectivity")
@@ -154,10 +176,16 @@ class MouseConnectivityCache(ReferenceSpaceCache):
             cache=cache,
             manifest=manifest_file,
             version=version,
+            memory_map_volumes=memory_map_volumes,
+            max_cached_volumes=max_cached_volumes,
         )
 
         self.api = MouseConnectivityApi(base_uri=base_uri)
 
+    def _download_volume(self, download, file_name, experiment_id):
+        download(file_name, experiment_id, self.resolution, strategy="lazy")
+        return nrrd.read(file_name)
+
     def get_projection_density(self, experiment_id, file_name=None):
         """
         Read a projection density volume for a single experiment.  Download it
@@ -185,12 +213,13 @@ class MouseConnectivityCache(ReferenceSpaceCache):
             self.resolution,
         )
 
-        self.api.download_projection_density(
-            file_name, experiment_id, self.resolution, strategy="lazy"
+        return self._read_volume(
+            file_name,
+            lambda: self._download_volume(
+                self.api.download_projection_density, file_name, experiment_id
+            ),
         )
 
-        return nrrd.read(file_name)
-
     def get_injection_density(self, experiment_id, file_name=None):
         """
         Read an injection density volume for a single experiment. Download it
@@ -218,12 +247,13 @@ class MouseConnectivityCache(ReferenceSpaceCache):
             experiment_id,
             self.resolution,
         )
-        self.api.download_injection_density(
-            file_name, experiment_id, self.resolution, strategy="lazy"
+        return self._read_volume(
+            file_name,
+            lambda: self._download_volume(
+                self.api.download_injection_density, file_name, experiment_id
+            ),
         )
 
-        return nrrd.read(file_name)
-
     def get_injection_fraction(self, experiment_id, file_name=None):
         """
         Read an injection fraction volume for a single experiment. Download it
@@ -250,12 +280,13 @@ class MouseConnectivityCache(ReferenceSpaceCache):
             experiment_id,
             self.resolution,
         )
-        self.api.download_injection_fraction(
-            file_name, experiment_id, self.resolution, strategy="lazy"
+        return self._read_volume(
+            file_name,
+            lambda: self._download_volume(
+                self.api.download_injection_fraction, file_name, experiment_id
+            ),
         )
 
-        return nrrd.read(file_name)
-
     def get_data_mask(self, experiment_id, file_name=None):
         """
         Read a data mask volume for a single experiment. Download it
@@ -279,12 +310,13 @@ class MouseConnectivityCache(ReferenceSpaceCache):
         file_name = self.get_cache_path(
             file_name, self.DATA_MASK_KEY, experiment_id, self.resolution
         )
-        self.api.download_data_mask(
-            file_name, experiment_id, self.resolution, strategy="lazy"
+        return self._read_volume(
+            file_name,
+            lambda: self._download_volume(
+                self.api.download_data_mask, file_name, experiment_id
+            ),
         )
 
-        return nrrd.read(file_name)
-
     def get_experiments(
         self,
         dataframe=False,
@@ -694,20 +726,69 @@ class MouseConnectivityCache(ReferenceSpaceCache):
             or set of hemispheres. Left = 1, Right = 2, Both = 3.  If None,
             include all
             records [1, 2, 3].  Default None.
+
+        Notes
+        -----
+        When caching is enabled, each experiment's unionizes are added to a
+        consolidated store (see get_structure_unionize_store) the first time
+        they are requested, and are subsequently loaded from there.
         """
 
-        unionizes = [
-            self.get_experiment_structure_unionizes(
-                eid,
-                is_injection=is_injection,
-                structure_ids=structure_ids,
-                include_descendants=include_descendants,
-                hemisphere_ids=hemisphere_ids,
+        store = self.get_structure_unionize_store()
+
+        if store is None:
+            unionizes = [
+                self.get_experiment_structure_unionizes(
+                    eid,
+                    is_injection=is_injection,
+                    structure_ids=structure_ids,
+                    include_descendants=include_descendants,
+                    hemisphere_ids=hemisphere_ids,
+                )
+                for eid in experiment_ids
+            ]
+            return pd.concat(unionizes, ignore_index=True, sort=True)
+
+        for eid in experiment_ids:
+            if not store.has_experiment(eid):
+                store.add_experiments(
+                    {eid: self.get_experiment_structure_unionizes(eid)}
+                )
+
+        unionizes = self.filter_structure_unionizes(
+            store.get_unionizes(experiment_ids),
+            is_injection=is_injection,
+            structure_ids=structure_ids,
+            include_descendants=include_descendants,
+            hemisphere_ids=hemisphere_ids,
+        )
+        return unionizes.reset_index(drop=True)
+
+    def get_structure_unionize_store(self):
+        """
+        Get the consolidated store of cached structure unionizes.
+
+        Returns
+        -------
+        StructureUnionizeStore or None :
+            None if caching is disabled or the manifest predates the store.
+        """
+        try:
+            path = self.get_cache_path(
+                None, self.STRUCTURE_UNIONIZES_STORE_KEY
             )
-            for eid in experiment_ids
-        ]
+        except KeyError:
+            return None
+
+        if path is None:
+            return None
 
-        return pd.concat(unionizes, ignore_index=True, sort=True)
+        store = getattr(self, "_structure_unionize_store", None)
+        if store is None or store.path != path:
+            store = StructureUnionizeStore(path)
+            self._structure_unionize_store = store
+
+        return store
 
     def get_projection_matrix(
         self,
@@ -736,14 +817,7 @@ class MouseConnectivityCache(ReferenceSpaceCache):
         matrix = np.empty((nrows, ncolumns))
         matrix[:] = np.NAN
 
-        row_lookup = {}
-        for idx, e in enumerate(experiment_ids):
-            row_lookup[e] = idx
-
-        column_lookup = {}
         columns = []
-
-        cidx = 0
         hlabel = {1: "-L", 2: "-R", 3: ""}
 
         acronym_map = self.get_structure_tree().value_map(
@@ -752,18 +826,34 @@ class MouseConnectivityCache(ReferenceSpaceCache):
 
         for hid in hemisphere_ids:
             for sid in projection_structure_ids:
-                column_lookup[(hid, sid)] = cidx
                 label = acronym_map[sid] + hlabel[hid]
                 columns.append(
                     {"hemisphere_id": hid, "structure_id": sid, "label": label}
                 )
-                cidx += 1
 
-        for _, row in unionizes.iterrows():
-            ridx = row_lookup[row["experiment_id"]]
-            k = (row["hemisphere_id"], row["structure_id"])
-            cidx = column_lookup[k]
-            matrix[ridx, cidx] = row[parameter]
+        # scatter each unionize record into the (experiment, hemisphere
+        # and structure) cell of the matrix
+        row_lookup = pd.Index(experiment_ids)
+        column_lookup = pd.MultiIndex.from_tuples(
+            [(c["hemisphere_id"], c["structure_id"]) for c in columns]
+        )
+        ridx = row_lookup.get_indexer(unionizes["experiment_id"].values)
+        cidx = column_lookup.get_indexer(
+            pd.MultiIndex.from_arrays(
+                [
+                    unionizes["hemisphere_id"].values,
+                    unionizes["structure_id"].values,
+                ]
+            )
+        )
+        if np.any(ridx < 0) or np.any(cidx < 0):
+            raise KeyError(
+                "unionize records do not match the requested experiments, "
+                "structures and hemispheres"
+            )
+
+        values = np.asarray(unionizes[parameter], dtype=float)
+        matrix[ridx, cidx] = values.reshape(len(unionizes), -1)[:, 0]
 
         if dataframe:
             warnings.warn("dataframe argument is deprecated.")
@@ -781,6 +871,156 @@ class MouseConnectivityCache(ReferenceSpaceCache):
                 "columns": columns,
             }
 
+    def _get_volume_path(self, volume, experiment_id):
+        """Download (if needed) an experiment's volume and return the path
+        from which it should be read. If memory_map_volumes is set, this is
+        the converted .npy file.
+        """
+        keys = {
+            "projection_density": self.PROJECTION_DENSITY_KEY,
+            "injection_density": self.INJECTION_DENSITY_KEY,
+            "injection_fraction": self.INJECTION_FRACTION_KEY,
+            "data_mask": self.DATA_MASK_KEY,
+        }
+        if volume not in keys:
+            raise ValueError(
+                "volume must be one of {}, got {}".format(
+                    sorted(keys), volume
+                )
+            )
+
+        file_name = self.get_cache_path(
+            None, keys[volume], experiment_id, self.resolution
+        )
+        download = getattr(self.api, "download_{}".format(volume))
+        if self.memory_map_volumes:
+            self._read_volume(
+                file_name,
+                lambda: self._download_volume(
+                    download, file_name, experiment_id
+                ),
+            )
+            return memmap_path(file_name)
+
+        download(file_name, experiment_id, self.resolution, strategy="lazy")
+        return file_name
+
+    def reduce_volumes(
+        self,
+        experiment_ids,
+        structure_ids=None,
+        reducers=("sum", "mean", "volume"),
+        volume="projection_density",
+        threshold=0.0,
+        use_data_mask=False,
+        num_workers=1,
+    ):
+        """
+        Compute per-structure statistics of a volume (e.g. projection
+        density) across many experiments. Volumes are streamed, so that at
+        most one volume per worker is held in memory, and every structure's
+        statistics are computed in one pass over each volume.
+
+        Parameters
+        ----------
+
+        experiment_ids: list
+            Experiments whose volumes will be reduced.
+
+        structure_ids: list
+            Structures (including their descendants) over which to reduce.
+            Defaults to the summary structures.
+
+        reducers: list or dict
+            Names of reducers in label_reduction.REDUCERS ("sum", "mean",
+            "voxel_count", "volume"), or a dict mapping output names to
+            functions of (statistics, voxel_volume), where statistics is a
+            dict of per-structure "count", "sum" and "count_above" arrays and
+            voxel_volume is in mm^3.
+
+        volume: string
+            One of "projection_density", "injection_density" or
+            "injection_fraction".  Default is "projection_density".
+
+        threshold: float
+            "voxel_count" and "volume" count voxels whose values exceed this.
+            Default is 0.
+
+        use_data_mask: boolean
+            If True, only voxels within each experiment's data mask are
+            counted.  Default is False.
+
+        num_workers: int
+            Number of processes used to read and reduce volumes.  Default
+            is 1 (no pool).
+
+        Returns
+        -------
+        pd.DataFrame :
+            Indexed by experiment id. Columns are a (reducer, structure_id)
+            MultiIndex, so that result[reducer] is an experiment X
+            structure table.
+
+        Notes
+        -----
+        Both hemispheres are reduced together (i.e. these correspond to
+        unionize records with hemisphere_id 3).
+
+        """
+
+        if structure_ids is None:
+            structure_ids = self.default_structure_ids
+        structure_ids = self.validate_structure_ids(list(structure_ids))
+
+        if not isinstance(reducers, dict):
+            reducers = {name: REDUCERS[name] for name in reducers}
+
+        annotation, _ = self.get_annotation_volume()
+        label_map = LabelMap(annotation)
+        del annotation
+        membership = label_map.membership(
+            self.get_structure_tree(), structure_ids
+        )
+
+        tasks = [
+            (
+                eid,
+                self._get_volume_path(volume, eid),
+                self._get_volume_path("data_mask", eid)
+                if use_data_mask
+                else None,
+                threshold,
+            )
+            for eid in experiment_ids
+        ]
+
+        voxel_volume = (self.resolution / 1000.0) ** 3
+        results = {name: [] for name in reducers}
+        for _, label_statistics in iter_volume_statistics(
+            label_map, tasks, num_workers
+        ):
+            # aggregate per-label statistics to (overlapping) structures
+            statistics = dict(
+                zip(STATISTICS, label_statistics @ membership.T)
+            )
+            for name, reducer in reducers.items():
+                results[name].append(reducer(statistics, voxel_volume))
+
+        return pd.concat(
+            {
+                name: pd.DataFrame(
+                    np.reshape(
+                        values, (len(experiment_ids), len(structure_ids))
+                    ),
+                    index=pd.Index(experiment_ids, name="experiment_id"),
+                    columns=pd.Index(structure_ids, name="structure_id"),
+                )
+                for name, values in results.items()
+            },
+            axis=1,
+            names=["reducer"],
+        )
+
     def get_deformation_field(
         self, section_data_set_id, header_path=None, voxel_path=None
     ):
@@ -926,6 +1166,13 @@ class MouseConnectivityCache(ReferenceSpaceCache):
             typename="file",
         )
 
+        manifest_builder.add_path(
+            self.STRUCTURE_UNIONIZES_STORE_KEY,
+            "structure_unionizes.h5",
+            parent_key="BASEDIR",
+            typename="file",
+        )
+
         manifest_builder.add_path(
             self.INJECTION_DENSITY_KEY,
             "experiment_%d/injection_density_%d.nrrd",
@@ -33,6 +33,8 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
+from contextlib import contextmanager
+
 import h5py
 import numpy as np
 
@@ -58,6 +60,41 @@ class NwbDataSet(object):
         else:
             self.spike_time_key = spike_time_key
 
+        self._file = None
+        self._sweeps = {}
+
+    @contextmanager
+    def open_file(self):
+        """ Keep the NWB file open for reading while in this context.
+        Sweeps read with get_sweep are decoded once and then returned from
+        memory until the context exits. Methods which modify the file must
+        not be called within this context.
+
+        Yields
+        ------
+        NwbDataSet
+            this data set
+        """
+        if self._file is not None:
+            yield self
+            return
+
+        self._file = h5py.File(self.file_name, 'r')
+        try:
+            yield self
+        finally:
+            self._file.close()
+            self._file = None
+            self._sweeps = {}
+
+    @contextmanager
+    def _read_file(self):
+        if self._file is not None:
+            yield self._file
+        else:
+            with h5py.File(self.file_name, 'r') as f:
+                yield f
+
     def get_sweep(self, sweep_number):
         """ Retrieve the stimulus, response, index_range, and sampling rate
         for a particular sweep.  This method hides the NWB file's distinction
@@ -83,75 +120,83 @@ class NwbDataSet(object):
             the first element indicates the end of the test pulse and the
             second index is the end of valid response data.
         """
-        with h5py.File(self.file_name, 'r') as f:
-
-            swp = f['epochs']['Sweep_%d' % sweep_number]
-
-            # fetch data from file and convert to correct SI unit
-            # this operation depends on file version. early versions of
-            #   the file have incorrect conversion information embedded
-            #   in the nwb file and data was stored in the appropriate
-            #   SI unit. For those files, return uncorrected data.
-            #   For newer files (1.1 and later), apply conversion value.
-            major, minor = self.get_pipeline_version()
-            if (major == 1 and minor > 0) or major > 1:
-                # stimulus
-                stimulus_dataset = swp['stimulus']['timeseries']['data']
-                conversion = float(stimulus_dataset.attrs["conversion"])
-                stimulus = stimulus_dataset[()] * conversion
-                # acquisition
-                response_dataset = swp['response']['timeseries']['data']
-                conversion = float(response_dataset.attrs["conversion"])
-                response = response_dataset[()] * conversion
-            else:  # old file version
-                stimulus_dataset = swp['stimulus']['timeseries']['data']
-                stimulus = stimulus_dataset[()]
-                response = swp['response']['timeseries']['data'][()]
-
-            if 'unit' in stimulus_dataset.attrs:
-                unit = stimulus_dataset.attrs["unit"].decode('UTF-8')
-
-                unit_str = None
-                if unit.startswith('A'):
-                    unit_str = "Amps"
-                elif unit.startswith('V'):
-                    unit_str = "Volts"
-                assert unit_str is not None, Exception(
-                    "Stimulus time series unit not recognized")
-            else:
-                unit = None
-                unit_str = 'Unknown'
+        if self._file is not None:
+            if sweep_number not in self._sweeps:
+                self._sweeps[sweep_number] = self._read_sweep(self._file,
+                                                              sweep_number)
+            return self._sweeps[sweep_number]
+
+        with self._read_file() as f:
+            return self._read_sweep(f, sweep_number)
+
+    def _read_sweep(self, f, sweep_number):
+        swp = f['epochs']['Sweep_%d' % sweep_number]
+
+        # fetch data from file and convert to correct SI unit
+        # this operation depends on file version. early versions of
+        #   the file have incorrect conversion information embedded
+        #   in the nwb file and data was stored in the appropriate
+        #   SI unit. For those files, return uncorrected data.
+        #   For newer files (1.1 and later), apply conversion value.
+        major, minor = self._read_pipeline_version(f)
+        if (major == 1 and minor > 0) or major > 1:
+            # stimulus
+            stimulus_dataset = swp['stimulus']['timeseries']['data']
+            conversion = float(stimulus_dataset.attrs["conversion"])
+            stimulus = stimulus_dataset[()] * conversion
+            # acquisition
+            response_dataset = swp['response']['timeseries']['data']
+            conversion = float(response_dataset.attrs["conversion"])
+            response = response_dataset[()] * conversion
+        else:  # old file version
+            stimulus_dataset = swp['stimulus']['timeseries']['data']
+            stimulus = stimulus_dataset[()]
+            response = swp['response']['timeseries']['data'][()]
+
+        if 'unit' in stimulus_dataset.attrs:
+            unit = stimulus_dataset.attrs["unit"].decode('UTF-8')
+
+            unit_str = None
+            if unit.startswith('A'):
+                unit_str = "Amps"
+            elif unit.startswith('V'):
+                unit_str = "Volts"
+            assert unit_str is not None, Exception(
+                "Stimulus time series unit not recognized")
+        else:
+            unit = None
+            unit_str = 'Unknown'
 
-            swp_idx_start = swp['stimulus']['idx_start'][()]
-            swp_length = swp['stimulus']['count'][()]
+        swp_idx_start = swp['stimulus']['idx_start'][()]
+        swp_length = swp['stimulus']['count'][()]
 
-            swp_idx_stop = swp_idx_start + swp_length - 1
-            sweep_index_range = (swp_idx_start, swp_idx_stop)
+        swp_idx_stop = swp_idx_start + swp_length - 1
+        sweep_index_range = (swp_idx_start, swp_idx_stop)
 
-            # if the sweep has an experiment, extract the experiment's index
-            # range
-            try:
-                exp = f['epochs']['Experiment_%d' % sweep_number]
-                exp_idx_start = exp['stimulus']['idx_start'][()]
-                exp_length = exp['stimulus']['count'][()]
-                exp_idx_stop = exp_idx_start + exp_length - 1
-                experiment_index_range = (exp_idx_start, exp_idx_stop)
-            except KeyError:
-                # this sweep has no experiment.  return the index range of the
-                # entire sweep.
-                experiment_index_range = sweep_index_range
-
-            assert sweep_index_range[0] == 0, Exception(
-                "index range of the full sweep does not start at 0.")
-
-            return {
-                'stimulus': stimulus,
-                'response': response,
-                'stimulus_unit': unit_str,
-                'index_range': experiment_index_range,
-                'sampling_rate': 1.0 * swp['stimulus']['timeseries'][
-                    'starting_time'].attrs['rate']
-            }
+        # if the sweep has an experiment, extract the experiment's index
+        # range
+        try:
+            exp = f['epochs']['Experiment_%d' % sweep_number]
+            exp_idx_start = exp['stimulus']['idx_start'][()]
+            exp_length = exp['stimulus']['count'][()]
+            exp_idx_stop = exp_idx_start + exp_length - 1
+            experiment_index_range = (exp_idx_start, exp_idx_stop)
+        except KeyError:
+            # this sweep has no experiment.  return the index range of the
+            # entire sweep.
+            experiment_index_range = sweep_index_range
+
+        assert sweep_index_range[0] == 0, Exception(
+            "index range of the full sweep does not start at 0.")
+
+        return {
+            'stimulus': stimulus,
+            'response': response,
+            'stimulus_unit': unit_str,
+            'index_range': experiment_index_range,
+            'sampling_rate': 1.0 * swp['stimulus']['timeseries'][
+                'starting_time'].attrs['rate']
+        }
 
     def set_sweep(self, sweep_number, stimulus, response):
         """ Overwrite the stimulus or response of an NWB file.
@@ -209,17 +254,21 @@ class NwbDataSet(object):
             -------
             int tuple: (major, minor)
         """
+        with self._read_file() as f:
+            return self._read_pipeline_version(f)
+
+    @staticmethod
+    def _read_pipeline_version(f):
         try:
-            with h5py.File(self.file_name, 'r') as f:
-                if 'generated_by' in f["general"]:
-                    info = f["general/generated_by"]
-                    # generated_by stores array of keys and values
-                    # keys are even numbered, corresponding values are in
-                    #   odd indices
-                    for i in range(len(info)):
-                        if info[i] == 'version':
-                            version = info[i + 1]
-                            break
+            if 'generated_by' in f["general"]:
+                info = f["general/generated_by"]
+                # generated_by stores array of keys and values
+                # keys are even numbered, corresponding values are in
+                #   odd indices
+                for i in range(len(info)):
+                    if info[i] == 'version':
+                        version = info[i + 1]
+                        break
             toks = version.split('.')
             if len(toks) >= 2:
                 major = int(toks[0])
@@ -249,7 +298,7 @@ class NwbDataSet(object):
         if key is None:
             key = self.spike_time_key
 
-        with h5py.File(self.file_name, 'r') as f:
+        with self._read_file() as f:
             datasets = ["analysis/%s/Sweep_%d" % (key, sweep_number),
                         "analysis/%s/Sweep_%d" % (
                         self.DEPRECATED_SPIKE_TIMES, sweep_number)]
@@ -306,7 +355,7 @@ class NwbDataSet(object):
         """ Get all of the sweep numbers in the file, including test sweeps.
         """
 
-        with h5py.File(self.file_name, 'r') as f:
+        with self._read_file() as f:
             sweeps = [int(e.split('_')[1])
                       for e in f['epochs'].keys() if e.startswith('Sweep_')]
             return sweeps
@@ -315,7 +364,7 @@ class NwbDataSet(object):
         """ Get all of the sweep numbers for experiment epochs in the file,
         not including test sweeps. """
 
-        with h5py.File(self.file_name, 'r') as f:
+        with self._read_file() as f:
             sweeps = [int(e.split('_')[1])
                       for e in f['epochs'].keys() if
                       e.startswith('Experiment_')]
@@ -380,7 +429,7 @@ class NwbDataSet(object):
             specific fields are ones encoded in the original AIBS in vitro
             .nwb files.
         """
-        with h5py.File(self.file_name, 'r') as f:
+        with self._read_file() as f:
 
             sweep_metadata = {}
 
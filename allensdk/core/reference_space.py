@@ -48,8 +48,103 @@ import pandas as pd
 from allensdk.core.structure_tree import StructureTree
 
 
+class SparseMask(object):
+
+    def __init__(self, indices, shape):
+        '''A binary volume mask stored as the flat (C-order) indices of its 
+        voxels.
+        
+        Parameters
+        ----------
+        indices : numpy ndarray
+            Sorted flat indices of voxels inside the mask.
+        shape : tuple of int
+            Shape of the masked volume.
+        
+        '''
+        
+        self.indices = indices
+        self.shape = tuple(shape)
+        
+    def __len__(self):
+        return len(self.indices)
+        
+    def to_dense(self):
+        '''Returns a uint8 array of shape self.shape. 1 inside mask, 0 
+        outside.
+        '''
+    
+        mask = np.zeros(self.shape, dtype=np.uint8, order='C')
+        mask.reshape(-1)[self.indices] = 1
+        return mask
+        
+    def to_run_length(self):
+        '''Returns the equivalent RunLengthMask
+        '''
+        
+        indices = np.asarray(self.indices, dtype=np.int64)
+        if indices.size == 0:
+            return RunLengthMask(indices, indices, self.shape)
+        
+        breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+        starts = indices[np.concatenate([[0], breaks])]
+        stops = indices[np.concatenate([breaks - 1, [indices.size - 1]])]
+        return RunLengthMask(starts, stops - starts + 1, self.shape)
+        
+
+class RunLengthMask(object):
+
+    def __init__(self, starts, lengths, shape):
+        '''A binary volume mask stored as runs of consecutive voxels in flat 
+        (C-order) indexing.
+        
+        Parameters
+        ----------
+        starts : numpy ndarray
+            Flat index of the first voxel of each run.
+        lengths : numpy ndarray
+            Number of voxels in each run.
+        shape : tuple of int
+            Shape of the masked volume.
+        
+        '''
+        
+        self.starts = starts
+        self.lengths = lengths
+        self.shape = tuple(shape)
+        
+    def __len__(self):
+        return int(np.sum(self.lengths))
+        
+    def to_dense(self):
+        '''Returns a uint8 array of shape self.shape. 1 inside mask, 0 
+        outside.
+        '''
+        
+        edges = np.zeros(int(np.prod(self.shape)) + 1, dtype=np.int8)
+        np.add.at(edges, self.starts, 1)
+        np.add.at(edges, np.asarray(self.starts) + self.lengths, -1)
+        
+        mask = np.cumsum(edges[:-1], dtype=np.int8).astype(np.uint8)
+        return mask.reshape(self.shape)
+        
+    def to_sparse(self):
+        '''Returns the equivalent SparseMask
+        '''
+    
+        starts = np.asarray(self.starts, dtype=np.int64)
+        lengths = np.asarray(self.lengths, dtype=np.int64)
+        
+        # offset of each voxel from its run's start
+        run_offsets = np.cumsum(lengths) - lengths
+        within = np.arange(lengths.sum()) - np.repeat(run_offsets, lengths)
+        return SparseMask(np.repeat(starts, lengths) + within, self.shape)
+
+
 class ReferenceSpace(object):
 
+    MASK_FORMATS = ('dense', 'sparse', 'run_length')
+
     @property
     def direct_voxel_map(self):
         if not hasattr(self, '_direct_voxel_map'):
@@ -89,6 +184,84 @@ class ReferenceSpace(object):
         
         self.annotation = np.ascontiguousarray(annotation)
         
+    def _get_voxel_index(self):
+        '''Sorts the annotated voxels by structure, so that each structure's 
+        voxels can be looked up without scanning the annotation.
+        
+        Returns
+        -------
+        numpy ndarray : 
+            Sorted ids of the structures present in the annotation.
+        numpy ndarray : 
+            Structure i's voxels are found at 
+            voxel_indices[offsets[i]:offsets[i + 1]].
+        numpy ndarray : 
+            Flat indices of all annotated voxels, grouped by structure and 
+            ascending within each structure.
+        
+        '''
+    
+        if not hasattr(self, '_voxel_index'):
+        
+            flat = self.annotation.reshape(-1)
+            voxel_indices = np.flatnonzero(flat)
+            if flat.size <= np.iinfo(np.uint32).max:
+                voxel_indices = voxel_indices.astype(np.uint32)
+
+            labels = flat[voxel_indices]
+            order = np.argsort(labels, kind='stable')
+            voxel_indices = voxel_indices[order]
+            labels = labels[order]
+            del order
+            
+            starts = np.flatnonzero(np.diff(labels)) + 1
+            structure_ids = labels[np.concatenate([[0], starts])] \
+                if labels.size else labels
+            offsets = np.concatenate([[0], starts, [labels.size]])
+            
+            self._voxel_index = (structure_ids, offsets, voxel_indices)
+            
+        return self._voxel_index
+        
+    def structure_voxel_indices(self, structure_ids, direct_only=False):
+        '''Find the voxels assigned to one or more structures
+        
+        Parameters
+        ----------
+        structure_ids : list of int
+            Find the union of these structures' voxels
+        direct_only : bool, optional
+            If True, only include voxels directly assigned to a structure. 
+            Otherwise include voxels assigned to descendants.
+            
+        Returns
+        -------
+        numpy ndarray :
+            Sorted flat (C-order) indices into the annotation.
+        
+        '''
+        
+        if not direct_only:
+            structure_ids = self.structure_tree.descendant_ids(structure_ids)
+            structure_ids = functools.reduce(op.add, structure_ids, [])
+            
+        index_ids, offsets, voxel_indices = self._get_voxel_index()
+        
+        structure_ids = np.unique(np.asarray(list(structure_ids)))
+        positions = np.searchsorted(index_ids, structure_ids)
+        present = positions < len(index_ids)
+        present[present] = \
+            index_ids[positions[present]] == structure_ids[present]
+        positions = positions[present]
+        
+        found = [voxel_indices[offsets[ii]:offsets[ii + 1]] 
+                 for ii in positions]
+        if len(found) == 0:
+            return voxel_indices[:0]
+        elif len(found) == 1:
+            return found[0]
+        return np.sort(np.concatenate(found))
+        
     def direct_voxel_counts(self):
         '''Determines the number of voxels directly assigned to one or more 
         structures.
@@ -118,13 +291,22 @@ class ReferenceSpace(object):
             to structures' descendants.
         
         ''' 
+        
+        # visit structures in reversed preorder, so that each structure's 
+        # children are totaled before it is
+        tree = self.structure_tree
+        order = [stid for stid in tree.node_ids() 
+                 if tree.parent_ids([stid])[0] is None]
+        ii = 0
+        while ii < len(order):
+            order.extend(tree.child_ids([order[ii]])[0])
+            ii += 1
 
         self._total_voxel_map = {}
-        for stid in self.structure_tree.node_ids():
-
-            desc_ids = self.structure_tree.descendant_ids([stid])[0]
-            self._total_voxel_map[stid] = sum([self.direct_voxel_map[dscid] 
-                                               for dscid in desc_ids])
+        for stid in reversed(order):
+            self._total_voxel_map[stid] = self.direct_voxel_map[stid] + sum(
+                [self._total_voxel_map[cid] 
+                 for cid in tree.child_ids([stid])[0]])
     
     def remove_unassigned(self, update_self=True):
         '''Obtains a structure tree consisting only of structures that have 
@@ -150,7 +332,8 @@ class ReferenceSpace(object):
             
         return structures
     
-    def make_structure_mask(self, structure_ids, direct_only=False):
+    def make_structure_mask(self, structure_ids, direct_only=False, 
+                            mask_format='dense'):
         '''Return an indicator array for one or more structures
         
         Parameters
@@ -160,32 +343,38 @@ class ReferenceSpace(object):
         direct_only : bool, optional
             If True, only include voxels directly assigned to a structure in 
             the mask. Otherwise include voxels assigned to descendants.
+        mask_format : str, optional
+            One of 'dense' (default), 'sparse' or 'run_length'.
             
         Returns
         -------
-        numpy ndarray :
+        numpy ndarray, SparseMask or RunLengthMask :
             Same shape as annotation. 1 inside mask, 0 outside.
+            
+        Notes
+        -----
+        The first call sorts all annotated voxels by structure. Subsequent 
+        masks are built from that index, without scanning the annotation.
         
         '''
+        
+        if mask_format not in self.MASK_FORMATS:
+            raise ValueError(
+                'mask_format must be one of {0}, got {1}'.format(
+                    self.MASK_FORMATS, mask_format))
     
-        if direct_only:
-            mask = np.zeros(self.annotation.shape, dtype=np.uint8, order='C')
-            for stid in structure_ids:
-                
-                if self.direct_voxel_map[stid] == 0:
-                    continue
-                    
-                mask[self.annotation == stid] = True
-                
-            return mask
+        mask = SparseMask(
+            self.structure_voxel_indices(structure_ids, direct_only), 
+            self.annotation.shape)
             
-        else:
-            structure_ids = self.structure_tree.descendant_ids(structure_ids)
-            structure_ids = set(functools.reduce(op.add, structure_ids))
-            return self.make_structure_mask(structure_ids, direct_only=True)
+        if mask_format == 'sparse':
+            return mask
+        elif mask_format == 'run_length':
+            return mask.to_run_length()
+        return mask.to_dense()
                         
     def many_structure_masks(self, structure_ids, output_cb=None, 
-                             direct_only=False):
+                             direct_only=False, mask_format='dense'):
         '''Build one or more structure masks and do something with them
         
         Parameters
@@ -199,6 +388,8 @@ class ReferenceSpace(object):
         direct_only : bool, optional
             If True, only include voxels directly assigned to a structure in 
             the mask. Otherwise include voxels assigned to descendants.
+        mask_format : str, optional
+            Passed to make_structure_mask.
             
         Yields
         -------
@@ -219,7 +410,8 @@ class ReferenceSpace(object):
                                               
         for stid in structure_ids:
             yield output_cb(stid, functools.partial(self.make_structure_mask, 
-                                                    [stid], direct_only))
+                                                    [stid], direct_only, 
+                                                    mask_format))
 
 
     def check_coverage(self, structure_ids, domain_mask):
@@ -42,6 +42,7 @@ from allensdk.deprecated import deprecated
 from .ontology import Ontology
 from .structure_tree import StructureTree
 from .reference_space import ReferenceSpace
+from .volume_cache import VolumeCache
 
 
 class ReferenceSpaceCache(Cache):
@@ -59,6 +60,8 @@ class ReferenceSpaceCache(Cache):
     def __init__(self, 
                  resolution, 
                  reference_space_key,
+                 memory_map_volumes=False,
+                 max_cached_volumes=8,
                  **kwargs):
 
         if not 'version' in kwargs:
@@ -72,8 +75,21 @@ class ReferenceSpaceCache(Cache):
         self.resolution = resolution
         self.reference_space_key = reference_space_key        
         
+        self.memory_map_volumes = memory_map_volumes
+        self.volume_cache = VolumeCache(max_cached_volumes)
+        
         self.api = ReferenceSpaceApi(base_uri=kwargs['base_uri'])
 
+
+    def _read_volume(self, file_name, loader):
+        '''Read a volume with loader, or, if memory_map_volumes is set, from 
+        a memory-mapped copy (see VolumeCache).
+        '''
+        
+        if not self.memory_map_volumes or file_name is None:
+            return loader()
+        return self.volume_cache.get(file_name, loader=loader)
+
         
     def get_annotation_volume(self, file_name=None):
         """
@@ -87,16 +103,23 @@ class ReferenceSpaceCache(Cache):
             it will be read from this file.  If file_name is None, the
             file_name will be pulled out of the manifest.  Default is None.
 
+        Notes
+        -----
+        If this cache was constructed with memory_map_volumes=True, the 
+        volume is returned as a read-only memory map.
+
         """
 
         file_name = self.get_cache_path(
             file_name, self.ANNOTATION_KEY, self.reference_space_key, self.resolution)
 
-        annotation, info = self.api.download_annotation_volume(
-            self.reference_space_key,
-            self.resolution,
+        annotation, info = self._read_volume(
             file_name, 
-            strategy='lazy')
+            lambda: self.api.download_annotation_volume(
+                self.reference_space_key,
+                self.resolution,
+                file_name, 
+                strategy='lazy'))
 
         return annotation, info
 
@@ -113,14 +136,21 @@ class ReferenceSpaceCache(Cache):
             it will be read from this file.  If file_name is None, the
             file_name will be pulled out of the manifest.  Default is None.
 
+        Notes
+        -----
+        If this cache was constructed with memory_map_volumes=True, the 
+        volume is returned as a read-only memory map.
+
         """
 
         file_name = self.get_cache_path(
             file_name, self.TEMPLATE_KEY, self.resolution)
 
-        template, info = self.api.download_template_volume(self.resolution, 
-                                                           file_name, 
-                                                           strategy='lazy')
+        template, info = self._read_volume(
+            file_name, 
+            lambda: self.api.download_template_volume(self.resolution, 
+                                                      file_name, 
+                                                      strategy='lazy'))
 
         return template, info
 
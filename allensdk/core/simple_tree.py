@@ -38,6 +38,8 @@ import operator as op
 from collections import defaultdict
 from six import iteritems
 
+import numpy as np
+
 from allensdk.deprecated import deprecated
 
 
@@ -84,6 +86,49 @@ class SimpleTree( object ):
         self.node_id_cb = node_id_cb
         self.parent_id_cb = parent_id_cb
 
+        self._build_interval_index()
+
+
+    def _build_interval_index(self):
+        '''Number the nodes in depth-first preorder. Each node's descendants 
+        then occupy the contiguous interval [enter, exit) of the ordering, 
+        so that descendant lookups are slices and ancestry checks are integer 
+        comparisons.
+        '''
+        
+        preorder = []
+        enter = {}
+        exit = {}
+        
+        roots = [nid for nid, pid in iteritems(self._parent_ids) 
+                 if pid is None]
+        for root in roots:
+        
+            # each stack item is a node id and whether it is being exited
+            stack = [(root, False)]
+            while stack:
+                nid, exiting = stack.pop()
+                if exiting:
+                    exit[nid] = len(preorder)
+                    continue
+                    
+                enter[nid] = len(preorder)
+                preorder.append(nid)
+                stack.append((nid, True))
+                stack.extend((cid, False) 
+                             for cid in reversed(self._child_ids[nid]))
+                             
+        self._preorder = preorder
+        self._enter = enter
+        self._exit = exit
+
+
+    def _interval_positions(self, node_ids, positions):
+        if isinstance(node_ids, np.ndarray):
+            return np.array([positions[nid] for nid in node_ids.flat], 
+                            dtype=np.int64).reshape(node_ids.shape)
+        return np.array([positions[nid] for nid in node_ids], dtype=np.int64)
+
 
     def filter_nodes(self, criterion):
         '''Obtain a list of nodes filtered by some criterion
@@ -252,9 +297,11 @@ class SimpleTree( object ):
         for nid in node_ids:
         
             current = [nid]
-            while current[-1] is not None:
-                current.extend(self.parent_ids([current[-1]]))
-            out.append(current[:-1])
+            pid = self._parent_ids[nid]
+            while pid is not None:
+                current.append(pid)
+                pid = self._parent_ids[pid]
+            out.append(current)
                 
         return out
             
@@ -283,8 +330,13 @@ class SimpleTree( object ):
         '''
     
         out = []
-        for ii, nid in enumerate(node_ids):
+        for nid in node_ids:
             
+            if nid in self._enter:
+                out.append(self._preorder[self._enter[nid]:self._exit[nid]])
+                continue
+            
+            # nodes that are unreachable from a root (i.e. are in a cycle)
             current = [nid]
             children = self.child_ids([nid])[0]
             
@@ -295,6 +347,33 @@ class SimpleTree( object ):
             out.append(current)
         return out
 
+
+    def is_descendant(self, child_ids, parent_ids):
+        '''Test whether nodes descend from other nodes
+        
+        Parameters
+        ----------
+        child_ids : list or numpy ndarray of hashable
+            Ids of putative descendants.
+        parent_ids : list or numpy ndarray of hashable
+            Ids of putative ancestors. Must be broadcastable against 
+            child_ids, so that a single parent can be compared to many 
+            children, or vice versa (or, with array inputs of shapes (n, 1) 
+            and (m,), every child to every parent).
+            
+        Returns
+        -------
+        numpy ndarray of bool :
+            True where the child is the parent or one of its descendants.
+        
+        '''
+        
+        child_enter = self._interval_positions(child_ids, self._enter)
+        parent_enter = self._interval_positions(parent_ids, self._enter)
+        parent_exit = self._interval_positions(parent_ids, self._exit)
+            
+        return (parent_enter <= child_enter) & (child_enter < parent_exit)
+
     
     @deprecated("Use SimpleTree.nodes instead")
     def node(self, node_ids=None):
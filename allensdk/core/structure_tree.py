@@ -232,11 +232,14 @@ class StructureTree( SimpleTree ):
         -------
         bool :
             True if the structure specified by child_id is a descendant of 
-            the one specified by parent_id. Otherwise False.
+            the one specified by parent_id. Otherwise False (including when 
+            either structure is not in the tree).
         
         '''
     
-        return parent_id in self.ancestor_ids([child_id])[0]
+        if child_id not in self._enter or parent_id not in self._enter:
+            return False
+        return bool(self.is_descendant([child_id], [parent_id])[0])
     
     
     def get_structure_sets(self):
@@ -0,0 +1,137 @@
+# Allen Institute Software License - This software license is the 2-clause BSD
+# license plus a third clause that prohibits redistribution for commercial
+# purposes without further permission.
+#
+# Copyright 2024. Allen Institute. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# 3. Redistributions for commercial purposes are not permitted without the
+# Allen Institute's written permission.
+# For purposes of this license, commercial purposes is the incorporation of the
+# Allen Institute's software into anything for which you will charge fees or
+# other compensation. Contact terms@alleninstitute.org for commercial licensing
+# opportunities.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import os
+import warnings
+
+import pandas as pd
+
+from allensdk.config.manifest import Manifest
+
+
+class StructureUnionizeStore(object):
+    """ A single HDF5 file consolidating the structure unionize records of
+    many experiments. Records are partitioned by experiment (one table per
+    experiment), so that many experiments can be loaded without parsing one
+    csv per experiment.
+
+    The store is not safe for concurrent writes from multiple processes.
+
+    Parameters
+    ----------
+    path : str
+        Location of the HDF5 file. It is created when the first experiment is
+        added.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._experiment_ids = None
+
+    @staticmethod
+    def _key(experiment_id):
+        return "experiment_{}".format(int(experiment_id))
+
+    @property
+    def experiment_ids(self):
+        """ Set of ids of the experiments whose unionizes are stored """
+        if self._experiment_ids is None:
+            if os.path.exists(self.path):
+                with pd.HDFStore(self.path, mode="r") as store:
+                    self._experiment_ids = set(
+                        int(key.rsplit("_", 1)[-1]) for key in store.keys()
+                    )
+            else:
+                self._experiment_ids = set()
+        return self._experiment_ids
+
+    def has_experiment(self, experiment_id):
+        return int(experiment_id) in self.experiment_ids
+
+    def add_experiments(self, unionizes):
+        """ Store unionize records for one or more experiments, replacing any
+        existing records for those experiments.
+
+        Parameters
+        ----------
+        unionizes : dict
+            Maps experiment ids to (unfiltered) pd.DataFrames of their
+            structure unionize records.
+
+        """
+        if len(unionizes) == 0:
+            return
+
+        experiment_ids = self.experiment_ids
+        Manifest.safe_make_parent_dirs(self.path)
+        with pd.HDFStore(self.path, mode="a") as store:
+            for experiment_id, experiment_unionizes in unionizes.items():
+                experiment_unionizes = pd.DataFrame(experiment_unionizes)
+                with warnings.catch_warnings():
+                    # object columns are stored pickled
+                    warnings.simplefilter(
+                        "ignore", pd.errors.PerformanceWarning
+                    )
+                    store.put(
+                        self._key(experiment_id),
+                        experiment_unionizes,
+                        format="fixed",
+                    )
+                experiment_ids.add(int(experiment_id))
+
+    def get_unionizes(self, experiment_ids):
+        """ Load the stored unionize records of a set of experiments
+
+        Parameters
+        ----------
+        experiment_ids : list
+            Ids of the experiments to load. All must be present in the
+            store.
+
+        Returns
+        -------
+        pd.DataFrame :
+            The records of all requested experiments, concatenated in the
+            order of experiment_ids.
+
+        """
+        with pd.HDFStore(self.path, mode="r") as store:
+            unionizes = [
+                store.get(self._key(experiment_id))
+                for experiment_id in experiment_ids
+            ]
+
+        return pd.concat(unionizes, ignore_index=True, sort=True)
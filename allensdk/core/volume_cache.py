@@ -0,0 +1,140 @@
+# Allen Institute Software License - This software license is the 2-clause BSD
+# license plus a third clause that prohibits redistribution for commercial
+# purposes without further permission.
+#
+# Copyright 2024. Allen Institute. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# 3. Redistributions for commercial purposes are not permitted without the
+# Allen Institute's written permission.
+# For purposes of this license, commercial purposes is the incorporation of the
+# Allen Institute's software into anything for which you will charge fees or
+# other compensation. Contact terms@alleninstitute.org for commercial licensing
+# opportunities.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import os
+from collections import OrderedDict
+
+import nrrd
+import numpy as np
+
+from allensdk.config.manifest import Manifest
+
+
+def memmap_path(nrrd_path):
+    """ Location of the uncompressed copy of an nrrd volume """
+    return os.path.splitext(nrrd_path)[0] + ".npy"
+
+
+def write_memmap_volume(data, path):
+    """ Write a volume as an uncompressed .npy file, which can later be
+    memory-mapped. The file is written to a temporary location and moved into
+    place, so that a partially written file is never read.
+    """
+    Manifest.safe_make_parent_dirs(path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as tmp_file:
+        np.save(tmp_file, data, allow_pickle=False)
+    os.replace(tmp_path, path)
+
+
+class VolumeCache(object):
+    """ Opens nrrd volumes as read-only memory maps of an uncompressed copy,
+    and keeps the most recently opened volumes.
+
+    The first time a volume is requested, it is decoded and written alongside
+    the nrrd file as a .npy (see memmap_path). Later requests (including from
+    other processes) map that file instead of decompressing the nrrd, so only
+    the regions of the volume which are actually indexed are read from disk.
+
+    Parameters
+    ----------
+    max_volumes : int
+        Maximum number of open volumes to retain. The least recently used
+        volume is dropped first.
+
+    """
+
+    def __init__(self, max_volumes=8):
+        self.max_volumes = max_volumes
+        self._volumes = OrderedDict()
+
+    def __len__(self):
+        return len(self._volumes)
+
+    def clear(self):
+        self._volumes.clear()
+
+    def get(self, nrrd_path, loader=None):
+        """ Obtain a volume and its header
+
+        Parameters
+        ----------
+        nrrd_path : str
+            Path to the nrrd file.
+        loader : function, optional
+            Called with no arguments if the volume has not been converted,
+            must ensure that nrrd_path exists and return its (data, header).
+            Defaults to reading nrrd_path.
+
+        Returns
+        -------
+        numpy.memmap :
+            Read-only volume data, with the same shape and memory order as
+            the output of nrrd.read.
+        OrderedDict :
+            The nrrd header.
+
+        """
+        key = os.path.abspath(nrrd_path)
+        if key in self._volumes:
+            self._volumes.move_to_end(key)
+            return self._volumes[key]
+
+        npy_path = memmap_path(nrrd_path)
+        if self._is_converted(nrrd_path, npy_path):
+            header = nrrd.read_header(nrrd_path)
+        else:
+            if loader is None:
+                data, header = nrrd.read(nrrd_path)
+            else:
+                data, header = loader()
+            write_memmap_volume(data, npy_path)
+            del data
+
+        volume = (np.load(npy_path, mmap_mode="r"), header)
+
+        self._volumes[key] = volume
+        while len(self._volumes) > self.max_volumes:
+            self._volumes.popitem(last=False)
+
+        return volume
+
+    @staticmethod
+    def _is_converted(nrrd_path, npy_path):
+        return (
+            os.path.exists(npy_path)
+            and os.path.exists(nrrd_path)
+            and os.path.getmtime(npy_path) >= os.path.getmtime(nrrd_path)
+        )
@@ -37,6 +37,7 @@ import numpy as np
 from pandas import DataFrame
 import warnings
 import logging
+import multiprocessing as mp
 from collections import Counter
 
 from . import ephys_features as ft
@@ -51,6 +52,10 @@ SHORT_SQUARES_WINDOW_END = 1.021
 SHORT_SQUARE_TRIPLE_WINDOW_START = 2.02
 SHORT_SQUARE_TRIPLE_WINDOW_END = 2.021
 
+# Cutoff frequency (kHz) of the heavier low-pass filter applied to voltage
+# when analyzing troughs and finding flat baseline intervals
+HEAVY_FILTER = 1.
+
 
 class EphysSweepFeatureExtractor:
     """Feature calculation for a sweep (voltage and/or current time series)."""
@@ -106,6 +111,25 @@ class EphysSweepFeatureExtractor:
 
         self._sweep_features = {}
         self._affected_by_clipping = []
+        self._dvdt_cache = {}
+        self._dvdt_cache_tv = (None, None)
+
+    def calculate_dvdt(self, filter):
+        """Get dV/dt of the sweep, low-pass filtered at `filter` kHz.
+
+        The filtered derivative is computed once per filter frequency and
+        shared by all feature calculations on this sweep (it is recomputed if
+        t or v are replaced).
+        """
+        t, v = self._dvdt_cache_tv
+        if t is not self.t or v is not self.v:
+            self._dvdt_cache = {}
+            self._dvdt_cache_tv = (self.t, self.v)
+
+        if filter not in self._dvdt_cache:
+            self._dvdt_cache[filter] = ft.calculate_dvdt(self.v, self.t,
+                                                         filter)
+        return self._dvdt_cache[filter]
 
     def process_spikes(self):
         """Perform spike-related feature analysis"""
@@ -115,12 +139,13 @@ class EphysSweepFeatureExtractor:
     def _process_individual_spikes(self):
         v = self.v
         t = self.t
-        dvdt = ft.calculate_dvdt(v, t, self.filter)
+        dvdt = self.calculate_dvdt(self.filter)
 
         # Basic features of spikes
         putative_spikes = ft.detect_putative_spikes(v, t, self.start, self.end,
                                                     self.filter,
-                                                    self.dv_cutoff)
+                                                    self.dv_cutoff,
+                                                    dvdt=dvdt)
         peaks = ft.find_peak_indexes(v, t, putative_spikes, self.end)
         putative_spikes, peaks = ft.filter_putative_spikes(v, t,
                                                            putative_spikes,
@@ -156,11 +181,14 @@ class EphysSweepFeatureExtractor:
                                          self.end)
         downstrokes = ft.find_downstroke_indexes(v, t, peaks, troughs, clipped,
                                                  self.filter, dvdt)
+        dvdt_hvy = self.calculate_dvdt(HEAVY_FILTER)
         trough_details, clipped = ft.analyze_trough_details(v, t, thresholds,
                                                             peaks, clipped,
                                                             self.end,
                                                             self.filter,
-                                                            dvdt=dvdt)
+                                                            HEAVY_FILTER,
+                                                            dvdt=dvdt,
+                                                            dvdt_hvy=dvdt_hvy)
         widths = ft.find_widths(v, t, thresholds, peaks, trough_details[1],
                                 clipped)
 
@@ -404,7 +432,7 @@ class EphysSweepFeatureExtractor:
     def _get_baseline_voltage(self):
         v = self.v
         t = self.t
-        filter_frequency = 1.  # in kHz
+        filter_frequency = HEAVY_FILTER  # in kHz
 
         # Look at baseline interval before start if start is defined
         if self.start is not None:
@@ -413,7 +441,7 @@ class EphysSweepFeatureExtractor:
                                       self.start)
 
         # Otherwise try to find an interval where things are pretty flat
-        dv = ft.calculate_dvdt(v, t, filter_frequency)
+        dv = self.calculate_dvdt(filter_frequency)
         non_flat_points = np.flatnonzero(
             np.abs(dv >= self.baseline_detect_thresh))
         flat_intervals = t[non_flat_points[1:]] - t[non_flat_points[:-1]]
@@ -809,10 +837,23 @@ class EphysSweepSetFeatureExtractor:
         """Get list of EphysSweepFeatureExtractor objects."""
         return self._sweeps
 
-    def process_spikes(self):
-        """Analyze spike features for all sweeps."""
-        for sweep in self._sweeps:
-            sweep.process_spikes()
+    def process_spikes(self, num_workers=1):
+        """Analyze spike features for all sweeps.
+
+        Parameters
+        ----------
+        num_workers : number of processes over which to spread the sweeps
+        (optional, default 1). If greater than 1, the sweeps are replaced by
+        their processed copies returned from the workers.
+        """
+        num_workers = min(num_workers, len(self._sweeps))
+        if num_workers <= 1:
+            for sweep in self._sweeps:
+                sweep.process_spikes()
+            return
+
+        with mp.Pool(num_workers) as pool:
+            self._sweeps = pool.map(_process_sweep_spikes, self._sweeps)
 
     def sweep_features(self, key, allow_missing=False):
         """Get nparray of sweep-level feature (`key`) for all sweeps
@@ -1193,11 +1234,10 @@ def cell_extractor_for_nwb(dataset, ramps, short_squares, long_squares,
     ramps_ext = extractor_for_nwb_sweeps(dataset, ramps,
                                          fixed_start=RAMPS_START)
 
-    temp_short_sq_ext = extractor_for_nwb_sweeps(dataset, short_squares)
-    t_set = [s.t for s in temp_short_sq_ext.sweeps()]
-    v_set = [s.v for s in temp_short_sq_ext.sweeps()]
+    short_sq_sweeps = load_nwb_sweeps(dataset, short_squares)
     cutoff, thresh_frac = \
-        ft.estimate_adjusted_detection_parameters(v_set, t_set,
+        ft.estimate_adjusted_detection_parameters(short_sq_sweeps["v_set"],
+                                                  short_sq_sweeps["t_set"],
                                                   SHORT_SQUARES_WINDOW_START,
                                                   SHORT_SQUARES_WINDOW_END)
 
@@ -1205,7 +1245,8 @@ def cell_extractor_for_nwb(dataset, ramps, short_squares, long_squares,
 
     short_squares_ext = extractor_for_nwb_sweeps(dataset, short_squares,
                                                  dv_cutoff=cutoff,
-                                                 thresh_frac=thresh_frac)
+                                                 thresh_frac=thresh_frac,
+                                                 sweeps=short_sq_sweeps)
     long_squares_ext = extractor_for_nwb_sweeps(dataset, long_squares,
                                                 fixed_start=LONG_SQUARES_START,
                                                 fixed_end=LONG_SQUARES_END)
@@ -1214,9 +1255,21 @@ def cell_extractor_for_nwb(dataset, ramps, short_squares, long_squares,
                                      long_squares_ext, subthresh_min_amp)
 
 
-def extractor_for_nwb_sweeps(dataset, sweep_numbers,
-                             fixed_start=None, fixed_end=None,
-                             dv_cutoff=20., thresh_frac=0.05):
+def load_nwb_sweeps(dataset, sweep_numbers):
+    """Read sweeps from an NWB data set, converted to the units used by the
+    feature extractors
+
+    Parameters
+    ----------
+    dataset : NwbDataSet
+    sweep_numbers : list of sweep numbers
+
+    Returns
+    -------
+    dict of lists (one item per sweep) of times in seconds ("t_set"),
+    voltages in mV ("v_set"), currents in pA ("i_set") and the start ("start")
+    and end ("end") times of the sweeps' experiment epochs
+    """
     v_set = []
     t_set = []
     i_set = []
@@ -1239,6 +1292,40 @@ def extractor_for_nwb_sweeps(dataset, sweep_numbers,
         start.append(s)
         end.append(e)
 
+    return {"t_set": t_set, "v_set": v_set, "i_set": i_set,
+            "start": start, "end": end}
+
+
+def extractor_for_nwb_sweeps(dataset, sweep_numbers,
+                             fixed_start=None, fixed_end=None,
+                             dv_cutoff=20., thresh_frac=0.05, sweeps=None):
+    """Initialize EphysSweepSetFeatureExtractor object from sweeps of an
+    NWB data set
+
+    Parameters
+    ----------
+    dataset : NwbDataSet
+    sweep_numbers : list of sweep numbers
+    fixed_start : start of time window for all sweeps (optional, defaults to
+    the start of each sweep's experiment epoch)
+    fixed_end : end of time window for all sweeps, used only with fixed_start
+    (optional)
+    dv_cutoff : minimum dV/dt to qualify as a spike in V/s (optional,
+    default 20)
+    thresh_frac : fraction of average upstroke for threshold calculation
+    (optional, default 0.05)
+    sweeps : output of load_nwb_sweeps for these sweep numbers, if already
+    loaded (optional)
+    """
+    if sweeps is None:
+        sweeps = load_nwb_sweeps(dataset, sweep_numbers)
+
+    t_set = sweeps["t_set"]
+    v_set = sweeps["v_set"]
+    i_set = sweeps["i_set"]
+    start = list(sweeps["start"])
+    end = list(sweeps["end"])
+
     if fixed_start and not fixed_end:
         start = [fixed_start] * len(end)
     elif fixed_start and fixed_end:
@@ -1252,6 +1339,11 @@ def extractor_for_nwb_sweeps(dataset, sweep_numbers,
                                          id_set=sweep_numbers)
 
 
+def _process_sweep_spikes(sweep):
+    sweep.process_spikes()
+    return sweep
+
+
 def _step_stim_amp(sweep):
     t_index = ft.find_time_index(sweep.t, sweep.start)
     return sweep.i[t_index + 1]
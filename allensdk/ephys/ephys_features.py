@@ -40,7 +40,8 @@ import scipy.signal as signal
 from scipy.optimize import curve_fit
 from functools import partial
 
-def detect_putative_spikes(v, t, start=None, end=None, filter=10., dv_cutoff=20.):
+def detect_putative_spikes(v, t, start=None, end=None, filter=10.,
+                           dv_cutoff=20., dvdt=None):
     """Perform initial detection of spikes and return their indexes.
 
     Parameters
@@ -51,7 +52,10 @@ def detect_putative_spikes(v, t, start=None, end=None, filter=10., dv_cutoff=20.
     end : end of time window for spike detection (optional)
     filter : cutoff frequency for 4-pole low-pass Bessel filter in kHz (optional, default 10)
     dv_cutoff : minimum dV/dt to qualify as a spike in V/s (optional, default 20)
-    dvdt : pre-calculated time-derivative of voltage (optional)
+    dvdt : pre-calculated time-derivative of voltage over the whole of v
+        (optional). Only used if the start-end window spans all of v:
+        filtering only the window differs near its edges, so otherwise
+        dV/dt is calculated over the window.
 
     Returns
     -------
@@ -75,10 +79,12 @@ def detect_putative_spikes(v, t, start=None, end=None, filter=10., dv_cutoff=20.
 
     start_index = find_time_index(t, start)
     end_index = find_time_index(t, end)
-    v_window = v[start_index:end_index + 1]
-    t_window = t[start_index:end_index + 1]
-
-    dvdt = calculate_dvdt(v_window, t_window, filter)
+    # dvdt cannot be reused if samples with dt == 0 were dropped from it
+    whole_trace = start_index == 0 and end_index == len(v) - 1
+    if dvdt is None or not whole_trace or len(dvdt) != len(v) - 1:
+        v_window = v[start_index:end_index + 1]
+        t_window = t[start_index:end_index + 1]
+        dvdt = calculate_dvdt(v_window, t_window, filter)
 
     # Find positive-going crossings of dV/dt cutoff level
     putative_spikes = np.flatnonzero(np.diff(np.greater_equal(dvdt, dv_cutoff).astype(int)) == 1)
@@ -88,11 +94,13 @@ def detect_putative_spikes(v, t, start=None, end=None, filter=10., dv_cutoff=20.
         return np.array(putative_spikes) + start_index
 
     # Only keep spike times if dV/dt has dropped all the way to zero between putative spikes
-    putative_spikes = [putative_spikes[0]] + [s for i, s in enumerate(putative_spikes[1:])
-        if np.any(dvdt[putative_spikes[i]:s] < 0)]
+    dropped_to_zero = _segments_have_negative(
+        dvdt, putative_spikes[:-1], putative_spikes[1:])
+    putative_spikes = np.append(putative_spikes[0],
+                                putative_spikes[1:][dropped_to_zero])
 
     # Set back to original index space (not just window)
-    return np.array(putative_spikes) + start_index
+    return putative_spikes + start_index
 
 
 def find_peak_indexes(v, t, spike_indexes, end=None):
@@ -111,10 +119,7 @@ def find_peak_indexes(v, t, spike_indexes, end=None):
     end_index = find_time_index(t, end)
 
     spks_and_end = np.append(spike_indexes, end_index)
-    peak_indexes = [np.argmax(v[spk:next]) + spk for spk, next in
-                    zip(spks_and_end[:-1], spks_and_end[1:])]
-
-    return np.array(peak_indexes)
+    return _segment_argmax(v, spks_and_end[:-1], spks_and_end[1:])
 
 
 def filter_putative_spikes(v, t, spike_indexes, peak_indexes, min_height=2.,
@@ -147,11 +152,10 @@ def filter_putative_spikes(v, t, spike_indexes, peak_indexes, min_height=2.,
     if dvdt is None:
         dvdt = calculate_dvdt(v, t, filter)
 
-    diff_mask = [np.any(dvdt[peak_ind:spike_ind] < 0)
-                 for peak_ind, spike_ind
-                 in zip(peak_indexes[:-1], spike_indexes[1:])]
-    peak_indexes = peak_indexes[np.array(diff_mask + [True])]
-    spike_indexes = spike_indexes[np.array([True] + diff_mask)]
+    diff_mask = _segments_have_negative(dvdt, peak_indexes[:-1],
+                                        spike_indexes[1:])
+    peak_indexes = peak_indexes[np.append(diff_mask, True)]
+    spike_indexes = spike_indexes[np.append(True, diff_mask)]
 
     peak_level_mask = v[peak_indexes] >= min_peak
     spike_indexes = spike_indexes[peak_level_mask]
@@ -185,10 +189,7 @@ def find_upstroke_indexes(v, t, spike_indexes, peak_indexes, filter=10., dvdt=No
     if dvdt is None:
         dvdt = calculate_dvdt(v, t, filter)
 
-    upstroke_indexes = [np.argmax(dvdt[spike:peak]) + spike for spike, peak in
-                        zip(spike_indexes, peak_indexes)]
-
-    return np.array(upstroke_indexes)
+    return _segment_argmax(dvdt, spike_indexes, peak_indexes)
 
 
 def refine_threshold_indexes(v, t, upstroke_indexes, thresh_frac=0.05, filter=10., dvdt=None):
@@ -281,13 +282,14 @@ def check_thresholds_and_peaks(v, t, spike_indexes, peak_indexes, upstroke_index
 
     # Validate that peaks don't occur too long after the threshold
     # If they do, try to re-find threshold from the peak
-    too_long_spikes = []
-    for i, (spk, peak) in enumerate(zip(spike_indexes, peak_indexes)):
-        if t[peak] - t[spk] >= max_interval:
-            logging.info("Need to recalculate threshold-peak pair that exceeds maximum allowed interval ({:f} s)".format(max_interval))
-            too_long_spikes.append(i)
-
-    if too_long_spikes:
+    n_pairs = min(len(spike_indexes), len(peak_indexes))
+    too_long_spikes = np.flatnonzero(
+        t[peak_indexes[:n_pairs]] - t[spike_indexes[:n_pairs]] >= max_interval)
+    for _ in too_long_spikes:
+        logging.info("Need to recalculate threshold-peak pair that exceeds "
+                     "maximum allowed interval ({:f} s)".format(max_interval))
+
+    if too_long_spikes.size:
         if dvdt is None:
             dvdt = calculate_dvdt(v, t, filter)
         avg_upstroke = dvdt[upstroke_indexes].mean()
@@ -365,8 +367,8 @@ def find_trough_indexes(v, t, spike_indexes, peak_indexes, clipped=None, end=Non
     end_index = find_time_index(t, end)
 
     trough_indexes = np.zeros_like(spike_indexes, dtype=float)
-    trough_indexes[:-1] = [v[peak:spk].argmin() + peak for peak, spk
-                           in zip(peak_indexes[:-1], spike_indexes[1:])]
+    trough_indexes[:-1] = _segment_argmin(v, peak_indexes[:-1],
+                                          spike_indexes[1:])
 
     if clipped[-1]:
         # If last spike is cut off by the end of the window, trough is undefined
@@ -418,9 +420,8 @@ def find_downstroke_indexes(v, t, peak_indexes, trough_indexes, clipped=None, fi
     valid_trough_indexes = trough_indexes[~clipped].astype(int)
 
     downstroke_indexes = np.zeros_like(peak_indexes) * np.nan
-    downstroke_index_values = [np.argmin(dvdt[peak:trough]) + peak for peak, trough
-                         in zip(valid_peak_indexes, valid_trough_indexes)]
-    downstroke_indexes[~clipped] = downstroke_index_values
+    downstroke_indexes[~clipped] = _segment_argmin(dvdt, valid_peak_indexes,
+                                                   valid_trough_indexes)
 
     return downstroke_indexes
 
@@ -491,7 +492,8 @@ def find_widths(v, t, spike_indexes, peak_indexes, trough_indexes, clipped=None)
 
 def analyze_trough_details(v, t, spike_indexes, peak_indexes, clipped=None, end=None, filter=10.,
                            heavy_filter=1., term_frac=0.01, adp_thresh=0.5, tol=0.5,
-                           flat_interval=0.002, adp_max_delta_t=0.005, adp_max_delta_v=10., dvdt=None):
+                           flat_interval=0.002, adp_max_delta_t=0.005,
+                           adp_max_delta_v=10., dvdt=None, dvdt_hvy=None):
     """Analyze trough to determine if an ADP exists and whether the reset is a 'detour' or 'direct'
 
     Parameters
@@ -510,6 +512,8 @@ def analyze_trough_details(v, t, spike_indexes, peak_indexes, clipped=None, end=
     adp_max_delta_t: max possible ADP delta t (default 0.005 s)
     adp_max_delta_v: max possible ADP delta v (default 10 mV)
     dvdt : pre-calculated time-derivative of voltage (optional)
+    dvdt_hvy : pre-calculated time-derivative of voltage filtered at
+        heavy_filter (optional)
 
     Returns
     -------
@@ -535,7 +539,8 @@ def analyze_trough_details(v, t, spike_indexes, peak_indexes, clipped=None, end=
     if dvdt is None:
         dvdt = calculate_dvdt(v, t, filter)
 
-    dvdt_hvy = calculate_dvdt(v, t, heavy_filter)
+    if dvdt_hvy is None:
+        dvdt_hvy = calculate_dvdt(v, t, heavy_filter)
 
     # Writing as for loop - see if I can vectorize any later
     fast_trough_indexes = []
@@ -636,6 +641,79 @@ def find_time_index(t, t_0):
     return t_gte[0]
 
 
+def _segment_arg_reduce(x, starts, stops, ufunc, arg_func):
+    """Index of the first extreme value of each segment x[start:stop].
+
+    Equivalent to [arg_func(x[a:b]) + a for a, b in zip(starts, stops)], but
+    reduces all segments at once with `ufunc.reduceat`.
+    """
+    starts = np.asarray(starts)
+    stops = np.asarray(stops)
+    n_segments = min(len(starts), len(stops))
+    if n_segments == 0:
+        return np.array([])
+    starts = starts[:n_segments]
+    stops = stops[:n_segments]
+
+    lo = np.minimum(starts, len(x))
+    lengths = np.minimum(stops, len(x)) - lo
+    if (starts.dtype.kind not in "iu" or stops.dtype.kind not in "iu"
+            or np.any(starts < 0) or np.any(stops < 0)
+            or np.any(lengths <= 0)):
+        # Fall back to slicing for cases that need python slice semantics
+        # (or that raise on an empty segment, as the loop does)
+        return np.array([arg_func(x[a:b]) + a for a, b in zip(starts, stops)])
+
+    # Gather every segment into one contiguous array
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.arange(lengths.sum()) + np.repeat(lo - offsets, lengths)
+    values = x[positions]
+    segments = np.repeat(np.arange(n_segments), lengths)
+
+    extremes = ufunc.reduceat(values, offsets)
+    matches = values == extremes[segments]
+    nan_extremes = np.isnan(extremes)
+    if nan_extremes.any():
+        # argmax/argmin return the first nan of a segment containing one
+        matches |= nan_extremes[segments] & np.isnan(values)
+
+    # Ties resolve to the first occurrence, as with argmax/argmin
+    match_positions = np.flatnonzero(matches)
+    first_matches = np.searchsorted(segments[match_positions],
+                                    np.arange(n_segments))
+    return positions[match_positions[first_matches]]
+
+
+def _segment_argmax(x, starts, stops):
+    """Index of the (first) maximum of each segment x[start:stop]"""
+    return _segment_arg_reduce(x, starts, stops, np.maximum, np.argmax)
+
+
+def _segment_argmin(x, starts, stops):
+    """Index of the (first) minimum of each segment x[start:stop]"""
+    return _segment_arg_reduce(x, starts, stops, np.minimum, np.argmin)
+
+
+def _segments_have_negative(x, starts, stops):
+    """Whether each segment x[start:stop] contains a negative value.
+
+    Equivalent to [np.any(x[a:b] < 0) for a, b in zip(starts, stops)], using a
+    cumulative count of negative values.
+    """
+    starts = np.asarray(starts)
+    stops = np.asarray(stops)
+    n_segments = min(len(starts), len(stops))
+    starts = starts[:n_segments]
+    stops = stops[:n_segments]
+    if np.any(starts < 0) or np.any(stops < 0):
+        return np.array([np.any(x[a:b] < 0) for a, b in zip(starts, stops)],
+                        dtype=bool)
+
+    negative_counts = np.append(0, np.cumsum(x < 0))
+    return (negative_counts[np.minimum(stops, len(x))]
+            - negative_counts[np.minimum(starts, len(x))]) > 0
+
+
 def calculate_dvdt(v, t, filter=None):
     """Low-pass filters (if requested) and differentiates voltage by time.
 
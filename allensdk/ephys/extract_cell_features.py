@@ -35,7 +35,11 @@
 #
 import numpy as np
 import logging
+import multiprocessing as mp
+from collections import defaultdict
 import six
+
+from allensdk.core.nwb_data_set import NwbDataSet
 from . import ephys_extractor as efex
 from . import ephys_features as ft
 
@@ -50,50 +54,53 @@ SHORT_SQUARE_TYPES = ["Short Square",
 
 SHORT_SQUARE_THRESH_FRAC_FLOOR = 0.1
 
+# stimulus names (as reported by CellTypesCache.get_ephys_sweeps) of the
+# sweeps used for cell-level features
+RAMP_STIMULUS_NAME = "Ramp"
+SHORT_SQUARE_STIMULUS_NAME = "Short Square"
+LONG_SQUARE_STIMULUS_NAME = "Long Square"
+
 MEAN_FEATURES = [ "upstroke_downstroke_ratio", "peak_v", "peak_t", "trough_v", "trough_t",
                   "fast_trough_v", "fast_trough_t", "slow_trough_v", "slow_trough_t",
                   "threshold_v", "threshold_i", "threshold_t", "peak_v", "peak_t" ]
 
 
-def extract_sweep_features(data_set, sweeps_by_type):
+def extract_sweep_features(data_set, sweeps_by_type, num_workers=1):
     # extract sweep-level features
     sweep_features = {}
 
     for stimulus_type, sweep_numbers in six.iteritems(sweeps_by_type):
         logging.debug("%s:%s" % (stimulus_type, ','.join(map(str, sweep_numbers))))
 
-        if stimulus_type == "Short Square - Triple":
-            tmp_ext = efex.extractor_for_nwb_sweeps(data_set, sweep_numbers)
-            t_set = [s.t for s in tmp_ext.sweeps()]
-            v_set = [s.v for s in tmp_ext.sweeps()]
+        sweeps = efex.load_nwb_sweeps(data_set, sweep_numbers)
 
+        if stimulus_type == "Short Square - Triple":
             # IT-14530
             # triple-sweeps to use different window
             win_start = efex.SHORT_SQUARE_TRIPLE_WINDOW_START
             win_end = efex.SHORT_SQUARE_TRIPLE_WINDOW_END
             cutoff, thresh_frac = ft.estimate_adjusted_detection_parameters(
-                                    v_set, t_set, win_start, win_end)
+                                    sweeps["v_set"], sweeps["t_set"], win_start, win_end)
             thresh_frac = max(SHORT_SQUARE_THRESH_FRAC_FLOOR, thresh_frac)
 
             fex = efex.extractor_for_nwb_sweeps(data_set, sweep_numbers,
-                                    dv_cutoff=cutoff, thresh_frac=thresh_frac)
+                                    dv_cutoff=cutoff, thresh_frac=thresh_frac,
+                                    sweeps=sweeps)
         elif stimulus_type in SHORT_SQUARE_TYPES:
-            tmp_ext = efex.extractor_for_nwb_sweeps(data_set, sweep_numbers)
-            t_set = [s.t for s in tmp_ext.sweeps()]
-            v_set = [s.v for s in tmp_ext.sweeps()]
-
             win_start = efex.SHORT_SQUARES_WINDOW_START
             win_end = efex.SHORT_SQUARES_WINDOW_END
             cutoff, thresh_frac = ft.estimate_adjusted_detection_parameters(
-                                     v_set, t_set, win_start, win_end)
+                                     sweeps["v_set"], sweeps["t_set"], win_start, win_end)
             thresh_frac = max(SHORT_SQUARE_THRESH_FRAC_FLOOR, thresh_frac)
 
             fex = efex.extractor_for_nwb_sweeps(data_set, sweep_numbers,
-                                                dv_cutoff=cutoff, thresh_frac=thresh_frac)
+                                                dv_cutoff=cutoff, thresh_frac=thresh_frac,
+                                                sweeps=sweeps)
         else:
-            fex = efex.extractor_for_nwb_sweeps(data_set, sweep_numbers)
+            fex = efex.extractor_for_nwb_sweeps(data_set, sweep_numbers,
+                                                sweeps=sweeps)
 
-        fex.process_spikes()
+        fex.process_spikes(num_workers=num_workers)
 
         sweep_features.update({ f.id:f.as_dict() for f in fex.sweeps() })
 
@@ -157,6 +164,71 @@ def extract_cell_features(data_set,
 
     return cell_features
 
+def extract_specimen_features(cell_types_cache, specimen_ids, num_workers=1):
+    """ Extract sweep and cell features for many specimens of the Cell
+    Types database.
+
+    Each specimen's NWB file and sweep metadata are downloaded (if not
+    already cached) before extraction begins. Specimens are then processed
+    in a pool of num_workers processes, each of which reads a specimen's
+    file through a single open handle.
+
+    Parameters
+    ----------
+    cell_types_cache: CellTypesCache
+    specimen_ids: list of int
+    num_workers: int
+        maximum number of specimens processed at once (default 1, no pool)
+
+    Returns
+    -------
+    dict
+        Maps specimen ids to dictionaries with 'sweep_features',
+        'cell_features' and 'error' elements. If extraction failed, 'error'
+        describes the failure and the features are None (or only
+        'cell_features' is None if only cell-level extraction failed).
+    """
+    tasks = []
+    for specimen_id in specimen_ids:
+        data_set = cell_types_cache.get_ephys_data(specimen_id)
+        sweeps = cell_types_cache.get_ephys_sweeps(specimen_id)
+        tasks.append((specimen_id, data_set.file_name, sweeps))
+
+    if num_workers <= 1 or len(tasks) <= 1:
+        return dict(map(_extract_specimen_features, tasks))
+
+    with mp.Pool(min(num_workers, len(tasks))) as pool:
+        return dict(pool.imap_unordered(_extract_specimen_features, tasks))
+
+
+def _extract_specimen_features(task):
+    specimen_id, nwb_file, sweeps = task
+
+    sweeps_by_type = defaultdict(list)
+    for sweep in sweeps:
+        # skip voltage clamp sweeps
+        if sweep.get("stimulus_units", "Amps") in ("Amps", "pA"):
+            sweeps_by_type[sweep["stimulus_name"]].append(sweep["sweep_number"])
+
+    result = {"sweep_features": None, "cell_features": None, "error": None}
+    data_set = NwbDataSet(nwb_file)
+    with data_set.open_file():
+        try:
+            result["sweep_features"] = extract_sweep_features(data_set,
+                                                              sweeps_by_type)
+            result["cell_features"] = extract_cell_features(
+                data_set,
+                sweeps_by_type[RAMP_STIMULUS_NAME],
+                sweeps_by_type[SHORT_SQUARE_STIMULUS_NAME],
+                sweeps_by_type[LONG_SQUARE_STIMULUS_NAME])
+        except Exception as e:
+            logging.warning("feature extraction failed for specimen %d: %s",
+                            specimen_id, e)
+            result["error"] = "%s: %s" % (type(e).__name__, e)
+
+    return specimen_id, result
+
+
 def mean_features_spike_zero(sweeps):
     """ Compute mean feature values for the first spike in list of extractors """
 
@@ -1,40 +1,131 @@
 import itertools
 import numpy as np
+import scipy.sparse as sparse
 import logging
 
 class MaskSet( object ):
+    """ A set of ROI masks, stored as a sparse (masks x pixels) matrix.
+
+    Neighboring masks are found by sweeping over their bounding boxes and
+    pairwise overlaps come from the sparse product M.M^T, so that duplicate
+    and union detection scale with the number of neighbors of each mask
+    rather than with the number of masks.
+
+    Parameters
+    ----------
+    masks: np.ndarray
+        (masks x rows x columns) boolean array. Masks must not be empty.
+    """
     def __init__(self, masks):
-        self.masks = masks
-        self.bbs = make_bbs(self.masks)
-        self.mask_dist = bb_dist(self.bbs)
+        masks = np.asarray(masks, dtype=bool)
+        self.shape = masks.shape[1:]
+        self.mask_matrix = create_mask_matrix(masks)
+        self.bbs = make_bbs_from_matrix(self.mask_matrix, self.shape)
+        self.sizes = np.diff(self.mask_matrix.indptr)
 
-        self.cached_sizes = {}
+        self._mask_dist = None
+        self._overlaps = None
+        self._overlap_rows = {}
+        self._close_pairs = {}
 
         self.cached_unions = {}
-        self.cached_union_sizes = {}
-
         self.cached_intersections = {}
-        self.cached_intersection_sizes = {}
 
     @property
     def count(self):
         return len(self.bbs)
 
+    @property
+    def mask_dist(self):
+        """ Dense (masks x masks) matrix of bounding box distances """
+        if self._mask_dist is None:
+            self._mask_dist = bb_dist(self.bbs)
+        return self._mask_dist
+
+    @property
+    def overlaps(self):
+        """ Sparse (masks x masks) matrix of pixel intersection sizes """
+        if self._overlaps is None:
+            m = self.mask_matrix.astype(np.int32)
+            self._overlaps = m.dot(m.T).tocsr()
+        return self._overlaps
+
+    def _pair_dist(self, mask_idxs):
+        pairs = np.array(list(itertools.combinations(mask_idxs, 2)),
+                         dtype=int).reshape(-1, 2)
+        pairs.sort(axis=1)
+        return bb_pair_dist(self.bbs[pairs[:,0]], self.bbs[pairs[:,1]])
+
     def distance(self, mask_idxs):
-        return max(self.mask_dist[i,j] for (i,j) in itertools.combinations(mask_idxs, 2))
+        return max(self._pair_dist(mask_idxs))
 
     def close(self, mask_idxs, max_dist):
-        return not any(self.mask_dist[i,j] > max_dist for (i,j) in itertools.combinations(mask_idxs, 2)) 
+        return not np.any(self._pair_dist(mask_idxs) > max_dist)
+
+    def close_pairs(self, max_dist):
+        """ Find all pairs of masks whose bounding boxes are within max_dist
+        of each other.
+
+        Returns
+        -------
+        np.ndarray
+            (pairs x 2) array of mask indices, i < j, in lexicographic order
+        """
+        if max_dist not in self._close_pairs:
+            self._close_pairs[max_dist] = close_bb_pairs(self.bbs, max_dist)
+        return self._close_pairs[max_dist]
+
+    def _neighbors(self, max_dist):
+        neighbors = [ set() for i in range(self.count) ]
+        for i, j in self.close_pairs(max_dist).tolist():
+            neighbors[i].add(j)
+            neighbors[j].add(i)
+        return neighbors
 
     def close_sets(self, set_size, max_dist):
-        mask_sets = itertools.combinations(range(len(self.bbs)), set_size)
-        return (ms for ms in mask_sets if self.close(ms,  max_dist))
+        if set_size < 2:
+            return itertools.combinations(range(self.count), set_size)
+
+        neighbors = self._neighbors(max_dist)
+
+        # grow sets one mask at a time, appending only higher indices close
+        # to every member, which keeps the sets in lexicographic order
+        mask_sets = [ tuple(p) for p in self.close_pairs(max_dist).tolist() ]
+        for _ in range(set_size - 2):
+            mask_sets = [ ms + (idx,)
+                          for ms in mask_sets
+                          for idx in sorted(neighbors[ms[-1]])
+                          if idx > ms[-1]
+                          if all(idx in neighbors[i] for i in ms[:-1]) ]
+
+        return iter(mask_sets)
 
     def _idx_key(self, idxs):
         return tuple(sorted(set(idxs)))
 
+    def pixels(self, mask_idx):
+        """ Sorted flat indices of the pixels in a mask """
+        m = self.mask_matrix
+        return m.indices[m.indptr[mask_idx]:m.indptr[mask_idx + 1]]
+
+    def _to_mask(self, pixels):
+        mask = np.zeros(int(np.prod(self.shape)), dtype=bool)
+        mask[pixels] = True
+        return mask.reshape(self.shape)
+
     def mask(self, mask_idx):
-        return self.masks[mask_idx]
+        return self._to_mask(self.pixels(mask_idx))
+
+    def _union_pixels(self, mask_idxs):
+        return np.unique(np.concatenate([ self.pixels(idx)
+                                          for idx in mask_idxs ]))
+
+    def _intersection_pixels(self, mask_idxs):
+        pixels = self.pixels(mask_idxs[0])
+        for idx in mask_idxs[1:]:
+            pixels = np.intersect1d(pixels, self.pixels(idx),
+                                    assume_unique=True)
+        return pixels
 
     def union(self, mask_idxs):
         mask_idxs = self._idx_key(mask_idxs)
@@ -45,50 +136,54 @@ class MaskSet( object ):
         if len(mask_idxs) == 0:
             return None
 
-        i0 = mask_idxs[0]
-        union = self.masks[i0].copy()
-        
-        if len(mask_idxs) == 1:
-            return union
-
-        for idx in mask_idxs[1:]:
-            union |= self.masks[idx]
+        union = self._to_mask(self._union_pixels(mask_idxs))
 
-        self.cached_unions[mask_idxs] = union
+        if len(mask_idxs) > 1:
+            self.cached_unions[mask_idxs] = union
 
         return union
 
+    def overlap_size(self, idx0, idx1):
+        """ Number of pixels shared by two masks """
+        if idx0 not in self._overlap_rows:
+            m = self.overlaps
+            row = slice(m.indptr[idx0], m.indptr[idx0 + 1])
+            self._overlap_rows[idx0] = dict(zip(m.indices[row].tolist(),
+                                                m.data[row].tolist()))
+        return self._overlap_rows[idx0].get(idx1, 0)
+
     def overlap_fraction(self, idx0, idx1):
         union_size = self.union_size([idx0,idx1])
         overlap_size = self.intersection_size([idx0,idx1])
         return float(overlap_size) / float(union_size)
 
     def detect_duplicates(self, overlap_threshold):
-        duplicate_masks = set()
+        pairs = self.close_pairs(max_dist=0)
+        if len(pairs) == 0:
+            return set()
 
-        for idx0,idx1 in self.close_sets(set_size=2, max_dist=0):
-            overlap_frac = self.overlap_fraction(idx0, idx1)
+        overlap_size = np.asarray(
+            self.overlaps[pairs[:,0], pairs[:,1]]).ravel()
+        union_size = self.sizes[pairs[:,0]] + self.sizes[pairs[:,1]] - \
+            overlap_size
+        overlap_frac = overlap_size.astype(float) / union_size
 
-            if overlap_frac > overlap_threshold:
-                duplicate_masks.add(tuple(sorted([idx0,idx1])))
-
-        return duplicate_masks
+        duplicates = pairs[overlap_frac > overlap_threshold]
+        return set(map(tuple, duplicates.tolist()))
 
     def mask_is_union_of_set(self, mask_idx, set_idxs, threshold):
         # does this mask overlap with each element of the set individually?
         # i.e. overlap of mask and set element covers most of the set element
         for set_mask_idx in set_idxs:
-            overlap_size = self.intersection_size([set_mask_idx, mask_idx])
+            overlap_size = self.overlap_size(set_mask_idx, mask_idx)
             set_mask_size = self.size(set_mask_idx)
             if overlap_size < threshold * set_mask_size:
                 return False
 
-
         # does this mask cover more than the union of the individual set elements?
-        set_union = self.union(set_idxs)
-        mask = self.mask(mask_idx)
-        overlap = set_union & mask
-        overlap_size = overlap.sum()
+        overlap_size = np.intersect1d(self._union_pixels(set_idxs),
+                                      self.pixels(mask_idx),
+                                      assume_unique=True).size
 
         return overlap_size > self.size(mask_idx) * threshold
 
@@ -96,15 +191,19 @@ class MaskSet( object ):
         union_masks = {}
 
         mask_combos = list(self.close_sets(set_size, max_dist))
+        if len(mask_combos) == 0:
+            return union_masks
+
+        neighbors = self._neighbors(max_dist)
 
         for i, set_idxs in enumerate(mask_combos):
-            for mask_idx in range(self.count):
-                if mask_idx in set_idxs:
-                    continue
-                elif not self.close([mask_idx] + list(set_idxs), max_dist):
-                    continue        
+            # only masks close to every set element can be unions of the set
+            candidates = set.intersection(*[ neighbors[idx]
+                                             for idx in set_idxs ])
+            candidates.difference_update(set_idxs)
 
-                if self.mask_is_union_of_set(mask_idx, set_idxs, threshold):                    
+            for mask_idx in sorted(candidates):
+                if self.mask_is_union_of_set(mask_idx, set_idxs, threshold):
                     if mask_idx in union_masks:
                         logging.warning("already detected this mask as a union")
                     union_masks[mask_idx] = set_idxs
@@ -114,13 +213,13 @@ class MaskSet( object ):
     def union_size(self, mask_idxs):
         mask_idxs = self._idx_key(mask_idxs)
 
-        if mask_idxs in self.cached_union_sizes:
-            return self.cached_union_sizes[mask_idxs]
-   
-        s = self.union(mask_idxs).sum()
-        self.cached_union_sizes[mask_idxs] = s
+        if len(mask_idxs) == 1:
+            return self.sizes[mask_idxs[0]]
+        elif len(mask_idxs) == 2:
+            return self.sizes[mask_idxs[0]] + self.sizes[mask_idxs[1]] - \
+                self.overlap_size(*mask_idxs)
 
-        return s
+        return self._union_pixels(mask_idxs).size
 
     def intersection(self, mask_idxs):        
         mask_idxs = self._idx_key(mask_idxs)
@@ -133,64 +232,122 @@ class MaskSet( object ):
 
         # don't cache the empty ones
         if not self.close(mask_idxs, 0):
-            return np.zeros(self.masks[0].shape)
+            return np.zeros(self.shape)
         
-        i0 = mask_idxs[0]
-        intersection = self.masks[i0].copy()
+        intersection = self._to_mask(self._intersection_pixels(mask_idxs))
 
-        if len(mask_idxs) == 1:
-            return intersection
-
-        for idx in mask_idxs[1:]:
-            intersection &= self.masks[idx]
-
-        self.cached_intersections[mask_idxs] = intersection
+        if len(mask_idxs) > 1:
+            self.cached_intersections[mask_idxs] = intersection
 
         return intersection
 
     def intersection_size(self, mask_idxs):
         mask_idxs = self._idx_key(mask_idxs)
 
-        if mask_idxs in self.cached_intersection_sizes:
-            return self.cached_intersection_sizes[mask_idxs]
-   
-        s = self.intersection(mask_idxs).sum()
-        self.cached_intersection_sizes[mask_idxs] = s
+        if len(mask_idxs) == 1:
+            return self.sizes[mask_idxs[0]]
+        elif len(mask_idxs) == 2:
+            return self.overlap_size(*mask_idxs)
+        elif not self.close(mask_idxs, 0):
+            return 0
 
-        return s
+        return self._intersection_pixels(mask_idxs).size
 
     def size(self, mask_idx):
-        return self.union_size([mask_idx])
+        return self.sizes[mask_idx]
+
+
+def create_mask_matrix(masks):
+    """ Convert a (masks x rows x columns) boolean array into a sparse
+    (masks x pixels) CSR matrix """
+    flat_masks = masks.reshape(masks.shape[0], -1)
+    mask_idxs, pixels = np.nonzero(flat_masks)
+    indptr = np.zeros(flat_masks.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(mask_idxs, minlength=flat_masks.shape[0]),
+              out=indptr[1:])
+    data = np.ones(len(pixels), dtype=bool)
+    return sparse.csr_matrix((data, pixels, indptr), shape=flat_masks.shape)
+
+
+def make_bbs_from_matrix(mask_matrix, shape):
+    """ Bounding boxes, [[min row, max row], [min col, max col]], of the
+    masks in a sparse (masks x pixels) matrix """
+    num_masks = mask_matrix.shape[0]
+    if num_masks == 0:
+        return np.zeros((0, 2, 2), dtype=int)
+
+    starts = mask_matrix.indptr[:-1]
+    if np.any(np.diff(mask_matrix.indptr) == 0):
+        raise ValueError("masks must not be empty")
+
+    rows, cols = np.unravel_index(mask_matrix.indices, shape)
+    bbs = np.empty((num_masks, 2, 2), dtype=int)
+    bbs[:,0,0] = np.minimum.reduceat(rows, starts)
+    bbs[:,0,1] = np.maximum.reduceat(rows, starts)
+    bbs[:,1,0] = np.minimum.reduceat(cols, starts)
+    bbs[:,1,1] = np.maximum.reduceat(cols, starts)
+
+    return bbs
 
 
 def make_bbs(masks):
-    bbs = []
+    masks = np.asarray(masks, dtype=bool)
+    return make_bbs_from_matrix(create_mask_matrix(masks), masks.shape[1:])
 
-    for i in range(len(masks)):
-        m = np.where(masks[i])
-        bbs.append([[m[0].min(), m[0].max()],[m[1].min(), m[1].max()]])
 
-    return bbs
+def bb_pair_dist(bbi, bbj):
+    """ Distances between corresponding bounding boxes of two
+    (boxes x 2 x 2) arrays. Boxes that overlap have distance <= 0. """
+    distx = np.where(bbi[:,0,0] < bbj[:,0,1],
+                     bbj[:,0,0] - bbi[:,0,1],
+                     bbi[:,0,0] - bbj[:,0,1])
+    disty = np.where(bbi[:,1,0] < bbj[:,1,1],
+                     bbj[:,1,0] - bbi[:,1,1],
+                     bbi[:,1,0] - bbj[:,1,1])
+    return np.maximum(distx, disty)
+
 
 def bb_dist(bbs):
+    bbs = np.asarray(bbs).reshape(-1, 2, 2)
     num_bbs = len(bbs)
 
     dist = np.zeros((num_bbs, num_bbs))
-    for i,j in itertools.combinations(range(num_bbs), 2):
-        bbi = bbs[i]
-        bbj = bbs[j]
+    i, j = np.triu_indices(num_bbs, 1)
+    dist[i,j] = bb_pair_dist(bbs[i], bbs[j])
+    dist[j,i] = dist[i,j]
 
-        if bbi[0][0] < bbj[0][1]:
-            distx = bbj[0][0] - bbi[0][1]
-        else:
-            distx = bbi[0][0] - bbj[0][1]
+    return dist
 
-        if bbi[1][0] < bbj[1][1]:
-            disty = bbj[1][0] - bbi[1][1]
-        else:
-            disty = bbi[1][0] - bbj[1][1]
 
-        dist[i,j] = max(distx,disty)
-        dist[j,i] = dist[i,j]
+def close_bb_pairs(bbs, max_dist):
+    """ Find all pairs of bounding boxes within max_dist of each other by
+    sweeping over boxes sorted by their first row, so that only boxes whose
+    row extents come within max_dist are compared.
 
-    return dist
+    Returns
+    -------
+    np.ndarray
+        (pairs x 2) array of box indices, i < j, in lexicographic order
+    """
+    bbs = np.asarray(bbs).reshape(-1, 2, 2)
+    num_bbs = len(bbs)
+
+    order = np.argsort(bbs[:,0,0], kind="stable")
+    sorted_starts = bbs[order,0,0]
+    # boxes sorted after box k whose first row is within max_dist of
+    # box k's last row; overlapping boxes always qualify
+    window_ends = np.searchsorted(sorted_starts,
+                                  bbs[order,0,1] + max(max_dist, 0),
+                                  side="right")
+    window_starts = np.arange(1, num_bbs + 1)
+    counts = np.maximum(window_ends - window_starts, 0)
+
+    first = np.repeat(np.arange(num_bbs), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                  counts)
+    second = window_starts[first] + offsets
+
+    pairs = np.sort(np.column_stack((order[first], order[second])), axis=1)
+    pairs = pairs[bb_pair_dist(bbs[pairs[:,0]], bbs[pairs[:,1]]) <= max_dist]
+
+    return pairs[np.lexsort((pairs[:,1], pairs[:,0]))]
@@ -1,4 +1,5 @@
 import logging
+import multiprocessing as mp
 
 import numpy as np
 
@@ -17,6 +18,39 @@ import allensdk.internal.model.glif.error_functions as error_functions
 # TODO: license
 # TODO: document
 
+# TODO: unhardcode this
+DT_MULTIPLIER_LIST = [100, 32, 10]
+#Note the following line may be useful when there are more iteration but is hasnt been tested
+#DT_MULTIPLIER_LIST = np.ceil(np.logspace(1,2,self.inner_iterations))[::-1].astype(int)
+
+_worker_optimizer = None
+
+
+def _init_worker(optimizer):
+    global _worker_optimizer
+    _worker_optimizer = optimizer
+
+
+def _run_chain(args):
+    # each chain starts from an empty cache, so that its results do not
+    # depend on which chains ran before it in this worker
+    optimizer = _worker_optimizer
+    optimizer.error_cache = {}
+    optimizer.evaluation_count = 0
+    optimizer.cache_hit_count = 0
+
+    chain_info = optimizer.run_chain(*args)
+    return (chain_info, optimizer.error_cache,
+            optimizer.evaluation_count, optimizer.cache_hit_count)
+
+
+def perturb_parameter_values(values, sigma, noise):
+    ''' Randomize values as rng.normal(values, sigma) would, from its
+    standard normal draws '''
+    values = np.asarray(values, dtype=float)
+    return values + sigma * np.reshape(noise, values.shape)
+
+
 class GlifOptimizer(object):
     def __init__(self, experiment, dt, 
                  outer_iterations, inner_iterations, 
@@ -27,7 +61,9 @@ class GlifOptimizer(object):
                  bessel,
                  error_function = None,
                  error_function_data = None,
-                 init_params = None):
+                 init_params = None,
+                 num_workers = 1,
+                 cache_decimals = 10):
 
         self.start_time = None
         self.rng = np.random.RandomState()
@@ -56,6 +92,16 @@ class GlifOptimizer(object):
         
         self.bessel = bessel
 
+        # outer iterations (independent restarts) are run in this many processes
+        self.num_workers = num_workers
+
+        # errors are memoized on the dt multiplier and the parameters rounded to this many
+        # decimals.  None disables the cache.
+        self.cache_decimals = cache_decimals
+        self.error_cache = {}
+        self.evaluation_count = 0
+        self.cache_hit_count = 0
+
         logging.info('internal_iterations: %s' % internal_iterations)
         logging.info('outer_iterations: %s' % outer_iterations)
         logging.info('inner_iterations: %s' % inner_iterations)
@@ -108,90 +154,118 @@ class GlifOptimizer(object):
 
         self.experiment.neuron.dt_multiplier = dt_multiplier
         return self.error_function([x], self.experiment, self.error_function_data)
+
+    def cached_error_function(self, x, experiment, error_function_data):
+        ''' error_function, memoized on the neuron's dt multiplier and the rounded parameters '''
+        self.evaluation_count += 1
+        if self.cache_decimals is None:
+            return self.error_function(x, experiment, error_function_data)
+
+        key = (experiment.neuron.dt_multiplier,
+               tuple(np.round(np.asarray(x, dtype=float), self.cache_decimals).tolist()))
+        error = self.error_cache.get(key, None)
+        if error is None:
+            error = self.error_function(x, experiment, error_function_data)
+            self.error_cache[key] = error
+        else:
+            self.cache_hit_count += 1
+        return error
+
+    def run_chain(self, outer, params, noise):
+        '''
+        Run the inner iterations of one outer iteration.  Each inner
+        iteration optimizes from the randomized best parameters of the
+        previous one.
+        @param outer: index of the outer iteration
+        @param params: starting parameters of the first inner iteration
+        @param noise: standard normal draws used to randomize the best
+            parameters after each inner iteration, one row per inner iteration
+        @return: list of iteration info dictionaries, one per inner iteration
+        '''
+        chain_info = []
+        for inner in range(0, self.inner_iterations):  #innerloop
+            iteration_start_time = time.time()
+            evaluation_count = self.evaluation_count
+            cache_hit_count = self.cache_hit_count
+
+            # run the optimizer once.  first time is always the passed initial conditions.
+            #--set this equal to 1 if want to do it slow
+            self.experiment.neuron.dt_multiplier = DT_MULTIPLIER_LIST[inner]
+
+            opt = self.run_once(params)
+            xopt, fopt = opt[0], opt[1]
+
+            iteration_time = time.time() - iteration_start_time
+            logging.info('fmin took %f secs, %f mins, %f hours' %  (iteration_time, iteration_time/60, iteration_time/60/60))
+
+            chain_info.append({
+                'outer': outer,
+                'inner': inner,
+                'in_params': np.array(params).tolist(),
+                'out_params': xopt.tolist(),
+                'error': float(fopt),
+                'dt_multiplier': self.experiment.neuron.dt_multiplier,
+                'time': iteration_time,
+                'evaluations': self.evaluation_count - evaluation_count,
+                'cache_hits': self.cache_hit_count - cache_hit_count
+            })
+
+            # randomize the best fit parameters
+            params = perturb_parameter_values(xopt, self.sigma_inner,
+                                              noise[inner])
+
+        return chain_info
         
     def run_many(self, iteration_finished_callback=None, seed=None):
         self.initiate_unique_seed(seed=seed)
-        params_start = self.init_params
         self.start_time = time.time()
-        params=params_start
-#        params=self.randomize_parameter_values(params_start, self.sigma_outer)
-        print('actual starting parameters', params)
-        
-        stop_flag=False
-        
-        # TODO: unhardcode this
-        dt_multiplier_list = [100, 32, 10]
-        #Note the following line may be useful when there are more iteration but is hasnt been tested
-#        dt_multiplier_list = np.ceil(np.logspace(1,2,self.inner_iterations))[::-1].astype(int)
-        print(dt_multiplier_list)
-#         dt_multiplier_list = [10,10,10]
-        #TODO: figure out the implications of this being an int versus float
-        #TODO: make this so that dt multiplier actually gets set
-        for outer in range(0, self.outer_iterations):  #outerloop 
-            for inner in range(0, self.inner_iterations):  #innerloop
-                iteration_start_time = time.time()
-
-                # run the optimizer once.  first time is always the passed initial conditions.
-#                 print('dt_multiplier_list[inner]', dt_multiplier_list[inner])
-                #--set this equal to 1 if want to do it slow
-                self.experiment.neuron.dt_multiplier = dt_multiplier_list[inner]
-                #self.experiment.neuron.dt_multiplier = 10
-                
-                
-                opt = self.run_once(params)
-                xopt, fopt = opt[0], opt[1]
-
-                logging.info('fmin took %f secs, %f mins, %f hours' %  (time.time() - iteration_start_time, (time.time() - iteration_start_time)/60, (time.time() - iteration_start_time)/60/60))
-
-                self.iteration_info.append({
-                    'in_params': np.array(params).tolist(),
-                    'out_params': xopt.tolist(),
-                    'error': float(fopt),
-                    'dt_multiplier': self.experiment.neuron.dt_multiplier
-                })
-
-#                ER=self.iteration_info['error']
-#                ETOL=1.e-4
-#                if len(ER) >=3:
-#                    #!!!!!!!!!!!!!!!fix this to use that actual parameters!!!!!!!!!!!!!!!!!!!!!!
-#                    if np.abs(ER[-1]-ER[-2])<ETOL and np.abs(ER[-1]-ER[-3])<ETOL and np.abs(ER[-2]-ER[-3])<ETOL:
-#                        stop_flag=True
-                    
-                    
-
+        print('actual starting parameters', self.init_params)
+        print(DT_MULTIPLIER_LIST)
+
+        # Randomizing parameters only shifts standard normal draws, so all
+        # draws are made up front, in the order of the serial loop: after
+        # each inner iteration, then after each outer iteration for the start
+        # of the next one.  Chains can then run in any order or process
+        # and still consume the same random stream.
+        parameter_count = len(self.init_params)
+        noise = self.rng.standard_normal(
+            (self.outer_iterations, self.inner_iterations + 1,
+             parameter_count))
+
+        # the first outer iteration starts from the initial parameters, later
+        # ones (the outer loop) use the outer standard deviation to randomize
+        # the initial values.
+        chain_params = [self.init_params] + [
+            perturb_parameter_values(self.init_params, self.sigma_outer,
+                                     noise[outer - 1, -1])
+            for outer in range(1, self.outer_iterations)
+        ]
+        tasks = [(outer, params, noise[outer, :-1])
+                 for outer, params in enumerate(chain_params)]
+
+        def record(chain_info):
+            for info in chain_info:
+                self.iteration_info.append(info)
+                self.experiment.neuron.dt_multiplier = info['dt_multiplier']
                 if iteration_finished_callback is not None:
-                    iteration_finished_callback(self, outer, inner)
-                    
-                if stop_flag is True:
-                    break
-
-                # randomize the best fit parameters
-                params = self.randomize_parameter_values(xopt, self.sigma_inner)
-                #params = xtol*(1-self.eps/2+self.eps*np.random.random(len(params),))
-                
-                #---Calculate the other fitness functions
-                
-                '''Add other fitness functions here
-                first gotta calculate the spike trains again
-                also look and see what the difference between
-                the size of a pickle file and a text file is to 
-                decide how to save stimulus and traces'''
-                
-                #Take the current best values and run the program again.
-                #tempTimeIterStart=time.time()
-                #(voltage_list, threshold_list, AScurrentMatrix_list, gridSpikeTime_list, interpolatedSpikeTime_list, \
-                #    gridSpikeIndex_list, interpolatedSpikeVoltage_list, interpolatedSpikeThreshold_list) = \
-                #    self.experiment.run_base_model(xtol)
-
-                #timeFor1Iter=time.time()-tempTimeIterStart  
-
-            # outer loop uses the outer standard deviation to randomize the initial values
-
-            if stop_flag is True:
-                break
-            
-            params = self.randomize_parameter_values(self.init_params, self.sigma_outer)
+                    iteration_finished_callback(self, info['outer'], info['inner'])
 
+        if self.num_workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                record(self.run_chain(*task))
+        else:
+            # chains run on copies of this optimizer; merge their evaluation
+            # counts and cached errors back before reporting them
+            with mp.Pool(min(self.num_workers, len(tasks)),
+                         initializer=_init_worker, initargs=(self,)) as pool:
+                for chain_info, error_cache, evaluation_count, cache_hit_count \
+                        in pool.imap(_run_chain, tasks):
+                    self.error_cache.update(error_cache)
+                    self.evaluation_count += evaluation_count
+                    self.cache_hit_count += cache_hit_count
+                    record(chain_info)
+
+        logging.info('optimization took %f secs' % (time.time() - self.start_time))
 
         # get the best one!
         min_error = float("inf")
@@ -232,7 +306,7 @@ class GlifOptimizer(object):
 #        fmin(func, x0, args=(), xtol=1e-4, ftol=1e-4, maxiter=None, maxfun=None, full_output=0, disp=1, retall=0, callback=None):
 
         print('self.error_function_data', self.error_function_data)
-        xopt, fopt, _, _, _, _ = fmin(self.error_function, param0, args=(self.experiment,self.error_function_data),xtol=self.xtol, ftol=self.ftol,  maxiter=self.internal_iterations, maxfun=self.internal_iterations, retall=1,full_output=1, disp=1)
+        xopt, fopt, _, _, _, _ = fmin(self.cached_error_function, param0, args=(self.experiment,self.error_function_data),xtol=self.xtol, ftol=self.ftol,  maxiter=self.internal_iterations, maxfun=self.internal_iterations, retall=1,full_output=1, disp=1)
 
         return xopt, fopt
 #         res = minimize(self.error_function, param0,
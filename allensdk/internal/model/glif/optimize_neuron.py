@@ -87,7 +87,8 @@ def optimize_neuron(model_config, sweep_index, nwb_file, save_callback=None):
                               ftol = optimizer_config['ftol'],
                               internal_iterations = optimizer_config['internal_iterations'],
                               init_params = optimizer_config.get('init_params', None),
-                              bessel = optimizer_config['bessel'])
+                              bessel = optimizer_config['bessel'],
+                              num_workers = optimizer_config.get('num_workers', 1))
 
     def save(optimizer, outer, inner):
         logging.info('finished outer: %d inner: %d' % (outer, inner))
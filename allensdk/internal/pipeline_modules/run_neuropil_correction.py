@@ -4,7 +4,7 @@ matplotlib.use('agg')
 import matplotlib.pyplot as plt
 import logging
 import numpy as np
-from allensdk.brain_observatory.r_neuropil import estimate_contamination_ratios
+from allensdk.brain_observatory.r_neuropil import estimate_all_contamination_ratios
 import allensdk.internal.core.lims_utilities as lu
 import h5py
 import json
@@ -159,22 +159,35 @@ def main():
     corrected = np.zeros((num_traces, T_orig))
     r_vals = [ None ] * num_traces
 
-    for n in range(num_traces):
-        roi = roi_traces['data'][n]
-        neuropil = neuropil_traces['data'][n]   
+    roi_data = roi_traces['data'][:]
+    neuropil_data = neuropil_traces['data'][:]
 
-        if np.any(np.isnan(neuropil)):
+    valid = np.ones(num_traces, dtype=bool)
+    for n in range(num_traces):
+        if np.any(np.isnan(neuropil_data[n])):
             logging.warning("neuropil trace for roi %d contains NaNs, skipping", n)
-            continue
-            
-        if np.any(np.isnan(roi)):
+            valid[n] = False
+        elif np.any(np.isnan(roi_data[n])):
             logging.warning("roi trace for roi %d contains NaNs, skipping", n)
-            continue
+            valid[n] = False
 
-        r = None
+    # fit all valid traces at once
+    valid_results = estimate_all_contamination_ratios(
+        roi_data[valid], neuropil_data[valid],
+        num_workers=jin.get("num_workers", 1))
+    all_results = [ None ] * num_traces
+    for n, results in zip(np.flatnonzero(valid), valid_results):
+        all_results[n] = results
+
+    for n in range(num_traces):
+        roi = roi_data[n]
+        neuropil = neuropil_data[n]
+        results = all_results[n]
+
+        if results is None:
+            continue
 
         logging.info("Correcting trace %d (roi %s)", n, str(n_id[n]))
-        results  = estimate_contamination_ratios(roi, neuropil)
         logging.info("r=%f err=%f it=%d", results["r"], results["err"], results["it"])
 
         r = results["r"]
@@ -197,8 +210,8 @@ def main():
 
     # fill in empty r values
     for n in range(num_traces):        
-        roi = roi_traces['data'][n]
-        neuropil = neuropil_traces['data'][n]
+        roi = roi_data[n]
+        neuropil = neuropil_data[n]
 
         if r_list[n] is None:
             logging.warning("Error estimated r for trace %d. Setting to zero.", n)
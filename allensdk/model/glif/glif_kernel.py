@@ -0,0 +1,380 @@
+# Allen Institute Software License - This software license is the 2-clause BSD
+# license plus a third clause that prohibits redistribution for commercial
+# purposes without further permission.
+#
+# Copyright 2024. Allen Institute. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# 3. Redistributions for commercial purposes are not permitted without the
+# Allen Institute's written permission.
+# For purposes of this license, commercial purposes is the incorporation of the
+# Allen Institute's software into anything for which you will charge fees or
+# other compensation. Contact terms@alleninstitute.org for commercial licensing
+# opportunities.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+""" A scalar simulation kernel for the GlifNeuron.
+
+The kernel applies the library dynamics and reset rules of glif_neuron_methods
+with the neuron's parameters folded into scalar constants, so that each time
+step is a handful of floating point operations rather than a chain of method
+calls. The arithmetic mirrors the library methods operation for operation, so
+that the kernel reproduces GlifNeuron.run exactly. If numba is installed the
+kernel is compiled; otherwise it runs as plain python.
+"""
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    import glif_neuron_methods as gnm
+except ImportError:
+    from . import glif_neuron_methods as gnm
+
+
+ASC_DYNAMICS_CODES = {
+    gnm.dynamics_AScurrent_exp: 0,
+    gnm.dynamics_AScurrent_none: 1
+}
+VOLTAGE_DYNAMICS_CODES = {
+    gnm.dynamics_voltage_linear_forward_euler: 0
+}
+THRESHOLD_DYNAMICS_CODES = {
+    gnm.dynamics_threshold_inf: 0,
+    gnm.dynamics_threshold_spike_component: 1,
+    gnm.dynamics_threshold_three_components_exact: 2
+}
+ASC_RESET_CODES = {
+    gnm.reset_AScurrent_sum: 0,
+    gnm.reset_AScurrent_none: 1
+}
+VOLTAGE_RESET_CODES = {
+    gnm.reset_voltage_v_before: 0,
+    gnm.reset_voltage_zero: 1
+}
+THRESHOLD_RESET_CODES = {
+    gnm.reset_threshold_inf: 0,
+    gnm.reset_threshold_three_components: 1
+}
+
+# numpy sums fewer than this many values sequentially; beyond it, pairwise
+MAX_KERNEL_AScurrents = 8
+
+# returned by the kernel when AScurrents are nonzero at a 'none' reset
+LIF_ASCURRENT_ERROR = -1
+
+
+def _method_code(method, codes):
+    func = getattr(method.method, 'func', None)
+    return codes.get(func, None)
+
+
+def supports(neuron):
+    """ Check whether the kernel can simulate a neuron.
+
+    The neuron must use the GlifNeuron dynamics and reset implementations and
+    library methods for every rule.
+
+    Parameters
+    ----------
+    neuron : GlifNeuron
+
+    Returns
+    -------
+    bool
+    """
+    from allensdk.model.glif.glif_neuron import GlifNeuron
+
+    if type(neuron).dynamics is not GlifNeuron.dynamics or \
+            type(neuron).reset is not GlifNeuron.reset:
+        return False
+
+    codes = [
+        _method_code(neuron.AScurrent_dynamics_method, ASC_DYNAMICS_CODES),
+        _method_code(neuron.voltage_dynamics_method, VOLTAGE_DYNAMICS_CODES),
+        _method_code(neuron.threshold_dynamics_method,
+                     THRESHOLD_DYNAMICS_CODES),
+        _method_code(neuron.AScurrent_reset_method, ASC_RESET_CODES),
+        _method_code(neuron.voltage_reset_method, VOLTAGE_RESET_CODES),
+        _method_code(neuron.threshold_reset_method, THRESHOLD_RESET_CODES)
+    ]
+    if any(code is None for code in codes):
+        return False
+
+    # the three component reset needs threshold components from the dynamics
+    if codes[2] == 0 and codes[5] == 1:
+        return False
+
+    return len(neuron.init_AScurrents) < MAX_KERNEL_AScurrents
+
+
+def _simulate(stim, asc_dynamics, threshold_dynamics, asc_reset,
+              voltage_reset, threshold_reset,
+              dt, El, g, C, th_inf, asc_decay,
+              voltage_decay, threshold_decay, phi, a_over_b, spike_decay,
+              asc_reset_amp, asc_reset_r, asc_cut_decay,
+              voltage_reset_a, voltage_reset_b,
+              spike_cut_decay, a_spike_reset,
+              voltage_init, threshold_init, AScurrents_init, spike_cut_length,
+              voltage_out, threshold_out, AScurrents_out,
+              spike_time_steps, spike_values):
+    """ Step a neuron through a stimulus, writing into the preallocated
+    outputs. Returns the number of spikes, or LIF_ASCURRENT_ERROR. """
+    num_time_steps = len(stim)
+    num_AScurrents = len(AScurrents_init)
+
+    voltage_t0 = voltage_init
+    threshold_t0 = threshold_init
+    AScurrents_t0 = AScurrents_init.copy()
+    AScurrents_t1 = AScurrents_init.copy()
+    th_spike = 0.0
+    th_voltage = 0.0
+    num_spikes = 0
+
+    time_step = 0
+    while time_step < num_time_steps:
+        inj = stim[time_step]
+        current = 0.0
+        for j in range(num_AScurrents):
+            current += AScurrents_t0[j]
+        current = inj + current
+
+        # dynamics
+        for j in range(num_AScurrents):
+            if asc_dynamics == 0:
+                AScurrents_t1[j] = AScurrents_t0[j] * asc_decay[j]
+            else:
+                AScurrents_t1[j] = 0.0
+
+        voltage_t1 = voltage_t0 + (current - g * (voltage_t0 - El)) * dt / C
+
+        if threshold_dynamics == 0:
+            threshold_t1 = th_inf
+        elif threshold_dynamics == 1:
+            th_spike = th_spike * spike_decay
+            th_voltage = 0.0
+            threshold_t1 = th_spike + th_inf
+        else:
+            beta = (current + g * El) / g
+            offset = phi * (voltage_t0 - beta)
+            th_voltage = (offset * voltage_decay
+                          + threshold_decay * (th_voltage - offset
+                                               - a_over_b * (beta - El) - 0.0)
+                          + a_over_b * (beta - El) + 0.0)
+            th_spike = th_spike * spike_decay
+            threshold_t1 = th_voltage + th_spike + th_inf
+
+        if voltage_t1 > threshold_t1:
+            spike_time_steps[num_spikes] = time_step
+            spike_values[num_spikes, 0] = voltage_t0
+            spike_values[num_spikes, 1] = voltage_t1
+            spike_values[num_spikes, 2] = threshold_t0
+            spike_values[num_spikes, 3] = threshold_t1
+            num_spikes += 1
+
+            # reset
+            if asc_reset == 0:
+                for j in range(num_AScurrents):
+                    AScurrents_t0[j] = (asc_reset_amp[j] + AScurrents_t1[j]
+                                        * asc_reset_r[j] * asc_cut_decay[j])
+            else:
+                total = 0.0
+                for j in range(num_AScurrents):
+                    total += AScurrents_t1[j]
+                if total != 0:
+                    return LIF_ASCURRENT_ERROR
+                for j in range(num_AScurrents):
+                    AScurrents_t0[j] = 0.0
+
+            if voltage_reset == 0:
+                voltage_t0 = voltage_reset_a * voltage_t1 + voltage_reset_b
+            else:
+                voltage_t0 = 0.0
+
+            if threshold_reset == 0:
+                threshold_t0 = th_inf
+            else:
+                if spike_cut_length > 0:
+                    th_spike = th_spike * spike_cut_decay
+                th_spike = th_spike + a_spike_reset
+                threshold_t0 = th_spike + th_voltage + th_inf
+
+            bad_reset = voltage_t0 > threshold_t0
+
+            if spike_cut_length > 0:
+                # the outputs are already nan through the cut
+                cut_step = time_step + spike_cut_length
+                if cut_step < num_time_steps:
+                    voltage_out[cut_step] = voltage_t0
+                    threshold_out[cut_step] = threshold_t0
+                    for j in range(num_AScurrents):
+                        AScurrents_out[cut_step, j] = AScurrents_t0[j]
+                time_step += spike_cut_length + 1
+            else:
+                voltage_out[time_step] = voltage_t0
+                threshold_out[time_step] = threshold_t0
+                for j in range(num_AScurrents):
+                    AScurrents_out[time_step, j] = AScurrents_t0[j]
+                time_step += 1
+
+            if bad_reset:
+                for i in range(time_step, min(time_step + 5, num_time_steps)):
+                    voltage_out[i] = voltage_t0
+                    threshold_out[i] = threshold_t0
+                    for j in range(num_AScurrents):
+                        AScurrents_out[i, j] = AScurrents_t0[j]
+                break
+        else:
+            voltage_out[time_step] = voltage_t1
+            threshold_out[time_step] = threshold_t1
+            for j in range(num_AScurrents):
+                AScurrents_out[time_step, j] = AScurrents_t1[j]
+
+            voltage_t0 = voltage_t1
+            threshold_t0 = threshold_t1
+            AScurrents_t0, AScurrents_t1 = AScurrents_t1, AScurrents_t0
+
+            time_step += 1
+
+    return num_spikes
+
+
+if numba is not None:
+    _simulate = numba.njit(cache=True)(_simulate)
+
+
+def _as_vector(values, num_AScurrents):
+    values = np.broadcast_to(np.asarray(values, dtype=float),
+                             (num_AScurrents,))
+    if numba is None:
+        # python floats are faster than numpy scalars in an interpreted loop
+        return values.tolist()
+    return np.ascontiguousarray(values)
+
+
+def run(neuron, stim):
+    """ Simulate a neuron over a stimulus with the kernel. See `supports` for
+    the neurons that the kernel can simulate.
+
+    Parameters
+    ----------
+    neuron : GlifNeuron
+    stim : np.ndarray
+        vector of scalar current values
+
+    Returns
+    -------
+    tuple
+        voltage, threshold and AScurrents outputs (as from GlifNeuron.run),
+        the spike time steps, and a (spikes x 4) array of the voltage and
+        threshold before and after each spike step.
+    """
+    num_time_steps = len(stim)
+    num_AScurrents = len(neuron.init_AScurrents)
+    spike_cut_length = neuron.spike_cut_length
+    dt = neuron.dt
+    coeffs = neuron.coeffs
+
+    # fold the neuron parameters into the constants of each library method,
+    # computing them exactly as those methods do
+    g = neuron.G * coeffs['G']
+    C = neuron.C * coeffs['C']
+    th_inf = coeffs['th_inf'] * neuron.th_inf
+
+    asc_decay = np.exp(-neuron.k*neuron.dt)
+
+    voltage_decay = threshold_decay = phi = a_over_b = spike_decay = 0.0
+    threshold_dynamics_params = \
+        neuron.threshold_dynamics_method.method.keywords
+    if 'b_spike' in threshold_dynamics_params:
+        spike_decay = np.exp(-threshold_dynamics_params['b_spike'] * dt)
+    if 'a_voltage' in threshold_dynamics_params:
+        a_voltage = threshold_dynamics_params['a_voltage'] * coeffs['a']
+        b_voltage = threshold_dynamics_params['b_voltage'] * coeffs['b']
+        voltage_decay = np.exp(-g*dt/C)
+        threshold_decay = 1/(np.exp(b_voltage*dt))
+        phi = a_voltage/(b_voltage-g/C)
+        a_over_b = a_voltage/b_voltage
+
+    asc_reset_amp = neuron.asc_amp_array * coeffs['asc_amp_array']
+    asc_reset_r = asc_cut_decay = np.zeros(num_AScurrents)
+    asc_reset_params = neuron.AScurrent_reset_method.method.keywords
+    if 'r' in asc_reset_params:
+        asc_reset_r = asc_reset_params['r']
+        asc_cut_decay = np.exp(-(neuron.k * neuron.dt * spike_cut_length))
+
+    voltage_reset_params = neuron.voltage_reset_method.method.keywords
+    voltage_reset_a = voltage_reset_params.get('a', 0.0)
+    voltage_reset_b = voltage_reset_params.get('b', 0.0)
+
+    spike_cut_decay = a_spike_reset = 0.0
+    threshold_reset_params = neuron.threshold_reset_method.method.keywords
+    if 'a_spike' in threshold_reset_params:
+        a_spike_reset = threshold_reset_params['a_spike']
+        if spike_cut_length > 0:
+            spike_cut_decay = gnm.spike_component_of_threshold_exact(
+                1.0, threshold_reset_params['b_spike'],
+                np.arange(1, spike_cut_length + 1) * dt)[-1]
+
+    voltage_out = np.empty(num_time_steps)
+    voltage_out[:] = np.nan
+    threshold_out = np.empty(num_time_steps)
+    threshold_out[:] = np.nan
+    AScurrents_out = np.empty(shape=(num_time_steps, num_AScurrents))
+    AScurrents_out[:] = np.nan
+
+    max_spikes = num_time_steps // (spike_cut_length + 1) + 1
+    spike_time_steps = np.zeros(max_spikes, dtype=np.int64)
+    spike_values = np.zeros((max_spikes, 4))
+
+    stim = np.asarray(stim, dtype=float)
+    num_spikes = _simulate(
+        stim if numba is not None else stim.tolist(),
+        ASC_DYNAMICS_CODES[neuron.AScurrent_dynamics_method.method.func],
+        THRESHOLD_DYNAMICS_CODES[neuron.threshold_dynamics_method.method.func],
+        ASC_RESET_CODES[neuron.AScurrent_reset_method.method.func],
+        VOLTAGE_RESET_CODES[neuron.voltage_reset_method.method.func],
+        THRESHOLD_RESET_CODES[neuron.threshold_reset_method.method.func],
+        float(dt), float(neuron.El), float(g), float(C), float(th_inf),
+        _as_vector(asc_decay, num_AScurrents),
+        float(voltage_decay), float(threshold_decay), float(phi),
+        float(a_over_b), float(spike_decay),
+        _as_vector(asc_reset_amp, num_AScurrents),
+        _as_vector(asc_reset_r, num_AScurrents),
+        _as_vector(asc_cut_decay, num_AScurrents),
+        float(voltage_reset_a), float(voltage_reset_b),
+        float(spike_cut_decay), float(a_spike_reset),
+        float(neuron.init_voltage), float(neuron.init_threshold),
+        _as_vector(neuron.init_AScurrents, num_AScurrents), spike_cut_length,
+        voltage_out, threshold_out, AScurrents_out, spike_time_steps,
+        spike_values)
+
+    if num_spikes == LIF_ASCURRENT_ERROR:
+        raise Exception(
+            'You are running a LIF but the AScurrents are not zero!')
+
+    return (voltage_out, threshold_out, AScurrents_out,
+            spike_time_steps[:num_spikes], spike_values[:num_spikes])
@@ -34,6 +34,7 @@
 # POSSIBILITY OF SUCH DAMAGE.
 #
 import logging
+import multiprocessing as mp
 
 import numpy as np
 import simplejson as json 
@@ -42,8 +43,10 @@ import copy
 
 try:
     from glif_neuron_methods import GlifNeuronMethod, METHOD_LIBRARY
+    import glif_kernel
 except:
     from .glif_neuron_methods import GlifNeuronMethod, METHOD_LIBRARY
+    from . import glif_kernel
 
 class GlifBadResetException( Exception ):
     """ Exception raised when voltage is still above threshold after a reset rule is applied. """
@@ -329,16 +332,23 @@ class GlifNeuron( object ):
 
         return voltage_t1, threshold_t1, AScurrents_t1, bad_reset_flag
     
-    def run(self, stim):
+    def run(self, stim, use_kernel=True):
         """ Run neuron simulation over a given stimulus. This steps through the stimulus applying dynamics equations.
         After each step it checks if voltage is above threshold.  If so, self.spike_cut_length NaNs are inserted 
         into the output voltages, reset rules are applied to the voltage, threshold, and afterspike currents, and the 
         simulation resumes.
 
+        Neurons configured with library dynamics and reset methods are simulated with the scalar kernel in
+        glif_kernel.py (compiled if numba is installed), which produces the same outputs. The kernel does not
+        record the neuron's threshold_components.
+
         Parameters
         ----------
         stim : np.ndarray
             vector of scalar current values
+        use_kernel : bool
+            simulate with the kernel when the neuron's methods allow it (default True).  If False, always
+            step through the stimulus with the neuron's methods.
 
         Returns
         -------
@@ -353,6 +363,9 @@ class GlifNeuron( object ):
                 'interpolated_spike_voltage': voltage of the simulation at interpolated spike times, 
                 'interpolated_spike_threshold': threshold of the simulation at interpolated spike times
         """
+        if use_kernel and glif_kernel.supports(self):
+            return self._run_kernel(stim)
+
         bad_reset_flag=False
         
         # initialize the voltage, threshold, and afterspike current values
@@ -459,6 +472,35 @@ class GlifNeuron( object ):
             'interpolated_spike_threshold': np.array(interpolated_spike_threshold)
             }
 
+    def _run_kernel(self, stim):
+        self.threshold_components = None  #get rid of lingering method data
+
+        (voltage_out, threshold_out, AScurrents_out,
+         spike_time_steps, spike_values) = glif_kernel.run(self, stim)
+
+        grid_spike_times = []
+        interpolated_spike_times = []
+        interpolated_spike_voltage = []
+        interpolated_spike_threshold = []
+        for time_step, (voltage_t0, voltage_t1, threshold_t0, threshold_t1) in zip(spike_time_steps.tolist(), spike_values):
+            grid_spike_times.append(time_step * self.dt)
+            interpolated_spike_times.append(interpolate_spike_time(self.dt, time_step, threshold_t0, threshold_t1, voltage_t0, voltage_t1))
+
+            interpolated_spike_time_offset = interpolated_spike_times[-1] - (time_step - 1) * self.dt
+            interpolated_spike_voltage.append(interpolate_spike_value(self.dt, interpolated_spike_time_offset, voltage_t0, voltage_t1))
+            interpolated_spike_threshold.append(interpolate_spike_value(self.dt, interpolated_spike_time_offset, threshold_t0, threshold_t1))
+
+        return {
+            'voltage': voltage_out,
+            'threshold': threshold_out,
+            'AScurrents': AScurrents_out,
+            'grid_spike_times': np.array(grid_spike_times),
+            'interpolated_spike_times': np.array(interpolated_spike_times),
+            'spike_time_steps': np.array(spike_time_steps.tolist()),
+            'interpolated_spike_voltage': np.array(interpolated_spike_voltage),
+            'interpolated_spike_threshold': np.array(interpolated_spike_threshold)
+            }
+
 # TODO: DEPRICATE
 #    def get_threshold_components(self):
 #        if self.threshold_components is None:
@@ -476,6 +518,45 @@ class GlifNeuron( object ):
             
 
 
+def _run_neuron(args):
+    neuron, stim = args
+    return neuron.run(stim)
+
+
+def run_batch(neurons, stimuli, num_workers=1):
+    """ Run many simulations, in parallel if requested.
+
+    Parameters
+    ----------
+    neurons : GlifNeuron or list
+        the neuron to simulate, or one neuron (e.g. one parameter set) per simulation
+    stimuli : np.ndarray or list
+        a vector of scalar current values, or one such vector per simulation. A single neuron or
+        stimulus is used for every simulation.
+    num_workers : int
+        number of processes to simulate with (default 1, serial)
+
+    Returns
+    -------
+    list
+        the output dictionary of GlifNeuron.run for each simulation
+    """
+    single_stimulus = isinstance(stimuli, np.ndarray) and stimuli.ndim == 1
+    if isinstance(neurons, GlifNeuron):
+        neurons = [neurons] * (1 if single_stimulus else len(stimuli))
+    if single_stimulus:
+        stimuli = [stimuli] * len(neurons)
+    if len(neurons) != len(stimuli):
+        raise ValueError("Got %d neurons but %d stimuli" % (len(neurons), len(stimuli)))
+
+    tasks = list(zip(neurons, stimuli))
+    if num_workers <= 1 or len(tasks) <= 1:
+        return [_run_neuron(task) for task in tasks]
+
+    with mp.Pool(min(num_workers, len(tasks))) as pool:
+        return pool.map(_run_neuron, tasks)
+
+
 def interpolate_spike_time(dt, time_step, threshold_t0, threshold_t1, voltage_t0, voltage_t1):
     """ Given two voltage and threshold values, the dt between them and the initial time step, interpolate
     a spike time within the dt interval by intersecting the two lines. """
@@ -1,8 +1,9 @@
 import numpy as np
 import pytest
+from scipy import stats
 
 from allensdk.brain_observatory.behavior.event_detection import \
-    filter_events_array
+    filter_events_array, sparse_events_array
 
 
 def test_filter_events_array():
@@ -19,3 +20,55 @@ def test_filter_events_array():
 
     expected = np.array([[0.0, 0.0, 0.199559]])
     assert (np.abs(filtered_events_array - expected) < 1e-6).all()
+
+
+@pytest.mark.parametrize("chunk_size, num_workers", [
+    (10000, 1), (7, 1), (19, 3), (1, 2)])
+@pytest.mark.parametrize("n_time_steps", [1, 5, 20])
+def test_filter_events_array_chunks(chunk_size, num_workers, n_time_steps):
+    np.random.seed(11)
+    arr = np.random.rand(5, 103) * (np.random.rand(5, 103) > 0.9)
+
+    filt = stats.halfnorm(loc=0, scale=3).pdf(np.arange(n_time_steps))
+    filt = filt / np.sum(filt)
+    expected = np.array([np.convolve(trace, filt)[:len(trace)]
+                         for trace in arr])
+
+    filtered = filter_events_array(arr, scale=3, n_time_steps=n_time_steps,
+                                   chunk_size=chunk_size,
+                                   num_workers=num_workers)
+    np.testing.assert_allclose(filtered, expected, rtol=0, atol=1e-12)
+
+
+def test_filter_events_array_memmap(tmpdir):
+    np.random.seed(12)
+    arr = np.random.rand(4, 50)
+    events = np.lib.format.open_memmap(str(tmpdir.join("events.npy")),
+                                       mode="w+", dtype=float, shape=arr.shape)
+    events[:] = arr
+    out = np.lib.format.open_memmap(str(tmpdir.join("filtered.npy")),
+                                    mode="w+", dtype=float, shape=arr.shape)
+
+    filtered = filter_events_array(events, chunk_size=8, out=out)
+    assert filtered is out
+    np.testing.assert_allclose(out, filter_events_array(arr),
+                               rtol=0, atol=1e-12)
+
+    with pytest.raises(ValueError):
+        filter_events_array(arr, out=np.zeros((4, 49)))
+
+
+@pytest.mark.parametrize("chunk_size, num_workers", [(10000, 1), (6, 2)])
+def test_sparse_events_array(chunk_size, num_workers):
+    arr = np.zeros((3, 20), dtype=np.float32)
+    arr[0, [2, 15]] = [0.5, 1.5]
+    arr[2, 7] = 0.25
+
+    events = sparse_events_array(arr, chunk_size=chunk_size,
+                                 num_workers=num_workers)
+    assert events.shape == arr.shape
+    assert events.nnz == 3
+    np.testing.assert_array_equal(events.toarray(), arr)
+    np.testing.assert_array_equal(events[0].indices, [2, 15])
+
+    assert sparse_events_array(np.zeros((2, 0))).shape == (2, 0)
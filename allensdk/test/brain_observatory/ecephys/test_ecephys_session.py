@@ -399,6 +399,70 @@ def test_presentationwise_spike_counts(spike_times_api):
     assert np.allclose([4, 2, 3], obtained.shape)
 
 
+def test_presentationwise_spike_counts_mask_invalid(spike_times_api):
+    spike_times_api.get_invalid_times = lambda: pd.DataFrame({
+        "start_time": [1.015, 5.5],
+        "stop_time": [1.025, 6.0],
+        "tags": [["EcephysProbe", "123448407", "probeA"],
+                 ["EcephysProbe", "123448407", "probeB"]]
+    })
+    session = EcephysSession(api=spike_times_api)
+
+    obtained = \
+        session.presentationwise_spike_counts(
+            np.linspace(-.1, .1, 3),
+            session.stimulus_presentations.index.values,
+            session.units.index.values,
+            mask_invalid_intervals=True)
+    first = obtained.loc[{'unit_id': 2, 'stimulus_presentation_id': 2}]
+    assert np.allclose([0, 2], first)
+
+    obtained = session.presentationwise_spike_times(
+        session.stimulus_presentations.index.values,
+        session.units.index.values,
+        mask_invalid_intervals=True)
+    assert np.allclose([1.01, 1.03], obtained.index.values)
+
+    # unmasked counts are unchanged
+    obtained = \
+        session.presentationwise_spike_counts(
+            np.linspace(-.1, .1, 3),
+            session.stimulus_presentations.index.values,
+            session.units.index.values)
+    first = obtained.loc[{'unit_id': 2, 'stimulus_presentation_id': 2}]
+    assert np.allclose([0, 3], first)
+
+
+def test_get_running_speed_mask_invalid(valid_stimulus_table_api):
+    valid_stimulus_table_api.get_running_speed = lambda: pd.DataFrame({
+        "start_time": [0.0, 0.5, 1.0, 1.5],
+        "end_time": [0.5, 1.0, 1.5, 2.0],
+        "velocity": [1.0, 2.0, 3.0, 4.0]
+    })
+    session = EcephysSession(api=valid_stimulus_table_api)
+
+    obtained = session.get_running_speed()
+    assert np.allclose([np.nan, np.nan, 3.0, 4.0],
+                       obtained["velocity"].values, equal_nan=True)
+
+    obtained = session.get_running_speed(mask_invalid_intervals=False)
+    assert np.allclose([1.0, 2.0, 3.0, 4.0], obtained["velocity"].values)
+
+
+def test_get_running_speed_mask_invalid_without_end_times(
+        valid_stimulus_table_api):
+    # NWB 1 sessions report only the start time of each sample
+    valid_stimulus_table_api.get_running_speed = lambda: pd.DataFrame({
+        "start_time": [0.0, 0.5, 1.0, 1.5],
+        "velocity": [1.0, 2.0, 3.0, 4.0]
+    })
+    session = EcephysSession(api=valid_stimulus_table_api)
+
+    obtained = session.get_running_speed()
+    assert np.allclose([1.0, np.nan, 3.0, 4.0],
+                       obtained["velocity"].values, equal_nan=True)
+
+
 @pytest.mark.parametrize("spike_times,time_domain,expected", [
     [
         {1: [1.5, 2.5]},
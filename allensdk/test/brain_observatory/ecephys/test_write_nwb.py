@@ -8,6 +8,8 @@ from unittest.mock import create_autospec, patch
 import allensdk.brain_observatory.ecephys.nwb_util
 import allensdk.brain_observatory.ecephys.utils
 import allensdk.brain_observatory.ecephys.write_nwb.__main__ as write_nwb
+import h5py
+import marshmallow as mm
 import numpy as np
 import pandas as pd
 import pynwb
@@ -60,6 +62,8 @@ from allensdk.brain_observatory.behavior.data_objects.stimuli.presentations impo
 from allensdk.brain_observatory.ecephys._behavior_ecephys_metadata import (
     BehaviorEcephysMetadata,
 )
+from allensdk.brain_observatory.ecephys._lfp import LFPWriteOptions
+from allensdk.brain_observatory.ecephys.write_nwb.schemas import VCNInputSchema
 from allensdk.brain_observatory.ecephys._unit import (
     Unit,
     _get_filtered_and_sorted_spikes,
@@ -1101,6 +1105,153 @@ def test_write_probe_lfp_file_roundtrip(
     xr.testing.assert_equal(obtained_csd, expected_csd)
 
 
+@pytest.mark.parametrize(
+    "write_options, expected_chunks",
+    [
+        (LFPWriteOptions(), (12, 2)),
+        (LFPWriteOptions(chunk_shape=(5, 1), buffer_gb=1e-7), (5, 1)),
+        (LFPWriteOptions(compression="lzf"), (12, 2)),
+        (LFPWriteOptions(chunk_shape=(4, 2), compression=None), (4, 2)),
+    ],
+)
+def test_write_probe_lfp_file_chunked(
+    tmpdir_factory, lfp_data, probe_data, csd_data, write_options,
+    expected_chunks
+):
+    tmpdir = Path(tmpdir_factory.mktemp("probe_lfp_nwb"))
+    input_data_path = tmpdir / Path("lfp_data.dat")
+    input_timestamps_path = tmpdir / Path("lfp_timestamps.npy")
+    input_channels_path = tmpdir / Path("lfp_channels.npy")
+    input_csd_path = tmpdir / Path("csd.h5")
+    output_path = str(tmpdir / Path("lfp.nwb"))
+
+    probe_data.update(
+        {
+            "lfp": {
+                "input_data_path": input_data_path,
+                "input_timestamps_path": input_timestamps_path,
+                "input_channels_path": input_channels_path,
+                "output_path": output_path,
+            },
+            "csd_path": input_csd_path,
+            "amplitude_scale_factor": 0.5,
+        }
+    )
+
+    write_csd_to_h5(path=input_csd_path, **csd_data)
+
+    np.save(input_timestamps_path, lfp_data["timestamps"], allow_pickle=False)
+    np.save(
+        input_channels_path, lfp_data["subsample_channels"], allow_pickle=False
+    )
+    with open(input_data_path, "wb") as input_data_file:
+        input_data_file.write(lfp_data["data"].tobytes())
+
+    with patch.object(Units, "from_json", wraps=lambda probe: None):
+        with patch.object(
+            BehaviorEcephysMetadata,
+            "from_json",
+            wraps=lambda dict_repr: create_autospec(
+                BehaviorEcephysMetadata, instance=True
+            ),
+        ):
+            output = write_nwb.write_probe_lfp_file(
+                4242, None, datetime.now(), logging.INFO, probe_data,
+                write_options=write_options
+            )
+
+    assert output["id"] == 12345
+    assert output["nwb_path"] == output_path
+    assert output["bytes_written"] == os.path.getsize(output_path)
+    assert output["write_time_seconds"] > 0
+
+    with h5py.File(output_path, "r") as f:
+        lfp = f["acquisition/probe_12345_lfp/probe_12345_lfp_data/data"]
+        assert lfp.dtype == np.float32
+        assert lfp.chunks == expected_chunks
+        assert lfp.compression == write_options.compression
+        np.testing.assert_array_equal(
+            lfp[:], lfp_data["data"].astype(np.float32) * 0.5
+        )
+
+        csd = f[
+            "processing/current_source_density/ecephys_csd/"
+            "current_source_density/data"
+        ]
+        assert csd.compression == write_options.compression
+        np.testing.assert_array_equal(csd[:].T, csd_data["csd"])
+
+
+def test_lfp_write_options_compression_opts():
+    assert LFPWriteOptions().wrap_data(np.zeros(3)).io_settings[
+        "compression_opts"] == 4
+    assert LFPWriteOptions(compression_opts=9).wrap_data(
+        np.zeros(3)).io_settings["compression_opts"] == 9
+
+    with pytest.raises(ValueError):
+        LFPWriteOptions(compression="lzf", compression_opts=4)
+
+
+@pytest.mark.parametrize("compression, compression_opts, valid", [
+    ["gzip", None, True],
+    ["gzip", 7, True],
+    ["lzf", None, True],
+    ["lzf", 4, False],
+    [None, 4, False],
+])
+def test_schema_validates_lfp_compression(compression, compression_opts,
+                                          valid):
+    schema = VCNInputSchema()
+    data = {"lfp_compression": compression,
+            "lfp_compression_opts": compression_opts}
+
+    if valid:
+        schema.validate_lfp_compression(data)
+    else:
+        with pytest.raises(mm.ValidationError):
+            schema.validate_lfp_compression(data)
+
+
+@pytest.mark.parametrize(
+    "n_probes, max_pool_size, available_memory, expected",
+    [
+        (6, 3, None, 3),  # memory unknown
+        (2, 3, None, 2),  # no more workers than probes
+        (6, 3, 10 ** 12, 3),  # plenty of memory
+        (6, 3, 2 * 6000 / 0.8, 2),  # memory for two writers
+        (6, 3, 1, 1),  # always at least one worker
+    ],
+)
+def test_get_lfp_pool_size(
+    tmpdir_factory, n_probes, max_pool_size, available_memory, expected
+):
+    tmpdir = Path(tmpdir_factory.mktemp("lfp_pool_size"))
+    input_data_path = tmpdir / "lfp_data.dat"
+    with open(input_data_path, "wb") as input_data_file:
+        input_data_file.write(np.zeros(1000, dtype=np.int16).tobytes())
+
+    probes = [
+        {
+            "id": ii,
+            "lfp": {
+                "input_data_path": input_data_path,
+                "input_timestamps_path": tmpdir / "missing.npy",
+            },
+        }
+        for ii in range(n_probes)
+    ]
+
+    with patch.object(
+        write_nwb, "get_available_memory", return_value=None
+    ):
+        obtained = write_nwb.get_lfp_pool_size(
+            probes,
+            max_pool_size=max_pool_size,
+            available_memory=available_memory,
+        )
+    assert obtained == expected
+
+
 @pytest.fixture
 def invalid_epochs():
     epochs = [
@@ -38,6 +38,7 @@ import os
 
 import pytest
 
+import scipy.ndimage as filt
 import scipy.stats as stats
 import numpy as np
 
@@ -306,3 +307,63 @@ def test_locate_median():
 
     obt = chi.locate_median(*where)
     assert (np.allclose(obt, [4, 4]))
+
+
+def test_smooth_stas():
+    np.random.seed(3)
+    images = np.random.rand(3, 2, 16, 28)
+
+    obtained = chi.smooth_STAs(images)
+
+    for index in np.ndindex(3, 2):
+        interpolated = filt.gaussian_filter(
+            chi.interpolate_RF(images[index], 4), 0.75)
+        expected = chi.deinterpolate_RF(interpolated, 28, 16, 4)
+        assert np.allclose(obtained[index], expected, rtol=1e-12, atol=0)
+
+
+def test_chi_square_within_masks(exclusion_mask, events_per_pixel,
+                                 trials_per_pixel):
+    masks = [exclusion_mask, 1 - exclusion_mask, np.ones_like(exclusion_mask)]
+    masks[2][1, 1, :] = 0
+
+    obt_p, obt_chi_sum = chi.chi_square_within_masks(
+        np.array([mask.ravel() for mask in masks]),
+        events_per_pixel.reshape(2, -1), trials_per_pixel.ravel(),
+        cell_chunk_size=1)
+
+    for mi, mask in enumerate(masks):
+        exp_p, exp_chi = chi.chi_square_within_mask(mask, events_per_pixel,
+                                                    trials_per_pixel)
+        assert np.allclose(obt_p[:, mi], exp_p)
+        assert np.allclose(obt_chi_sum[:, mi],
+                           np.nansum(exp_chi, axis=(1, 2, 3)))
+
+
+@pytest.mark.skipif(os.getenv('NO_TEST_RANDOM') == 'true',
+                    reason="random seed may not produce the same results on "
+                           "all machines")
+def test_chi_square_binary_cell_chunks(locally_sparse_noise):
+    lsn = locally_sparse_noise(500, 8, 14)
+    events = np.random.rand(500, 5) < 0.2
+
+    exclusion_masks = chi.get_disc_masks(lsn)
+    trial_matrix = chi.build_trial_matrix(lsn, 500)
+    events_per_pixel = chi.get_events_per_pixel(events, trial_matrix)
+    for n in range(5):
+        for on_off in range(2):
+            events_per_pixel[n, :, :, on_off] = chi.smooth_STA(
+                events_per_pixel[n, :, :, on_off])
+
+    expected = np.zeros((5, 8, 14))
+    for y in range(8):
+        for x in range(14):
+            mask = np.repeat(exclusion_masks[y, x, :, :, np.newaxis], 2,
+                             axis=2)
+            expected[:, y, x], _ = chi.chi_square_within_mask(
+                mask, events_per_pixel, trial_matrix.sum(axis=3))
+
+    for cell_chunk_size in [1, 2, 64]:
+        obtained = chi.chi_square_binary(events, lsn,
+                                         cell_chunk_size=cell_chunk_size)
+        assert np.allclose(obtained, expected, rtol=1e-12, atol=0)
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from allensdk.brain_observatory.receptive_field_analysis.receptive_field \
+    import compute_receptive_fields_with_postprocessing
+
+
+class LocallySparseNoiseData(object):
+    """ A small locally sparse noise session, in which each cell responds
+    when a pixel near its own receptive field center is white. Defined at
+    module level so that it can be pickled to worker processes. """
+
+    def __init__(self, num_trials=400, shape=(8, 14), num_cells=3, seed=0):
+        rng = np.random.RandomState(seed)
+
+        template = np.full((num_trials,) + shape, 127, dtype=np.uint8)
+        template[rng.rand(num_trials, *shape) < 0.06] = 255
+        template[rng.rand(num_trials, *shape) < 0.06] = 0
+        self.template = template
+
+        starts = np.arange(num_trials) * 10 + 20
+        self.stimulus_table = pd.DataFrame({'start': starts,
+                                            'end': starts + 7,
+                                            'frame': np.arange(num_trials)})
+
+        dff = rng.normal(0, 0.02, (num_cells, starts[-1] + 40))
+        for cell in range(num_cells):
+            y, x = 2 + 2 * cell, 3 + 4 * cell
+            responsive = template[:, y, x] == 255
+            for start in starts[responsive]:
+                dff[cell, start + 2:start + 9] += 0.5
+        self.dff = dff
+
+    def get_stimulus_table(self, stimulus):
+        return self.stimulus_table
+
+    def get_stimulus_template(self, stimulus):
+        return self.template
+
+    def get_dff_traces(self):
+        return None, self.dff
+
+
+def assert_nested_equal(obtained, expected):
+    if isinstance(expected, dict):
+        assert set(obtained) == set(expected)
+        for key in expected:
+            assert_nested_equal(obtained[key], expected[key])
+    elif isinstance(expected, list):
+        assert len(obtained) == len(expected)
+        for obtained_item, expected_item in zip(obtained, expected):
+            assert_nested_equal(obtained_item, expected_item)
+    else:
+        np.testing.assert_array_equal(obtained, expected)
+
+
+def test_compute_receptive_fields_num_workers():
+    data = LocallySparseNoiseData()
+    cell_indices = [2, 0, 1]
+
+    serial = compute_receptive_fields_with_postprocessing(
+        data, cell_indices, 'locally_sparse_noise', alpha=0.05,
+        number_of_shuffles=200)
+    parallel = compute_receptive_fields_with_postprocessing(
+        data, cell_indices, 'locally_sparse_noise', num_workers=2,
+        alpha=0.05, number_of_shuffles=200)
+
+    assert [rf['attrs']['cell_index'] for rf in parallel] == cell_indices
+    assert any(rf['on']['fdr_mask']['attrs']['number_of_components'] > 0
+               for rf in serial)
+    assert_nested_equal(parallel, serial)
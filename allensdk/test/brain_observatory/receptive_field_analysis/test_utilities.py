@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from allensdk.brain_observatory.receptive_field_analysis import utilities
+from allensdk.brain_observatory.receptive_field_analysis.receptive_field \
+    import events_to_pvalues_no_fdr_correction
+
+
+@pytest.fixture
+def event_vector():
+    event_vector = np.zeros(200, dtype=bool)
+    event_vector[::10] = True
+    return event_vector
+
+
+@pytest.mark.parametrize("batch_size", [7, 500])
+def test_get_shuffle_matrix_selection(event_vector, batch_size):
+    # with an identity stimulus each shuffle is its selection of trials
+    A = np.eye(len(event_vector))
+
+    shuffle_data = utilities.get_shuffle_matrix(
+        None, event_vector, A, number_of_shuffles=30,
+        response_detection_error_std_dev=0, batch_size=batch_size,
+        rng=np.random.RandomState(0))
+
+    assert shuffle_data.shape == (200, 30)
+    assert np.all(np.count_nonzero(shuffle_data, axis=0) == 20)
+    assert np.allclose(shuffle_data[shuffle_data > 0], 1.0 / 20)
+    assert np.unique(shuffle_data > 0, axis=1).shape[1] == 30
+
+
+def test_get_shuffle_matrix_sizes(event_vector):
+    A = np.ones((4, len(event_vector)))
+
+    shuffle_data = utilities.get_shuffle_matrix(
+        None, event_vector, A, number_of_shuffles=100,
+        response_detection_error_std_dev=0.2, batch_size=30,
+        rng=np.random.RandomState(0))
+
+    # each shuffle is an average of ones
+    assert np.allclose(shuffle_data, 1.0)
+
+
+def test_events_to_pvalues_no_fdr_correction(event_vector):
+    rng = np.random.RandomState(1)
+    A = rng.rand(6, len(event_vector))
+    A[0, event_vector] += 1.0
+
+    pvalues = events_to_pvalues_no_fdr_correction(
+        None, event_vector, A, number_of_shuffles=200, seed=3)
+
+    shuffle_data = utilities.get_shuffle_matrix(
+        None, event_vector, A, number_of_shuffles=200,
+        rng=np.random.RandomState(3))
+    rts = A.dot(event_vector) / event_vector.sum()
+    expected = [1 - (shuffle_data[pi, :] < rts[pi]).sum() / 200.
+                for pi in range(6)]
+
+    assert np.allclose(pvalues, expected)
+    assert pvalues[0] == 0
+    assert np.all(pvalues[1:] > 0)
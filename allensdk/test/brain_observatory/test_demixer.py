@@ -123,3 +123,77 @@ def test_demix_invalid_max_block_size(raw_traces, stack, masks, max_block_size):
     with pytest.raises(ValueError, match="Invalid maximum block size*"):
         dmx.demix_time_dep_masks(raw_traces, stack, masks, max_block_size)
 
+
+def demix_by_frame(raw_traces, stack, masks):
+    N, T = raw_traces.shape
+    flat_masks = sparse.csr_matrix(masks.reshape(N, -1))
+    pixels_per_mask = np.sum(masks, axis=(1, 2))
+    demix_traces = np.zeros((N, T))
+    drop_frames = []
+    for t in range(T):
+        demixed_point = dmx._demix_point(
+            stack[t].ravel(), raw_traces[:, t], flat_masks, pixels_per_mask)
+        drop_frames.append(demixed_point is None)
+        if demixed_point is not None:
+            demix_traces[:, t] = demixed_point
+    return demix_traces, drop_frames
+
+
+@pytest.fixture
+def overlapping_masks_movie():
+    rng = np.random.RandomState(0)
+    T, H, W = 23, 20, 20
+    masks = np.zeros((7, H, W), dtype=bool)
+    masks[0, 2:6, 2:6] = True
+    masks[1, 4:8, 4:8] = True  # overlaps 0 and 2
+    masks[2, 7:10, 5:9] = True
+    masks[3, 12:15, 2:5] = True  # isolated
+    masks[4, 12:16, 10:14] = True
+    masks[5, 14:18, 12:18] = True  # overlaps 4
+    masks[6, 1:4, 15:19] = True  # isolated
+
+    stack = rng.uniform(1, 10, size=(T, H, W))
+    raw_traces = np.array([[stack[t][m].mean() for t in range(T)]
+                           for m in masks])
+    stack[5][masks[4] | masks[5]] = 0  # a singular overlap system
+    raw_traces *= rng.uniform(0.8, 1.2, size=raw_traces.shape)
+    raw_traces[2, 3] = 0  # dropped frames
+    raw_traces[6, 11] = 0
+    return raw_traces, stack, masks
+
+
+@pytest.mark.parametrize("max_block_size,num_workers", [
+    (-1, 1), (4, 1), (5, 2),
+])
+def test_demix_time_dep_masks_matches_frame_by_frame(
+        overlapping_masks_movie, max_block_size, num_workers):
+    raw_traces, stack, masks = overlapping_masks_movie
+    expected_traces, expected_drop_frames = demix_by_frame(
+        raw_traces, stack, masks)
+
+    demix_traces, drop_frames = dmx.demix_time_dep_masks(
+        raw_traces, stack, masks, max_block_size=max_block_size,
+        num_workers=num_workers)
+
+    assert drop_frames == expected_drop_frames
+    assert drop_frames[3] and drop_frames[11] and sum(drop_frames) == 2
+    np.testing.assert_allclose(demix_traces, expected_traces,
+                               rtol=1e-10, atol=1e-12)
+
+
+def test_overlap_components():
+    masks = np.zeros((4, 3, 3))
+    masks[0, 0, :2] = 1
+    masks[1, 0, 1:] = 1
+    masks[2, 2, 2] = 1
+    masks[3, 1:, 0] = 1
+    flat_masks = sparse.csr_matrix(masks.reshape(4, -1))
+    mask_pixels = np.flatnonzero(flat_masks.getnnz(axis=0))
+
+    components = dmx._overlap_components(flat_masks, mask_pixels)
+
+    assert [c.mask_indices.tolist() for c in components] == [[0, 1], [2], [3]]
+    np.testing.assert_equal(components[0].masks, [[1, 1, 0], [0, 1, 1]])
+    np.testing.assert_equal(components[0].pair_products.toarray(),
+                            [[1, 1, 0], [0, 1, 0], [0, 1, 0], [0, 1, 1]])
+    np.testing.assert_equal(mask_pixels[components[2].pixel_indices], [3, 6])
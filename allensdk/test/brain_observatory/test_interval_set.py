@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from allensdk.brain_observatory.interval_set import IntervalSet
+
+
+@pytest.mark.parametrize("start_times,stop_times,expected_starts,"
+                         "expected_stops", [
+                             [[], [], [], []],
+                             [[3, 1], [4, 2], [1, 3], [2, 4]],
+                             [[1, 1.5, 5], [2, 3, 6], [1, 5], [3, 6]],
+                             [[1, 1.5, 2], [10, 3, 4], [1], [10]],
+                             [[1, 2], [2, 3], [1], [3]],
+                         ])
+def test_interval_set_merge(start_times, stop_times, expected_starts,
+                            expected_stops):
+    interval_set = IntervalSet(start_times, stop_times)
+
+    assert np.allclose(expected_starts, interval_set.start_times)
+    assert np.allclose(expected_stops, interval_set.stop_times)
+    assert len(interval_set) == len(expected_starts)
+
+
+def test_interval_set_mismatched_lengths():
+    with pytest.raises(ValueError):
+        IntervalSet([1, 2], [3])
+
+
+def test_interval_set_from_dataframe():
+    intervals = pd.DataFrame({
+        "start_time": [1.6, 0.3],
+        "stop_time": [2.3, 0.6],
+        "tags": [["a"], ["b"]]
+    })
+    interval_set = IntervalSet.from_dataframe(intervals)
+
+    assert np.allclose([0.3, 1.6], interval_set.start_times)
+    assert np.allclose([0.6, 2.3], interval_set.stop_times)
+    assert len(IntervalSet.from_dataframe(pd.DataFrame())) == 0
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_interval_set_contains(seed):
+    rng = np.random.default_rng(seed)
+    start_times = rng.uniform(0, 100, 20)
+    stop_times = start_times + rng.uniform(0, 10, 20)
+    times = np.concatenate([rng.uniform(-5, 115, 1000),
+                            start_times, stop_times])
+
+    expected = np.zeros(times.shape, dtype=bool)
+    for start, stop in zip(start_times, stop_times):
+        expected |= (times >= start) & (times <= stop)
+
+    obtained = IntervalSet(start_times, stop_times).contains(times)
+    np.testing.assert_array_equal(expected, obtained)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_interval_set_intersect(seed):
+    rng = np.random.default_rng(seed)
+    start_times = rng.uniform(0, 100, 20)
+    stop_times = start_times + rng.uniform(0, 10, 20)
+    window_starts = np.concatenate([rng.uniform(-5, 115, 1000), stop_times])
+    window_stops = window_starts + rng.uniform(0, 2, window_starts.size)
+
+    expected = np.zeros(window_starts.shape, dtype=bool)
+    for start, stop in zip(start_times, stop_times):
+        expected |= (
+            np.maximum(window_starts, start) <= np.minimum(window_stops, stop)
+        )
+
+    obtained = IntervalSet(start_times, stop_times).intersect(window_starts,
+                                                              window_stops)
+    np.testing.assert_array_equal(expected, obtained)
+
+
+def test_empty_interval_set():
+    interval_set = IntervalSet([], [])
+
+    assert not interval_set.contains([0, 1, 2]).any()
+    assert not interval_set.intersect([0, 1], [1, 2]).any()
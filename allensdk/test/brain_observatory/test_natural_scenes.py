@@ -33,7 +33,11 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
-from allensdk.brain_observatory.natural_scenes import NaturalScenes
+import numpy as np
+import pandas as pd
+import scipy.stats as st
+from allensdk.brain_observatory.natural_scenes import NaturalScenes, \
+    image_selectivity
 from allensdk.brain_observatory.stimulus_analysis import StimulusAnalysis
 import pytest
 from mock import patch, MagicMock
@@ -161,3 +165,127 @@ def test_harness(dataset, trigger):
 
     assert ns._dxcm is NaturalScenes._PRELOAD
     assert ns._dxtime is NaturalScenes._PRELOAD
+
+
+def test_image_selectivity():
+    np.random.seed(7)
+    responses = np.random.randn(118, 5)
+    responses[:, 1] = 2.0
+    responses[3, 2] = np.nan
+    responses[:, 3] = np.round(responses[:, 3], 1)
+
+    expected = []
+    for nc in range(responses.shape[1]):
+        fmin = responses[:, nc].min()
+        fmax = responses[:, nc].max()
+        rtj = [np.mean(responses[:, nc] > fmin + j * ((fmax - fmin) / 1000.))
+               for j in range(1000)]
+        expected.append(1 - 2 * np.mean(rtj))
+
+    np.testing.assert_allclose(image_selectivity(responses), expected)
+
+
+def get_peak_per_cell(ns):
+    ''' Peak metrics computed one cell at a time, as NaturalScenes.get_peak
+    did before it was vectorized '''
+    peak = pd.DataFrame(index=range(ns.numbercells), columns=(
+        'scene_ns', 'reliability_ns', 'peak_dff_ns',
+        'ptest_ns', 'p_run_ns', 'run_modulation_ns',
+        'time_to_peak_ns', 'image_selectivity_ns'), dtype=float)
+
+    frame = ns.stim_table.frame
+    for nc in range(ns.numbercells):
+        col = str(nc)
+        nsp = np.argmax(ns.response[1:, nc, 0])
+        peak.loc[nc, 'scene_ns'] = nsp
+        peak.loc[nc, 'peak_dff_ns'] = ns.response[nsp + 1, nc, 0]
+
+        groups = [ns.mean_sweep_response[frame == (im - 1)][col].values
+                  for im in range(ns.number_scenes)]
+        peak.loc[nc, 'ptest_ns'] = st.f_oneway(*groups)[1]
+
+        test = ns.sweep_response[frame == nsp][col].mean()
+        peak.loc[nc, 'time_to_peak_ns'] = \
+            (np.argmax(test) - ns.interlength) / ns.acquisition_rate
+
+        subset = ns.mean_sweep_response[frame == nsp]
+        subset_run = subset[subset.dx >= 1][col]
+        subset_stat = subset[subset.dx < 1][col]
+        if (len(subset_run) > 4) & (len(subset_stat) > 4):
+            peak.loc[nc, 'p_run_ns'] = st.ttest_ind(
+                subset_run, subset_stat, equal_var=False)[1]
+            if subset_run.mean() > subset_stat.mean():
+                peak.loc[nc, 'run_modulation_ns'] = \
+                    (subset_run.mean() - subset_stat.mean()) / \
+                    np.abs(subset_run.mean())
+            elif subset_run.mean() < subset_stat.mean():
+                peak.loc[nc, 'run_modulation_ns'] = \
+                    -1 * ((subset_stat.mean() - subset_run.mean()) /
+                          np.abs(subset_stat.mean()))
+
+        traces = ns.sweep_response[frame == nsp][col]
+        corr_matrix = np.full((len(traces), len(traces)), np.nan)
+        for i in range(len(traces)):
+            for j in range(i + 1, len(traces)):
+                corr_matrix[i, j] = st.pearsonr(traces.iloc[i][28:42],
+                                                traces.iloc[j][28:42])[0]
+        peak.loc[nc, 'reliability_ns'] = np.nanmean(corr_matrix)
+
+        fmin = ns.response[1:, nc, 0].min()
+        fmax = ns.response[1:, nc, 0].max()
+        step = (fmax - fmin) / 1000.
+        rtj = [np.mean(ns.response[1:, nc, 0] > fmin + j * step)
+               for j in range(1000)]
+        peak.loc[nc, 'image_selectivity_ns'] = 1 - 2 * np.mean(rtj)
+
+    return peak
+
+
+def test_get_peak_matches_per_cell(dataset):
+    rng = np.random.RandomState(3)
+    number_scenes, trials_per_scene, numbercells = 119, 12, 3
+    window = 50
+
+    frames = np.repeat(np.arange(number_scenes) - 1, trials_per_scene)
+    rng.shuffle(frames)
+    columns = [str(nc) for nc in range(numbercells)]
+
+    mean_sweep_response = pd.DataFrame(
+        rng.randn(len(frames), numbercells), columns=columns)
+    mean_sweep_response['dx'] = rng.uniform(0, 2, len(frames))
+    sweep_response = pd.DataFrame({
+        col: [rng.randn(window) for _ in frames] for col in columns})
+
+    # each cell prefers one scene, some of whose trials have no response
+    peak_scenes = [5, 40, 77]
+    response = np.zeros((number_scenes, numbercells, 3))
+    response[:, :, 0] = rng.rand(number_scenes, numbercells)
+    for nc, scene in enumerate(peak_scenes):
+        response[scene + 1, nc, 0] = 2.0
+        trials = np.flatnonzero(frames == scene)
+        mean_sweep_response.loc[trials, columns[nc]] += 1.0
+        mean_sweep_response.loc[trials[:6], 'dx'] = [0.5, 1.5] * 3
+    for nc in [1, 2]:
+        trials = np.flatnonzero(frames == peak_scenes[nc])
+        running = trials[mean_sweep_response.dx.values[trials] >= 1]
+        mean_sweep_response.loc[running[0], columns[nc]] = np.nan
+
+    ns = NaturalScenes(dataset)
+    ns._numbercells = numbercells
+    ns._acquisition_rate = 30.
+    ns._stim_table = pd.DataFrame({'frame': frames})
+    ns._number_scenes = number_scenes
+    ns._interlength = 8
+    ns._mean_sweep_response = mean_sweep_response
+    ns._sweep_response = sweep_response
+    ns._response = response
+    dataset.get_cell_specimen_ids.return_value = np.arange(numbercells)
+
+    expected = get_peak_per_cell(ns)
+    obtained = ns.get_peak()
+
+    assert np.all(np.isfinite(expected['run_modulation_ns']))
+    for column in expected.columns:
+        np.testing.assert_allclose(obtained[column].values.astype(float),
+                                   expected[column].values, rtol=1e-10,
+                                   err_msg=column)
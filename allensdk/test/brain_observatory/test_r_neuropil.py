@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from scipy.linalg import solve_banded
+
+import allensdk.brain_observatory.r_neuropil as r_neuropil
+
+
+@pytest.fixture
+def traces():
+    np.random.seed(7)
+    af1 = r_neuropil.alpha_filter()
+    af2 = r_neuropil.alpha_filter(alpha=0.1, beta=0.5)
+
+    F_M, F_N, r = [], [], []
+    for i in range(5):
+        F_M_i, F_N_i, _, r_i = r_neuropil.synthesize_F(2003, af1, af2)
+        F_M.append(F_M_i + 10.0)
+        F_N.append(F_N_i + 5.0)
+        r.append(r_i)
+
+    return np.array(F_M), np.array(F_N), np.array(r)
+
+
+def estimate_error_by_solve(ns, r):
+    errors = np.zeros(ns.folds)
+    for fi in range(ns.folds):
+        F_M = ns.F_M[fi]
+        F_N = ns.F_N[fi]
+        F_C = solve_banded((1, 1), ns.ab, F_M - r * F_N)
+        errors[fi] = abs(r_neuropil.error_calc(F_M, F_N, F_C, r))
+
+    return np.mean(errors)
+
+
+def test_estimate_error_closed_form(traces):
+    F_M, F_N, _ = traces
+
+    ns = r_neuropil.NeuropilSubtract()
+    ns.set_F(F_M[0], F_N[0])
+
+    rs = np.linspace(-1, 3, 17)
+    expected = [estimate_error_by_solve(ns, r) for r in rs]
+
+    np.testing.assert_allclose(ns.estimate_error(rs), expected, rtol=1e-9)
+    assert np.isclose(ns.estimate_error(rs[3]), expected[3], rtol=1e-9)
+
+
+@pytest.mark.parametrize("num_workers,block_size", [(1, 100), (2, 2)])
+def test_estimate_all_contamination_ratios(traces, num_workers, block_size):
+    F_M, F_N, r_truth = traces
+
+    results = r_neuropil.estimate_all_contamination_ratios(
+        F_M, F_N, num_workers=num_workers, block_size=block_size)
+
+    assert len(results) == len(F_M)
+    for i, result in enumerate(results):
+        expected = r_neuropil.estimate_contamination_ratios(F_M[i], F_N[i])
+
+        assert result["r"] == pytest.approx(expected["r"], abs=1e-12)
+        assert result["err"] == pytest.approx(expected["err"])
+        np.testing.assert_allclose(result["r_vals"], expected["r_vals"])
+        assert result["r"] == pytest.approx(r_truth[i], abs=0.05)
@@ -33,6 +33,7 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
+import h5py
 import numpy as np
 import pandas as pd
 import pytest
@@ -213,3 +214,87 @@ def test_validate_masks(roi_mask_list, neuropil_masks):
     })
     pd.testing.assert_frame_equal(expected_exclusions, pd.DataFrame(obtained), check_like=True)
 
+
+def calculate_traces_by_mask(stack, mask_list):
+    traces = np.full((len(mask_list), stack.shape[0]), np.nan)
+    for i, mask in enumerate(mask_list):
+        if roi_masks.validate_mask(mask):
+            continue
+        subframe = stack[:, mask.y:mask.y + mask.height,
+                         mask.x:mask.x + mask.width]
+        traces[i] = subframe[:, mask.mask].sum(axis=1) / mask.mask.sum()
+    return traces
+
+
+@pytest.mark.parametrize("dtype", [np.uint16, np.float32])
+def test_calculate_traces_matches_per_mask(tmpdir, roi_mask_list,
+                                           neuropil_masks, image_dims, dtype):
+    rng = np.random.RandomState(0)
+    video = rng.uniform(0, 1000, size=(53, image_dims['height'],
+                                       image_dims['width'])).astype(dtype)
+    mask_list = roi_mask_list + neuropil_masks
+
+    movie_path = str(tmpdir.join("movie.h5"))
+    with h5py.File(movie_path, "w") as movie_f:
+        movie_f.create_dataset("data", data=video, chunks=(10, 50, 50))
+
+    with h5py.File(movie_path, "r") as movie_f:
+        traces, _ = roi_masks.calculate_traces(movie_f["data"], mask_list,
+                                               block_size=10)
+
+    np.testing.assert_allclose(
+        traces, calculate_traces_by_mask(video, mask_list), rtol=1e-5)
+
+
+def test_create_mask_pixel_matrix(roi_mask_list, image_dims):
+    mask_pixels = roi_masks.create_mask_pixel_matrix(
+        roi_mask_list, (image_dims['height'], image_dims['width']),
+        valid_masks=np.arange(10) != 3)
+
+    assert mask_pixels.shape == (10, image_dims['height'] * image_dims['width'])
+    for i, mask in enumerate(roi_mask_list):
+        expected = mask.get_mask_plane().ravel() if i != 3 else 0
+        np.testing.assert_equal(mask_pixels[i].toarray().ravel(), expected)
+
+
+class SyntheticMovie(object):
+    ''' Frames of a large movie, generated on read from a few random frames '''
+    def __init__(self, num_frames, height, width, num_unique=16):
+        rng = np.random.RandomState(0)
+        self.frames = rng.uniform(0, 1000, size=(num_unique, height, width)).astype(np.float32)
+        self.shape = (num_frames, height, width)
+
+    def __getitem__(self, frames):
+        indices = np.arange(*frames.indices(self.shape[0]))
+        return self.frames[indices % len(self.frames)]
+
+
+@pytest.mark.nightly
+def test_calculate_traces_benchmark():
+    ''' 500 roi and 500 neuropil masks over a 512 x 512 x 100k frame movie '''
+    import time
+
+    rng = np.random.RandomState(1)
+    border = [5, 5, 5, 5]
+    rois = []
+    for i in range(500):
+        y, x = rng.randint(10, 490, size=2)
+        roi = np.zeros((512, 512), dtype=bool)
+        roi[y:y + 12, x:x + 12] = True
+        rois.append(roi_masks.create_roi_mask(512, 512, border, roi_mask=roi, label=str(i)))
+    combined_mask = roi_masks.create_roi_mask_array(rois).max(axis=0)
+    mask_list = rois + [roi_masks.create_neuropil_mask(roi, border, combined_mask)
+                        for roi in rois]
+
+    movie = SyntheticMovie(100000, 512, 512)
+
+    start = time.time()
+    traces, _ = roi_masks.calculate_traces(movie, mask_list)
+    elapsed = time.time() - start
+
+    start = time.time()
+    expected = calculate_traces_by_mask(movie[slice(0, 2000)], mask_list)
+    per_mask_elapsed = (time.time() - start) * 50
+
+    np.testing.assert_allclose(traces[:, :2000], expected, rtol=1e-5)
+    assert elapsed < per_mask_elapsed
@@ -33,7 +33,11 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
-from allensdk.brain_observatory.stimulus_analysis import StimulusAnalysis
+import numpy as np
+import pandas as pd
+import scipy.stats as st
+from allensdk.brain_observatory.stimulus_analysis import StimulusAnalysis, \
+    level_index, sweep_traces, trial_reliability
 import pytest
 from mock import patch, MagicMock
 
@@ -138,3 +142,105 @@ def test_harness(dataset,
         assert sa._binned_dx_vis is not StimulusAnalysis._PRELOAD
         assert sa._binned_cells_vis is not StimulusAnalysis._PRELOAD
         assert sa._peak_run is not StimulusAnalysis._PRELOAD
+
+
+@pytest.fixture
+def sweep_analysis():
+    np.random.seed(4)
+    sa = StimulusAnalysis(None)
+    sa._celltraces = np.random.rand(6, 2000) + 1
+    sa._celltraces[2, 500:700] = 2.0
+    sa._numbercells = 6
+    # the last sweep runs past the end of the running speed
+    sa._dxcm = np.random.rand(1875)
+    starts = np.arange(40, 1900, 75)
+    sa._stim_table = pd.DataFrame({'start': starts, 'end': starts + 30,
+                                   'condition': np.arange(len(starts)) % 4})
+    sa.sweeplength = 30
+    sa.interlength = 20
+    sa.extralength = 5
+    return sa
+
+
+def test_get_sweep_response(sweep_analysis):
+    sa = sweep_analysis
+    sweep_response, mean_sweep_response, pval = sa.get_sweep_response()
+
+    assert list(sweep_response.columns) == \
+        [str(i) for i in range(6)] + ['dx']
+    for si, row in enumerate(sa.stim_table.itertuples()):
+        start = row.start - sa.interlength
+        end = row.start + sa.sweeplength + sa.interlength
+        for ci, column in enumerate(sweep_response.columns):
+            if column == 'dx':
+                expected = sa.dxcm[start:end]
+            else:
+                temp = sa.celltraces[ci, start:end]
+                expected = 100 * ((temp / np.mean(temp[:20])) - 1)
+            np.testing.assert_array_equal(sweep_response[column].iloc[si],
+                                          expected)
+            assert mean_sweep_response[column].iloc[si] == \
+                np.mean(expected[20:55])
+            p = st.f_oneway(expected[:20], expected[20:55])[1]
+            np.testing.assert_array_equal(pval[column].iloc[si], p)
+
+    assert len(sweep_response['dx'].iloc[-1]) == 55
+
+    responses, means, pvals = sa.get_sweep_response_arrays()
+    assert responses.shape == (len(sa.stim_table), 7, 70)
+    np.testing.assert_array_equal(means, mean_sweep_response.values)
+    assert np.isnan(responses[-1, 6, 55:]).all()
+
+
+def test_get_condition_response(sweep_analysis):
+    sa = sweep_analysis
+    n = len(sa.stim_table)
+    sa._mean_sweep_response = pd.DataFrame(np.random.randn(n, 7))
+    sa._mean_sweep_response.iloc[3, 2] = np.nan
+    sa._pval = pd.DataFrame(np.random.rand(n, 7))
+    condition = sa.stim_table.condition.values.copy()
+    condition[5] = -1
+
+    response = sa.get_condition_response(condition, 5, p_threshold=0.3)
+
+    for ci in range(4):
+        subset = condition == ci
+        subset_response = sa.mean_sweep_response[subset]
+        np.testing.assert_allclose(response[ci, :, 0],
+                                   subset_response.mean(axis=0))
+        np.testing.assert_allclose(
+            response[ci, :, 1],
+            subset_response.std(axis=0) / np.sqrt(subset.sum()))
+        np.testing.assert_array_equal(response[ci, :, 2],
+                                      (sa.pval[subset] < 0.3).sum(axis=0))
+
+    assert np.isnan(response[4]).all()
+
+
+def test_level_index():
+    index = level_index([0., 45., 30., 90., np.nan], np.array([0, 45, 90]))
+    np.testing.assert_array_equal(index, [0, 1, -1, 2, -1])
+
+
+def test_sweep_traces():
+    sweep_response = pd.DataFrame({'0': [np.arange(4.), np.arange(2.)],
+                                   '1': [np.ones(4), np.zeros(4)]})
+
+    traces = sweep_traces(sweep_response, ['1', '0'])
+
+    assert traces.shape == (2, 2, 4)
+    np.testing.assert_array_equal(traces[:, 0], [np.ones(4), np.zeros(4)])
+    np.testing.assert_array_equal(traces[1, 1], [0, 1, np.nan, np.nan])
+
+
+def test_trial_reliability():
+    np.random.seed(3)
+    traces = np.random.rand(6, 3, 14)
+    traces[2, 1] = 1.0
+
+    reliability = trial_reliability(traces)
+
+    for nc in range(3):
+        corr = [st.pearsonr(traces[i, nc], traces[j, nc])[0]
+                for i in range(6) for j in range(i + 1, 6)]
+        np.testing.assert_allclose(reliability[nc], np.nanmean(corr))
@@ -1,6 +1,7 @@
 import pytest
 import numpy as np
 import os
+import pandas as pd
 from allensdk.core.brain_observatory_nwb_data_set import BrainObservatoryNwbDataSet, si
 import numpy as np
 from pkg_resources import resource_filename  # @UnresolvedImport
@@ -38,6 +39,46 @@ def test_BinaryIntervalSearchTree_shared_endpoint():
     assert bist.search(1)[2] == 'A'
     assert bist.search(1.5)[2] == 'B'
 
+def test_SortedIntervalIndex():
+
+    index = si.SortedIntervalIndex([0, 1, 3, 2], [.9, 1.9, 3.9, 2.9])
+    np.testing.assert_array_equal(index.search([1.5, 0, 2.5, 3.5, 0.95, 5]),
+                                  [1, 0, 3, 2, -1, -1])
+
+def test_SortedIntervalIndex_shared_endpoint():
+
+    index = si.SortedIntervalIndex([0, 1], [1, 2])
+    np.testing.assert_array_equal(index.search([0, 1, 1.5]), [0, 0, 1])
+
+    with pytest.raises(ValueError):
+        si.SortedIntervalIndex([0, 1], [1.5, 2])
+
+def test_StimulusSearch_search_frames():
+
+    class MockDataSet(object):
+        def get_stimulus_epoch_table(self):
+            return pd.DataFrame({'start': [10, 30, 42], 'end': [30, 40, 60]})
+
+        def get_stimulus_table(self, name):
+            return pd.DataFrame({'start': [12, 15, 25, 31, 45],
+                                 'end': [15, 20, 26, 33, 50]})
+
+    s = si.StimulusSearch(MockDataSet())
+    frames = np.arange(70)
+    rows = s.search_frames(frames)
+
+    expected = np.full(70, -1)
+    expected[12:15] = 0
+    expected[15:25] = 1  # 20 - 24 are unregistered and take the last row
+    expected[25:31] = 2  # continues into the adjacent epoch
+    expected[31:40] = 3
+    expected[45:60] = 4  # 42 - 44 follow a gap between epochs
+    np.testing.assert_array_equal(rows, expected)
+
+    assert s.search(22) == (15, 19.99, s.master_df.iloc[1].to_dict())
+    assert s.search(43) is None
+    assert s.search(40) is None
+
 def test_pixels_to_visual_degrees():
     m = si.BrainObservatoryMonitor()
     np.testing.assert_almost_equal(m.pixels_to_visual_degrees(1), 0.103270443661,10)
@@ -357,6 +398,91 @@ def test_show_image():
     m.show_image(img, show=False, warp=True, mask=False)
     m.show_image(img, show=False, warp=False, mask=True)
 
+def test_spline_interpolation_matrix():
+
+    np.random.seed(5)
+    img = np.random.rand(9, 13)
+    coords = np.vstack([np.random.uniform(-2, 10, 200),
+                        np.random.uniform(-2, 14, 200)])
+    coords[:, :4] = [[0, 8, 8, 3.5], [0, 12, 3, 12]]
+
+    matrix = si.spline_interpolation_matrix(coords, img.shape)
+    coefficients = si.spndi.spline_filter(img, 3, output=np.float64,
+                                          mode="constant")
+
+    np.testing.assert_allclose(
+        matrix.dot(coefficients.ravel()),
+        si.spndi.map_coordinates(img, coords),
+        rtol=0, atol=1e-12)
+
+def test_cast_interpolated():
+
+    values = np.array([0.5, 1.5, -0.5, -1.5, 254.5, 300.2, -3.2])
+    np.testing.assert_array_equal(si.cast_interpolated(values, np.uint8),
+                                  [1, 2, 0, 0, 255, 255, 0])
+    np.testing.assert_array_equal(si.cast_interpolated(values, np.int8),
+                                  [1, 2, -1, -2, 127, 127, -3])
+
+def test_warp_images(tmpdir):
+
+    m = si.BrainObservatoryMonitor()
+    np.random.seed(6)
+    imgs = (np.random.rand(2, *si.MONITOR_DIMENSIONS) * 255).astype(np.uint8)
+
+    warped = m.warp_images(imgs, cache_dir=str(tmpdir))
+    assert warped.dtype == np.uint8
+    for img, warped_img in zip(imgs, warped):
+        np.testing.assert_array_equal(warped_img, m.warp_image(img))
+    np.testing.assert_array_equal(
+        m.warp_images(imgs, chunk_size=2, max_buffer_bytes=1), warped)
+
+    # a monitor with the same geometry memory-maps the cached operator
+    cache_files = tmpdir.listdir()
+    assert len(cache_files) == 1
+    geometry = si.BrainObservatoryMonitor().experiment_geometry
+    assert geometry.warp_operator_key == m.experiment_geometry.warp_operator_key
+    operator = geometry.get_warp_operator(cache_dir=str(tmpdir),
+                                          mmap_mode='r')
+    assert not operator.data.flags.writeable
+    assert (operator != m.experiment_geometry.warp_operator).nnz == 0
+
+def test_get_warp_operator_saves_operator_in_memory(tmpdir):
+
+    geometry = si.BrainObservatoryMonitor().experiment_geometry
+    operator = geometry.get_warp_operator()
+    assert tmpdir.listdir() == []
+
+    # already in memory, but not yet saved to this cache_dir
+    assert geometry.get_warp_operator(cache_dir=str(tmpdir)) is operator
+    assert len(tmpdir.listdir()) == 1
+
+    geometry.clear_warp_operator()
+    loaded = geometry.get_warp_operator(cache_dir=str(tmpdir), mmap_mode='r')
+    assert loaded is not operator
+    assert not loaded.data.flags.writeable
+    assert (loaded != operator).nnz == 0
+
+def test_mask_stimulus_template():
+
+    np.random.seed(7)
+    display_mask = np.random.rand(30, 20) > 0.3
+    x, y = np.meshgrid(np.arange(30), np.arange(20), indexing='ij')
+    template_display_coords = np.array([x // 4 - 1, y // 4])
+    template_shape = (8, 5)
+
+    mask, frac = si.mask_stimulus_template(template_display_coords,
+                                           template_shape, display_mask,
+                                           threshold=0.75)
+
+    for tx in range(template_shape[0]):
+        for ty in range(template_shape[1]):
+            on_template = (template_display_coords[0] == tx) & \
+                (template_display_coords[1] == ty)
+            expected = display_mask[on_template].mean() \
+                if on_template.any() else np.nan
+            np.testing.assert_equal(frac[tx, ty], expected)
+            assert mask[tx, ty] == (expected >= 0.75)
+
 def test_map_stimulus():
 
     m = si.BrainObservatoryMonitor()
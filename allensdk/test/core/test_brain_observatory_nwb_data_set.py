@@ -34,6 +34,8 @@
 # POSSIBILITY OF SUCH DAMAGE.
 #
 import functools
+import mock
+import pandas as pd
 import numpy as np
 from pkg_resources import resource_filename  # @UnresolvedImport
 from allensdk.core.brain_observatory_nwb_data_set import BrainObservatoryNwbDataSet, si
@@ -358,3 +360,141 @@ def test_find_stimulus_presentation_group_duplicate(stim_pres_h5):
 
     with pytest.raises(MissingStimulusException):
         obt = bonds._find_stimulus_presentation_group(stim_pres_h5, stimulus_name)
+
+
+@pytest.fixture
+def traces_nwb(tmpdir_factory):
+    path = str(tmpdir_factory.mktemp("nwb").join("traces.nwb"))
+    processing = 'processing/{}/'.format(
+        BrainObservatoryNwbDataSet.PIPELINE_DATASET)
+
+    with h5py.File(path, 'w') as f:
+        f['general/generated_by'] = np.array([b'pipeline', b'2.0'])
+        f.create_group('analysis')
+        f[processing + 'ImageSegmentation/cell_specimen_ids'] = \
+            np.array([10, 30, 20, 40])
+        f[processing + 'ImageSegmentation/roi_ids'] = \
+            np.array([b'a', b'b', b'c', b'd'])
+        f[processing + 'Fluorescence/imaging_plane_1/timestamps'] = \
+            np.arange(5) / 30.
+        f[processing + 'Fluorescence/imaging_plane_1/data'] = \
+            np.arange(20, dtype=float).reshape(4, 5)
+        f[processing + 'Fluorescence/imaging_plane_1_neuropil_response/r'] = \
+            np.array([0.7, 0.6, 0.5, 0.4])
+
+    return path
+
+
+def test_read_rows():
+    with h5py.File('read_rows', 'w', driver='core', backing_store=False) as f:
+        ds = f.create_dataset('data', data=np.arange(12).reshape(4, 3))
+
+        assert np.array_equal(bonds._read_rows(ds, [2, 0, 2, 3]),
+                              ds[()][[2, 0, 2, 3]])
+        assert np.array_equal(bonds._read_rows(ds, [1, 3]), ds[()][[1, 3]])
+        assert bonds._read_rows(ds, []).shape == (0, 3)
+
+
+def test_get_traces_subset_order(traces_nwb):
+    data_set = BrainObservatoryNwbDataSet(traces_nwb)
+    assert data_set.get_cell_specimen_indices([40, 10, 40]) == [3, 0, 3]
+
+    _, traces = data_set.get_fluorescence_traces([40, 10, 40])
+    expected = np.arange(20, dtype=float).reshape(4, 5)[[3, 0, 3]]
+    assert np.array_equal(traces, expected)
+
+    assert np.allclose(data_set.get_neuropil_r([20, 30]), [0.5, 0.6])
+
+    with pytest.raises(ValueError):
+        data_set.get_cell_specimen_indices([50])
+
+
+def test_open_close(traces_nwb):
+    data_set = BrainObservatoryNwbDataSet(traces_nwb)
+    assert not data_set.is_open
+
+    with data_set.open(read_cache_bytes=2 ** 22) as opened:
+        assert opened is data_set
+        assert data_set.is_open
+
+        ids = data_set.get_cell_specimen_ids()
+        ids[0] = -1  # callers get copies of the cached ids
+        assert np.array_equal(data_set.get_cell_specimen_ids(),
+                              [10, 30, 20, 40])
+        assert np.array_equal(data_set.get_fluorescence_timestamps(),
+                              np.arange(5) / 30.)
+
+        _, traces = data_set.get_fluorescence_traces([20])
+        assert np.array_equal(traces, [[10, 11, 12, 13, 14]])
+
+        data_set.save_analysis_arrays(('test_array', np.ones(3)))
+        assert data_set.is_open
+
+    assert not data_set.is_open
+    assert len(data_set._loaded) == 0
+
+    with h5py.File(traces_nwb, 'r') as f:
+        assert np.array_equal(f['analysis/test_array'][()], np.ones(3))
+
+
+def test_get_stimulus_frames(tmpdir):
+    data_set = BrainObservatoryNwbDataSet(str(tmpdir.join('missing.nwb')))
+    master = pd.DataFrame({
+        'start': [2, 5, 8],
+        'end': [4, 7, 9],
+        'stimulus': [si.NATURAL_SCENES, si.SPONTANEOUS_ACTIVITY,
+                     si.STATIC_GRATINGS],
+        'frame': [1, np.nan, np.nan]})
+    templates = np.arange(12).reshape(3, 2, 2)
+
+    with mock.patch.object(data_set, 'get_stimulus_epoch_table',
+                           return_value=master[['start', 'end']]), \
+            mock.patch.object(data_set, 'get_stimulus_table',
+                              return_value=master), \
+            mock.patch.object(data_set, 'get_stimulus_template',
+                              return_value=templates):
+        frames = [8, 0, 3, 6]
+        obtained = data_set.get_stimulus(frames)
+
+        with mock.patch.object(data_set.stimulus_search, 'search_frames',
+                               wraps=data_set.stimulus_search.search_frames) \
+                as search_frames:
+            assert len(data_set.get_stimulus(np.arange(10))) == 10
+            search_frames.assert_called_once()
+
+        for frame, (result, template) in zip(frames, obtained):
+            expected, expected_template = data_set.get_stimulus(frame)
+            assert result is expected
+            assert np.array_equal(template, expected_template)
+
+    assert obtained[0][0][2]['stimulus'] == si.STATIC_GRATINGS
+    assert obtained[1] == (None, None)
+    assert np.array_equal(obtained[2][1], templates[1])
+    assert obtained[3] == (None, None)
+
+
+def test_get_stimulus_reads_template_once(tmpdir):
+    data_set = BrainObservatoryNwbDataSet(str(tmpdir.join('missing.nwb')))
+    master = pd.DataFrame({
+        'start': [0, 3, 6, 9],
+        'end': [3, 6, 9, 12],
+        'stimulus': [si.NATURAL_MOVIE_ONE, si.NATURAL_SCENES,
+                     si.NATURAL_MOVIE_ONE, si.NATURAL_SCENES],
+        'frame': [0, 1, 2, 0]})
+    templates = {si.NATURAL_MOVIE_ONE: np.arange(12).reshape(3, 2, 2),
+                 si.NATURAL_SCENES: -np.arange(8).reshape(2, 2, 2)}
+
+    with mock.patch.object(data_set, 'get_stimulus_epoch_table',
+                           return_value=master[['start', 'end']]), \
+            mock.patch.object(data_set, 'get_stimulus_table',
+                              return_value=master), \
+            mock.patch.object(data_set, 'get_stimulus_template',
+                              side_effect=templates.get) as get_template:
+        obtained = data_set.get_stimulus(np.arange(12))
+
+    assert get_template.call_count == 2
+    for frame, (result, template) in enumerate(obtained):
+        row = master.iloc[frame // 3]
+        assert result[2]['stimulus'] == row['stimulus']
+        assert np.array_equal(template,
+                              templates[row['stimulus']][row['frame']])
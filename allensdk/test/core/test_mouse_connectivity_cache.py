@@ -43,6 +43,7 @@ import pandas as pd
 import SimpleITK as sitk
 
 
+from allensdk.core.label_reduction import LabelMap
 from allensdk.core.mouse_connectivity_cache import MouseConnectivityCache
 from allensdk.core.structure_tree import StructureTree
 
@@ -179,6 +180,43 @@ def test_get_projection_density(mcc):
     assert( os.path.exists(path) )
 
 
+@pytest.fixture(scope='function')
+def mmap_mcc(tmpdir_factory):
+    manifest_file = tmpdir_factory.mktemp("mcc").join('manifest.json')
+    return MouseConnectivityCache(manifest_file=str(manifest_file),
+                                  memory_map_volumes=True,
+                                  max_cached_volumes=1)
+
+
+def test_get_volumes_memory_mapped(mmap_mcc):
+
+    eye = np.eye(100)
+    eid = 123456789
+    path = os.path.join(os.path.dirname(mmap_mcc.manifest_path),
+                        'experiment_{0}'.format(eid), 
+                        'projection_density_25.npy')
+
+    with mock.patch('allensdk.api.queries.grid_data_api.GridDataApi.'
+                    'retrieve_file_over_http', 
+                    new=lambda a, b, c: nrrd.write(c, eye)):
+        obtained, _ = mmap_mcc.get_projection_density(eid)
+        mmap_mcc.get_data_mask(eid)
+
+    # evicted from the in-memory cache, but read from the converted file
+    assert( len(mmap_mcc.volume_cache) == 1 )
+    with mock.patch.object(mmap_mcc.api, "retrieve_file_over_http") \
+            as mock_rtrv, \
+            mock.patch('nrrd.read') as mock_read:
+        second, _ = mmap_mcc.get_projection_density(eid)
+
+    mock_rtrv.assert_not_called()
+    mock_read.assert_not_called()
+    assert( isinstance(obtained, np.memmap) )
+    assert( np.allclose(second, eye) )
+    assert( np.allclose(obtained[10:20, 10], eye[10:20, 10]) )
+    assert( os.path.exists(path) )
+
+
 def test_get_injection_density(mcc):
 
     eye = np.eye(100)
@@ -393,6 +431,49 @@ def test_get_structure_unionizes(mcc, unionizes):
     assert obtained.shape[0] == 6
 
 
+def test_get_structure_unionizes_store(mcc, unionizes):
+
+    calls = []
+
+    def get_experiment_unionizes(eid, *a, **k):
+        calls.append(eid)
+        return pd.DataFrame(unionizes)
+
+    with mock.patch.object(mcc, "get_experiment_structure_unionizes",
+                           new=get_experiment_unionizes):
+        mcc.get_structure_unionizes([1, 2])
+        obtained = mcc.get_structure_unionizes([1, 2, 3],
+                                               hemisphere_ids=[2])
+
+    assert calls == [1, 2, 3]
+    assert obtained.shape[0] == 3
+    assert set(obtained["hemisphere_id"]) == {2}
+    assert np.array_equal(obtained.index.values, np.arange(3))
+
+
+def test_get_projection_matrix_unordered(mcc):
+
+    unionizes = pd.DataFrame({
+        'experiment_id': [2, 1, 2, 1],
+        'structure_id': [1, 2, 2, 1],
+        'hemisphere_id': [3, 3, 3, 3],
+        'value': [1.0, 2.0, 3.0, 4.0]})
+
+    class FakeTree(object):
+        def value_map(*a, **k):
+            return {1: 'one', 2: 'two'}
+
+    with mock.patch.object(mcc, "get_structure_unionizes",
+                           new=lambda *a, **k: unionizes), \
+            mock.patch.object(mcc, "get_structure_tree",
+                              new=lambda *a, **k: FakeTree()):
+        obtained = mcc.get_projection_matrix([1, 2, 5], [1, 2], [3], 'value')
+
+    expected = np.array([[4.0, 2.0], [1.0, 3.0], [np.nan, np.nan]])
+    assert np.allclose(obtained['matrix'], expected, equal_nan=True)
+    assert [c['label'] for c in obtained['columns']] == ['one', 'two']
+
+
 def test_get_projection_matrix(mcc):
     # yup
 
@@ -419,6 +500,81 @@ def test_get_projection_matrix(mcc):
                           ['two-L', 'two-R'])
 
 
+@pytest.mark.parametrize('num_workers', [1, 2])
+@pytest.mark.parametrize('use_data_mask', [False, True])
+def test_reduce_volumes(mcc, num_workers, use_data_mask):
+
+    nodes = [{'id': 1, 'structure_id_path': [1]},
+             {'id': 2, 'structure_id_path': [1, 2]},
+             {'id': 3, 'structure_id_path': [1, 3]},
+             {'id': 4, 'structure_id_path': [1, 2, 4]}]
+    tree = StructureTree(nodes)
+
+    annotation = np.zeros((6, 7, 8), dtype=np.uint32)
+    annotation[1:3] = 2
+    annotation[2, 2:5] = 4
+    annotation[4:, 3:] = 3
+
+    rng = np.random.default_rng(0)
+    volumes = {}
+    for eid in [10, 11, 12]:
+        density = rng.random(annotation.shape)
+        density[density < 0.5] = 0
+        mask = (rng.random(annotation.shape) > 0.2).astype(np.uint8)
+        volumes[eid] = {'projection_density': density, 'data_mask': mask}
+        for name, data in volumes[eid].items():
+            path = mcc.get_cache_path(
+                None, getattr(mcc, name.upper() + '_KEY'), eid,
+                mcc.resolution)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            nrrd.write(path, data)
+
+    with mock.patch.object(mcc, 'get_annotation_volume',
+                           new=lambda: (annotation, {})), \
+            mock.patch.object(mcc, 'get_structure_tree', new=lambda: tree), \
+            mock.patch.object(mcc.api, 'retrieve_file_over_http') \
+            as mock_rtrv:
+        obtained = mcc.reduce_volumes(
+            [12, 10], [1, 2, 3, 4],
+            reducers=['sum', 'mean', 'voxel_count', 'volume'],
+            threshold=0.75, use_data_mask=use_data_mask,
+            num_workers=num_workers)
+
+    mock_rtrv.assert_not_called()
+    voxel_volume = (mcc.resolution / 1000.0) ** 3
+    for eid in [12, 10]:
+        density = volumes[eid]['projection_density']
+        mask = volumes[eid]['data_mask'] > 0 if use_data_mask else \
+            np.ones(annotation.shape, dtype=bool)
+        for sid in [1, 2, 3, 4]:
+            in_structure = np.isin(
+                annotation, tree.descendant_ids([sid])[0]) & mask
+            values = density[in_structure]
+
+            assert np.isclose(obtained['sum'].loc[eid, sid], values.sum())
+            assert np.isclose(obtained['mean'].loc[eid, sid], values.mean())
+            assert obtained['voxel_count'].loc[eid, sid] == \
+                np.count_nonzero(values > 0.75)
+            assert np.isclose(obtained['volume'].loc[eid, sid],
+                              np.count_nonzero(values > 0.75) * voxel_volume)
+
+    assert obtained.index.tolist() == [12, 10]
+
+
+@pytest.mark.parametrize('chunk_voxels', [1, 40, 10 ** 6])
+def test_label_map_chunks(chunk_voxels):
+
+    annotation = np.random.default_rng(1).choice(
+        [0, 7, 3, 1000], size=(5, 6, 7)).astype(np.uint32)
+    label_map = LabelMap(annotation, chunk_voxels=chunk_voxels)
+
+    labels, label_index = np.unique(
+        np.ravel(annotation, order='F'), return_inverse=True)
+    assert np.array_equal(label_map.labels, labels)
+    assert label_map.label_index.dtype == np.int32
+    assert np.array_equal(label_map.label_index, label_index)
+
+
 def test_get_reference_space(mcc, new_nodes):
 
     tree = StructureTree(StructureTree.clean_structures(new_nodes))
@@ -241,3 +241,43 @@ def test_get_sweep_metadata(data_set):
     sweep_metadata = data_set.get_sweep_metadata(1)
 
     assert sweep_metadata is not None
+
+
+@pytest.fixture
+def sweep_nwb_file(tmpdir_factory):
+    import h5py
+
+    file_name = str(tmpdir_factory.mktemp("nwb").join("sweeps.nwb"))
+    with h5py.File(file_name, 'w') as f:
+        for sweep_number in [1, 2]:
+            sweep = f.create_group('epochs/Sweep_%d' % sweep_number)
+            for name in ['stimulus', 'response']:
+                ts = sweep.create_group('%s/timeseries' % name)
+                ts.create_dataset('data',
+                                  data=np.arange(10.0) * sweep_number)
+                ts.create_dataset('starting_time', data=0.0)
+                ts['starting_time'].attrs['rate'] = 1000.0
+            sweep['stimulus/idx_start'] = 0
+            sweep['stimulus/count'] = 10
+    return file_name
+
+
+def test_open_file_memoizes_sweeps(sweep_nwb_file):
+    import h5py
+
+    data_set = NwbDataSet(sweep_nwb_file)
+    expected = data_set.get_sweep(2)
+
+    with patch('h5py.File', wraps=h5py.File) as mock_file:
+        with data_set.open_file():
+            first = data_set.get_sweep(2)
+            assert data_set.get_sweep(2) is first
+            data_set.get_sweep(1)
+            with data_set.open_file():
+                assert data_set.get_sweep(2) is first
+
+    assert mock_file.call_count == 1
+    assert data_set._file is None
+    assert np.allclose(first['response'], expected['response'])
+    assert first['index_range'] == expected['index_range']
+    assert data_set.get_sweep(2) is not first
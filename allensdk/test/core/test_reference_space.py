@@ -128,6 +128,45 @@ def test_make_structure_mask_direct(rsp):
     assert( np.allclose(obt, exp) )
     
     
+@pytest.mark.parametrize('mask_format', ['sparse', 'run_length'])
+def test_make_structure_mask_formats(rsp, mask_format):
+
+    for structure_ids, direct_only in [([2, 3, 7], False), ([5], True), 
+                                       ([1], False), ([7], False)]:
+        exp = rsp.make_structure_mask(structure_ids, direct_only)
+        obt = rsp.make_structure_mask(structure_ids, direct_only, 
+                                      mask_format=mask_format)
+
+        assert( len(obt) == exp.sum() )
+        assert( np.array_equal(obt.to_dense(), exp) )
+
+
+def test_run_length_mask_roundtrip(rsp):
+
+    sparse = rsp.make_structure_mask([2, 3], mask_format='sparse')
+    runs = sparse.to_run_length()
+
+    assert( len(runs.starts) < len(sparse) )
+    assert( np.array_equal(runs.to_sparse().indices, sparse.indices) )
+
+
+def test_make_structure_mask_bad_format(rsp):
+
+    with pytest.raises(ValueError):
+        rsp.make_structure_mask([2], mask_format='foo')
+
+
+def test_structure_voxel_indices(rsp):
+
+    for stid in rsp.structure_tree.node_ids():
+        exp = np.flatnonzero(np.isin(
+            rsp.annotation, rsp.structure_tree.descendant_ids([stid])[0]))
+        obt = rsp.structure_voxel_indices([stid])
+
+        assert( np.array_equal(obt, exp) )
+        assert( len(obt) == rsp.total_voxel_map[stid] )
+
+
 def test_many_structure_masks(rsp):
 
     cb = mock.MagicMock()
@@ -35,6 +35,7 @@
 #
 import pytest
 import mock
+import numpy as np
 from numpy import allclose
 
 from allensdk.core.simple_tree import SimpleTree
@@ -136,6 +137,34 @@ def test_descendant_ids(tree):
     assert( set(obtained[1]) == set([3]) )
     
     
+def test_descendant_ids_order(tree):
+
+    exp = [[0, 1, 3, 4, 2, 5], [1, 3, 4], [5]]
+    assert( tree.descendant_ids([0, 1, 5]) == exp )
+
+
+@pytest.mark.parametrize('children,parents,exp', [
+    [[3, 4, 5, 0], [1], [True, True, False, False]],
+    [[5], [0, 1, 2, 5], [True, False, True, True]],
+    [[3, 2], [0, 4], [True, False]],
+    [[], [0], []],
+])
+def test_is_descendant(tree, children, parents, exp):
+
+    obt = tree.is_descendant(children, parents)
+    assert( obt.tolist() == exp )
+
+
+def test_is_descendant_matches_ancestors(tree):
+
+    ids = np.array(tree.node_ids())
+    obt = tree.is_descendant(ids[:, None], ids)
+
+    for ii, child in enumerate(ids):
+        ancestors = tree.ancestor_ids([child])[0]
+        assert( obt[ii].tolist() == [pid in ancestors for pid in ids] )
+
+
 def test_nodes(tree):
     
     obtained = tree.nodes([0, 1])
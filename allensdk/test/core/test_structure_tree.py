@@ -123,6 +123,12 @@ def test_structure_descends_from(tree):
     
     assert( tree.structure_descends_from(2, 0) )
     assert( not tree.structure_descends_from(0, 1) )
+
+
+@pytest.mark.parametrize('child_id,parent_id', [(2, 99), (99, 0), (98, 99)])
+def test_structure_descends_from_unknown(tree, child_id, parent_id):
+
+    assert( not tree.structure_descends_from(child_id, parent_id) )
     
     
 def test_has_overlaps(tree):
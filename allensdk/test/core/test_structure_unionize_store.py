@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from allensdk.core.structure_unionize_store import StructureUnionizeStore
+
+
+@pytest.fixture
+def store_path(tmpdir_factory):
+    return str(tmpdir_factory.mktemp("unionizes").join("unionizes.h5"))
+
+
+def make_unionizes(experiment_id, n):
+    return pd.DataFrame({
+        "experiment_id": [experiment_id] * n,
+        "structure_id": np.arange(n),
+        "hemisphere_id": [3] * n,
+        "is_injection": [False] * n,
+        "projection_density": np.linspace(0, 1, n),
+    })
+
+
+def test_store_roundtrip(store_path):
+    store = StructureUnionizeStore(store_path)
+    assert store.experiment_ids == set()
+
+    store.add_experiments({1: make_unionizes(1, 3), 2: make_unionizes(2, 2)})
+    assert store.has_experiment(1)
+    assert not store.has_experiment(3)
+
+    # a new instance discovers experiments already in the file
+    reopened = StructureUnionizeStore(store_path)
+    assert reopened.experiment_ids == {1, 2}
+
+    obtained = reopened.get_unionizes([2, 1])
+    expected = pd.concat([make_unionizes(2, 2), make_unionizes(1, 3)],
+                         ignore_index=True, sort=True)
+    pd.testing.assert_frame_equal(obtained, expected)
+
+
+def test_store_replace(store_path):
+    store = StructureUnionizeStore(store_path)
+    store.add_experiments({1: make_unionizes(1, 3)})
+    store.add_experiments({1: make_unionizes(1, 5)})
+
+    assert store.get_unionizes([1]).shape[0] == 5
@@ -0,0 +1,69 @@
+import os
+
+import mock
+import nrrd
+import numpy as np
+import pytest
+
+from allensdk.core.volume_cache import VolumeCache, memmap_path
+
+
+@pytest.fixture
+def volume_paths(tmpdir_factory):
+    tmpdir = tmpdir_factory.mktemp("volumes")
+    paths = []
+    for ii in range(3):
+        path = str(tmpdir.join("volume_{}.nrrd".format(ii)))
+        nrrd.write(path, np.arange(60, dtype=np.float32).reshape(3, 4, 5) + ii)
+        paths.append(path)
+    return paths
+
+
+def test_get(volume_paths):
+    cache = VolumeCache()
+    expected, expected_header = nrrd.read(volume_paths[0])
+
+    obtained, header = cache.get(volume_paths[0])
+
+    assert os.path.exists(memmap_path(volume_paths[0]))
+    assert isinstance(obtained, np.memmap)
+    assert not obtained.flags.writeable
+    assert obtained.shape == expected.shape
+    assert obtained.flags.f_contiguous == expected.flags.f_contiguous
+    assert np.array_equal(obtained, expected)
+    assert header["sizes"].tolist() == expected_header["sizes"].tolist()
+
+
+def test_get_converted(volume_paths):
+    VolumeCache().get(volume_paths[0])
+
+    loader = mock.MagicMock()
+    with mock.patch("nrrd.read") as mock_read:
+        obtained, _ = VolumeCache().get(volume_paths[0], loader=loader)
+
+    loader.assert_not_called()
+    mock_read.assert_not_called()
+    assert obtained[2, 3, 4] == 59
+
+
+def test_get_stale(volume_paths):
+    VolumeCache().get(volume_paths[0])
+    os.utime(memmap_path(volume_paths[0]), (0, 0))
+
+    obtained, _ = VolumeCache().get(volume_paths[0],
+                                    loader=lambda: nrrd.read(volume_paths[1]))
+    assert obtained[0, 0, 0] == 1
+
+
+def test_eviction(volume_paths):
+    cache = VolumeCache(max_volumes=2)
+
+    first, _ = cache.get(volume_paths[0])
+    cache.get(volume_paths[1])
+    assert cache.get(volume_paths[0])[0] is first
+
+    cache.get(volume_paths[2])
+    assert len(cache) == 2
+    assert cache.get(volume_paths[0])[0] is first
+    assert cache.get(volume_paths[1])[0] is not None
+    assert len(cache) == 2
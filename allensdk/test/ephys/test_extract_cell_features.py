@@ -0,0 +1,52 @@
+import mock
+import pytest
+
+import allensdk.ephys.extract_cell_features as ecf
+from allensdk.core.nwb_data_set import NwbDataSet
+
+
+@pytest.fixture
+def cell_types_cache():
+    sweeps = [
+        {"sweep_number": 1, "stimulus_name": "Test",
+         "stimulus_units": "Volts"},
+        {"sweep_number": 2, "stimulus_name": "Ramp",
+         "stimulus_units": "Amps"},
+        {"sweep_number": 3, "stimulus_name": "Long Square",
+         "stimulus_units": "Amps"},
+        {"sweep_number": 4, "stimulus_name": "Short Square",
+         "stimulus_units": "Amps"},
+        {"sweep_number": 5, "stimulus_name": "Long Square",
+         "stimulus_units": "Amps"},
+    ]
+
+    ctc = mock.MagicMock()
+    ctc.get_ephys_sweeps.return_value = sweeps
+    ctc.get_ephys_data.side_effect = \
+        lambda specimen_id: NwbDataSet("specimen_%d.nwb" % specimen_id)
+    return ctc
+
+
+def test_extract_specimen_features(cell_types_cache):
+
+    def cell_features(data_set, ramps, short_squares, long_squares):
+        if data_set.file_name == "specimen_2.nwb":
+            raise ecf.ft.FeatureError("Could not find hero sweep.")
+        return {"sweeps": (ramps, short_squares, long_squares)}
+
+    with mock.patch.object(NwbDataSet, "open_file") as open_file, \
+            mock.patch.object(ecf, "extract_sweep_features",
+                              side_effect=lambda ds, sbt: dict(sbt)), \
+            mock.patch.object(ecf, "extract_cell_features",
+                              side_effect=cell_features):
+        obtained = ecf.extract_specimen_features(cell_types_cache, [1, 2])
+
+    assert open_file.call_count == 2
+    assert obtained[1]["error"] is None
+    assert obtained[1]["sweep_features"] == {
+        "Ramp": [2], "Long Square": [3, 5], "Short Square": [4]}
+    assert obtained[1]["cell_features"]["sweeps"] == ([2], [4], [3, 5])
+
+    assert obtained[2]["sweep_features"] is not None
+    assert obtained[2]["cell_features"] is None
+    assert "hero sweep" in obtained[2]["error"]
@@ -38,6 +38,7 @@ import mock
 
 import pytest
 import numpy as np
+import pandas as pd
 from allensdk.ephys.ephys_extractor import EphysSweepSetFeatureExtractor, input_resistance
 import allensdk.ephys.ephys_extractor as ephys_extractor
 import os
@@ -137,6 +138,72 @@ def test_extractor_with_high_init_dvdt():
     assert np.allclose(sweep.spike_feature("threshold_index"), expected_thresh_ind)
 
 
+def test_extractor_filters_once_per_cutoff():
+    # Filtering dominates per-cell feature extraction time; each sweep should
+    # filter its voltage once per cutoff frequency, however many features use
+    # dV/dt
+    data = np.loadtxt(os.path.join(path, "data/spike_test_pair.txt"))
+    t = data[:, 0]
+    v = data[:, 1]
+
+    ext = EphysSweepSetFeatureExtractor([t, t, t], [v, v.copy(), v.copy()])
+    with mock.patch.object(ephys_extractor.ft, "calculate_dvdt",
+                           wraps=ephys_extractor.ft.calculate_dvdt) as calc:
+        ext.process_spikes()
+        ext.process_spikes()
+
+    assert calc.call_count == 2 * len(ext.sweeps())
+    assert sorted(set(c[0][2] for c in calc.call_args_list)) == \
+        [ephys_extractor.HEAVY_FILTER, 10.]
+
+
+def test_extractor_filters_detection_window():
+    # spikes are detected in dV/dt filtered over the detection window only,
+    # which differs from the whole-sweep dV/dt near the window edges
+    data = np.loadtxt(os.path.join(path, "data/spike_test_pair.txt"))
+    t = data[:, 0]
+    v = data[:, 1]
+
+    ext = EphysSweepSetFeatureExtractor([t], [v], start=t[100], end=t[-100])
+    with mock.patch.object(ephys_extractor.ft, "calculate_dvdt",
+                           wraps=ephys_extractor.ft.calculate_dvdt) as calc:
+        ext.process_spikes()
+
+    window_length = len(t) - 199
+    assert sorted(len(c[0][0]) for c in calc.call_args_list) == \
+        [window_length, len(t), len(t)]
+
+
+def test_extractor_dvdt_recomputed_for_new_voltage():
+    data = np.loadtxt(os.path.join(path, "data/spike_test_pair.txt"))
+    t = data[:, 0]
+    v = data[:, 1]
+
+    sweep = EphysSweepSetFeatureExtractor([t], [v]).sweeps()[0]
+    first = sweep.calculate_dvdt(10.)
+    assert sweep.calculate_dvdt(10.) is first
+
+    sweep.v = 2 * v
+    assert np.allclose(sweep.calculate_dvdt(10.), 2 * first)
+
+
+def test_extractor_process_spikes_parallel():
+    data = np.loadtxt(os.path.join(path, "data/spike_test_pair.txt"))
+    t = data[:, 0]
+    v = data[:, 1]
+
+    serial = EphysSweepSetFeatureExtractor([t, t], [v, v[::-1].copy()])
+    serial.process_spikes()
+    parallel = EphysSweepSetFeatureExtractor([t, t], [v, v[::-1].copy()])
+    parallel.process_spikes(num_workers=2)
+
+    for expected, obtained in zip(serial.sweeps(), parallel.sweeps()):
+        pd.testing.assert_frame_equal(expected._spikes_df,
+                                      obtained._spikes_df)
+        assert expected.sweep_feature("avg_rate") == \
+            obtained.sweep_feature("avg_rate")
+
+
 def test_extractor_input_resistance():
     t = np.arange(0, 1.0, 5e-6)
     v1 = np.ones_like(t) * -5.
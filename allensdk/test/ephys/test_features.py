@@ -99,6 +99,24 @@ def test_detect_two_spikes():
     assert np.allclose(ft.detect_putative_spikes(v, t), expected_spikes)
 
 
+def test_detect_spikes_in_window_with_dvdt():
+    data = np.loadtxt(os.path.join(path, "data/spike_test_pair.txt"))
+    t = data[:, 0]
+    v = data[:, 1]
+    dvdt = ft.calculate_dvdt(v, t, 10.)
+
+    # dV/dt is filtered over the window only, as without a precalculated
+    # dvdt, even though the edge of the window changes the result
+    expected_spikes = np.array([726, 3386])
+    assert np.array_equal(
+        ft.detect_putative_spikes(v, t, start=t[726], end=t[3400]),
+        expected_spikes)
+    assert np.array_equal(
+        ft.detect_putative_spikes(v, t, start=t[726], end=t[3400],
+                                  dvdt=dvdt),
+        expected_spikes)
+
+
 def test_detect_no_spikes():
     data = np.loadtxt(os.path.join(path, "data/spike_test_pair.txt"))
     t = data[:, 0]
@@ -266,3 +284,90 @@ def test_width_calculation_too_many_troughs():
 def test_width_calculation_with_burst():
     # example sp 487663469, sweep 43
     pass
+
+
+def _spike_train(n_spikes=40, seed=0):
+    # A fast-spiking sweep built from repeated copies of a recorded spike
+    data = np.loadtxt(os.path.join(path, "data/spike_test_pair.txt"))
+    spike_v = data[600:1400, 1]
+    rng = np.random.RandomState(seed)
+    v = np.concatenate([spike_v + rng.normal(0, 0.05, spike_v.size)
+                        for _ in range(n_spikes)])
+    t = np.arange(v.size) * (data[1, 0] - data[0, 0])
+    return v, t
+
+
+@pytest.mark.parametrize("arg_func, vectorized", [
+    (np.argmax, ft._segment_argmax),
+    (np.argmin, ft._segment_argmin),
+])
+def test_segment_arg_reduce_matches_loop(arg_func, vectorized):
+    x = np.array([3., 1., 3., 3., 0., 0., np.nan, 2., np.nan, 5., 5.])
+    starts = np.array([0, 2, 4, 5, 7, 9, 9])
+    stops = np.array([3, 4, 6, 9, 9, 11, 20])
+
+    expected = [arg_func(x[a:b]) + a for a, b in zip(starts, stops)]
+    assert np.array_equal(vectorized(x, starts, stops), expected)
+    assert len(vectorized(x, np.array([]), np.array([]))) == 0
+
+    with pytest.raises(ValueError):
+        vectorized(x, np.array([0, 3]), np.array([2, 3]))
+
+
+def test_segments_have_negative_matches_loop():
+    x = np.array([1., -1., 2., 0., -3., np.nan, 4.])
+    starts = np.array([0, 2, 2, 3, 5, 5, 6, 4])
+    stops = np.array([1, 2, 4, 5, 7, 20, 3, 5])
+
+    expected = [np.any(x[a:b] < 0) for a, b in zip(starts, stops)]
+    assert np.array_equal(ft._segments_have_negative(x, starts, stops),
+                          expected)
+
+
+@pytest.mark.parametrize("file_name", [
+    "spike_test_pair.txt", "spike_test_high_init_dvdt.txt",
+    "spike_test_var_dt.txt",
+])
+def test_spike_detection_stages_match_loops(file_name):
+    data = np.loadtxt(os.path.join(path, "data", file_name))
+    for v, t in [(data[:, 1], data[:, 0]), _spike_train()]:
+        dvdt = ft.calculate_dvdt(v, t, 10.)
+
+        putative = np.flatnonzero(
+            np.diff(np.greater_equal(dvdt, 20.).astype(int)) == 1)
+        expected = [putative[0]] + [s for i, s in enumerate(putative[1:])
+                                    if np.any(dvdt[putative[i]:s] < 0)]
+        spikes = ft.detect_putative_spikes(v, t, dvdt=dvdt)
+        assert np.array_equal(spikes, expected)
+
+        end_index = ft.find_time_index(t, t[-1])
+        bounds = np.append(spikes, end_index)
+        expected = [np.argmax(v[a:b]) + a
+                    for a, b in zip(bounds[:-1], bounds[1:])]
+        peaks = ft.find_peak_indexes(v, t, spikes)
+        assert np.array_equal(peaks, expected)
+
+        expected = [np.argmax(dvdt[a:b]) + a for a, b in zip(spikes, peaks)]
+        upstrokes = ft.find_upstroke_indexes(v, t, spikes, peaks, dvdt=dvdt)
+        assert np.array_equal(upstrokes, expected)
+
+        diff_mask = [np.any(dvdt[a:b] < 0)
+                     for a, b in zip(peaks[:-1], spikes[1:])]
+        filtered_spikes, filtered_peaks = ft.filter_putative_spikes(
+            v, t, spikes, peaks, dvdt=dvdt)
+        assert np.array_equal(filtered_spikes,
+                              spikes[np.array([True] + diff_mask)])
+        assert np.array_equal(filtered_peaks,
+                              peaks[np.array(diff_mask + [True])])
+
+        expected = [v[a:b].argmin() + a
+                    for a, b in zip(filtered_peaks[:-1], filtered_spikes[1:])]
+        troughs = ft.find_trough_indexes(v, t, filtered_spikes,
+                                         filtered_peaks)
+        assert np.array_equal(troughs[:-1], expected)
+
+        expected = [np.argmin(dvdt[a:b]) + a
+                    for a, b in zip(filtered_peaks, troughs.astype(int))]
+        downstrokes = ft.find_downstroke_indexes(v, t, filtered_peaks,
+                                                 troughs, dvdt=dvdt)
+        assert np.array_equal(downstrokes, expected)
@@ -0,0 +1,75 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from allensdk.internal.brain_observatory.mask_set import (
+    MaskSet, bb_dist, close_bb_pairs, make_bbs)
+
+
+def box(shape, rows, cols):
+    mask = np.zeros(shape, dtype=bool)
+    mask[rows[0]:rows[1], cols[0]:cols[1]] = True
+    return mask
+
+
+@pytest.fixture
+def masks():
+    shape = (40, 40)
+    left = box(shape, (5, 15), (5, 10))
+    right = box(shape, (5, 15), (10, 15))
+    union = box(shape, (5, 15), (5, 15))
+    duplicate = box(shape, (5, 15), (5, 9))
+    far = box(shape, (30, 35), (30, 35))
+    return np.array([left, right, union, duplicate, far])
+
+
+def test_make_bbs(masks):
+    bbs = make_bbs(masks)
+    np.testing.assert_array_equal(bbs[0], [[5, 14], [5, 9]])
+    np.testing.assert_array_equal(bbs[4], [[30, 34], [30, 34]])
+
+    with pytest.raises(ValueError):
+        make_bbs(np.zeros((1, 4, 4), dtype=bool))
+
+
+def test_close_bb_pairs():
+    np.random.seed(3)
+    starts = np.random.randint(0, 100, size=(60, 2))
+    extents = np.random.randint(0, 8, size=(60, 2))
+    bbs = np.stack([starts, starts + extents], axis=2)
+    dist = bb_dist(bbs)
+
+    for max_dist in (0, 2, 10):
+        expected = [(i, j) for i, j in itertools.combinations(range(60), 2)
+                    if dist[i, j] <= max_dist]
+        pairs = close_bb_pairs(bbs, max_dist)
+        assert list(map(tuple, pairs.tolist())) == expected
+
+
+def test_detect_duplicates(masks):
+    ms = MaskSet(masks)
+    assert ms.detect_duplicates(overlap_threshold=0.7) == {(0, 3)}
+    assert ms.overlap_fraction(0, 3) == pytest.approx(0.8)
+
+
+def test_detect_unions(masks):
+    ms = MaskSet(masks)
+    # the last matching set is kept
+    assert ms.detect_unions() == {2: (1, 3)}
+
+    ms = MaskSet(masks[[0, 1, 2, 4]])
+    assert ms.detect_unions() == {2: (0, 1)}
+
+
+def test_union_and_intersection(masks):
+    ms = MaskSet(masks)
+    np.testing.assert_array_equal(ms.union([0, 1]), masks[2])
+    np.testing.assert_array_equal(ms.intersection([0, 3]), masks[3])
+    assert not ms.intersection([0, 4]).any()
+    assert ms.union_size([0, 1, 3]) == masks[2].sum()
+    assert ms.intersection_size([0, 2, 3]) == masks[3].sum()
+    assert ms.size(4) == 25
+    # adjacent masks are a distance of 1 apart
+    assert list(ms.close_sets(2, 0)) == [(0, 2), (0, 3), (1, 2), (2, 3)]
+    assert list(ms.close_sets(3, 1)) == [(0, 1, 2), (0, 2, 3)]
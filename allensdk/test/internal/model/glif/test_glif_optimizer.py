@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+from allensdk.internal.model.glif.glif_optimizer import GlifOptimizer
+
+
+TARGET = np.array([1.5, 0.5])
+
+
+class FakeNeuron(object):
+    dt_multiplier = None
+
+
+class FakeExperiment(object):
+    def __init__(self):
+        self.neuron = FakeNeuron()
+        self.params = None
+
+    def neuron_parameter_count(self):
+        return len(TARGET)
+
+    def set_neuron_parameters(self, params):
+        self.params = params
+
+
+def quadratic_error(x, experiment, error_function_data):
+    error_function_data['calls'] += 1
+    return float(np.sum((np.asarray(x) - TARGET) ** 2)) * \
+        experiment.neuron.dt_multiplier
+
+
+def make_optimizer(num_workers=1, sigma_outer=0.3, cache_decimals=10):
+    return GlifOptimizer(experiment=FakeExperiment(), dt=5e-05,
+                         outer_iterations=3, inner_iterations=2,
+                         sigma_outer=sigma_outer, sigma_inner=0.1,
+                         param_fit_names=['a', 'b'], stim=None,
+                         xtol=1e-5, ftol=1e-5, internal_iterations=200,
+                         bessel=None, error_function=quadratic_error,
+                         error_function_data={'calls': 0},
+                         num_workers=num_workers,
+                         cache_decimals=cache_decimals)
+
+
+def without_timing(iteration_info):
+    return [{k: v for k, v in info.items() if k != 'time'}
+            for info in iteration_info]
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_run_many_deterministic(num_workers):
+    serial = make_optimizer()
+    best_params, _ = serial.run_many(seed=7)
+
+    optimizer = make_optimizer(num_workers=num_workers)
+    calls = []
+    parallel_best_params, _ = optimizer.run_many(
+        iteration_finished_callback=lambda opt, outer, inner:
+            calls.append((outer, inner)),
+        seed=7)
+
+    assert calls == [(outer, inner)
+                     for outer in range(3) for inner in range(2)]
+    assert without_timing(optimizer.iteration_info) == \
+        without_timing(serial.iteration_info)
+    assert parallel_best_params == best_params
+    assert optimizer.experiment.params == best_params
+    assert np.allclose(best_params, TARGET, atol=1e-3)
+    assert all(info['time'] >= 0 for info in optimizer.iteration_info)
+
+
+def test_error_cache():
+    # without outer randomization every outer iteration repeats the first one
+    optimizer = make_optimizer(sigma_outer=0.0)
+    optimizer.run_many(seed=1)
+    info = optimizer.iteration_info
+
+    assert info[0]['cache_hits'] < info[0]['evaluations']
+    assert info[2]['in_params'] == info[0]['in_params']
+    assert info[2]['cache_hits'] == info[2]['evaluations']
+    assert optimizer.error_function_data['calls'] == len(optimizer.error_cache)
+
+    uncached = make_optimizer(sigma_outer=0.0, cache_decimals=None)
+    uncached.run_many(seed=1)
+    assert without_timing(uncached.iteration_info)[0]['out_params'] == \
+        info[0]['out_params']
+    assert uncached.error_function_data['calls'] == \
+        sum(i['evaluations'] for i in info)
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_run_many_baseline_random_stream(num_workers):
+    optimizer = make_optimizer(num_workers=num_workers)
+    optimizer.run_many(seed=7)
+    info = optimizer.iteration_info
+
+    # parameters are randomized from one stream, in serial loop order
+    rng = np.random.RandomState(7)
+    for outer in range(3):
+        chain = info[2 * outer:2 * outer + 2]
+        if outer > 0:
+            expected = rng.normal(optimizer.init_params, 0.3)
+            assert np.array_equal(chain[0]['in_params'], expected)
+        expected = rng.normal(chain[0]['out_params'], 0.1)
+        assert np.array_equal(chain[1]['in_params'], expected)
+        rng.normal(chain[1]['out_params'], 0.1)
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_run_many_optimizer_state(num_workers):
+    dt_multipliers = []
+    optimizer = make_optimizer(num_workers=num_workers)
+    optimizer.run_many(
+        iteration_finished_callback=lambda opt, outer, inner:
+            dt_multipliers.append(opt.experiment.neuron.dt_multiplier),
+        seed=7)
+    info = optimizer.iteration_info
+
+    assert dt_multipliers == [100, 32] * 3
+    assert optimizer.experiment.neuron.dt_multiplier == 32
+    assert optimizer.evaluation_count == sum(i['evaluations'] for i in info)
+    assert optimizer.cache_hit_count == sum(i['cache_hits'] for i in info)
+    assert len(optimizer.error_cache) == \
+        optimizer.evaluation_count - optimizer.cache_hit_count
@@ -0,0 +1,136 @@
+import copy
+
+import numpy as np
+import pytest
+
+from allensdk.model.glif import glif_kernel
+from allensdk.model.glif.glif_neuron import GlifNeuron, run_batch
+
+
+BASE_CONFIG = {
+    'El': 0.0,
+    'dt': 5e-05,
+    'asc_tau_array': [0.01, 0.1],
+    'R_input': 2.0e8,
+    'C': 1.0e-10,
+    'asc_amp_array': [-2.0e-11, 5.0e-12],
+    'spike_cut_length': 20,
+    'th_inf': 0.02,
+    'th_adapt': None,
+    'coeffs': {'th_inf': 1.1, 'C': 1.0, 'G': 0.9, 'b': 1.0, 'a': 1.0,
+               'asc_amp_array': [1.0, 1.0]},
+    'init_voltage': 0.0,
+    'init_threshold': 0.02,
+    'init_AScurrents': [0.0, 0.0],
+    'AScurrent_dynamics_method': {'name': 'exp', 'params': {}},
+    'voltage_dynamics_method': {'name': 'linear_forward_euler', 'params': {}},
+    'threshold_dynamics_method': {'name': 'inf', 'params': {}},
+    'AScurrent_reset_method': {'name': 'sum', 'params': {'r': [1.0, 1.0]}},
+    'voltage_reset_method': {'name': 'v_before',
+                             'params': {'a': 0.3, 'b': 0.001}},
+    'threshold_reset_method': {'name': 'inf', 'params': {}},
+}
+
+THREE_COMPONENTS = {'a_spike': 0.002, 'b_spike': 200.0,
+                    'a_voltage': 5.0, 'b_voltage': 20.0}
+THREE_COMPONENTS_RESET = {'name': 'three_components',
+                          'params': {'a_spike': 0.002, 'b_spike': 200.0}}
+
+
+def make_config(**methods):
+    config = copy.deepcopy(BASE_CONFIG)
+    config.update(methods)
+    return config
+
+
+CONFIGS = {
+    'lif': make_config(
+        AScurrent_dynamics_method={'name': 'none', 'params': {}},
+        AScurrent_reset_method={'name': 'none', 'params': {}},
+        voltage_reset_method={'name': 'zero', 'params': {}},
+        init_AScurrents=[0.0, 0.0]),
+    'lif_r_asc': make_config(),
+    'lif_no_cut': make_config(spike_cut_length=0),
+    'lif_r_asc_a': make_config(
+        threshold_dynamics_method={'name': 'three_components_exact',
+                                   'params': THREE_COMPONENTS},
+        threshold_reset_method=THREE_COMPONENTS_RESET),
+    'spike_component': make_config(
+        spike_cut_length=0,
+        threshold_dynamics_method={'name': 'spike_component',
+                                   'params': THREE_COMPONENTS},
+        threshold_reset_method=THREE_COMPONENTS_RESET),
+    'bad_reset': make_config(
+        voltage_reset_method={'name': 'v_before',
+                              'params': {'a': 1.0, 'b': 0.05}}),
+}
+
+
+def stimulus(seed, num_time_steps=20000):
+    rng = np.random.RandomState(seed)
+    stim = np.zeros(num_time_steps)
+    on = slice(num_time_steps // 10, num_time_steps * 9 // 10)
+    stim[on] = 2.0e-10 + rng.normal(0, 5.0e-11, on.stop - on.start)
+    return stim
+
+
+def assert_outputs_equal(actual, expected):
+    assert set(actual) == set(expected)
+    for key in expected:
+        np.testing.assert_array_equal(actual[key], expected[key], err_msg=key)
+        assert actual[key].dtype == expected[key].dtype
+
+
+@pytest.mark.parametrize("name", sorted(CONFIGS))
+def test_kernel_matches_python_run(name):
+    neuron = GlifNeuron.from_dict(CONFIGS[name])
+    assert glif_kernel.supports(neuron)
+
+    stim = stimulus(0)
+    expected = neuron.run(stim, use_kernel=False)
+    actual = neuron.run(stim)
+
+    assert len(expected['spike_time_steps']) > 0
+    assert_outputs_equal(actual, expected)
+
+
+def test_kernel_lif_ascurrent_error():
+    config = make_config(
+        AScurrent_reset_method={'name': 'none', 'params': {}},
+        voltage_reset_method={'name': 'zero', 'params': {}},
+        init_AScurrents=[1.0e-12, 0.0])
+    neuron = GlifNeuron.from_dict(config)
+
+    with pytest.raises(Exception, match="AScurrents are not zero"):
+        neuron.run(stimulus(0))
+
+
+def test_kernel_not_supported():
+    neuron = GlifNeuron.from_dict(CONFIGS['lif_r_asc'])
+    neuron.voltage_dynamics_method = GlifNeuron.configure_method(
+        'custom',
+        lambda neuron, voltage_t0, AScurrents_t0, inj: voltage_t0, {})
+    assert not glif_kernel.supports(neuron)
+
+    output = neuron.run(stimulus(0))
+    assert np.all(output['voltage'] == 0.0)
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_run_batch(num_workers):
+    neurons = [GlifNeuron.from_dict(CONFIGS[name])
+               for name in ['lif', 'lif_r_asc_a']]
+    stim = stimulus(1, 5000)
+
+    outputs = run_batch(neurons, stim, num_workers=num_workers)
+    assert len(outputs) == 2
+    for neuron, output in zip(neurons, outputs):
+        assert_outputs_equal(output, neuron.run(stim, use_kernel=False))
+
+    stims = [stimulus(2, 5000), stimulus(3, 5000)]
+    outputs = run_batch(neurons[1], stims, num_workers=num_workers)
+    for stim, output in zip(stims, outputs):
+        assert_outputs_equal(output, neurons[1].run(stim, use_kernel=False))
+
+    with pytest.raises(ValueError):
+        run_batch(neurons, stims[:1] * 3)